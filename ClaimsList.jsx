@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { Link } from 'react-router-dom';
 import { toast } from 'react-toastify';
-import { claimsApi, patientsApi } from '../services/api';
+import { claimsApi, eventsApi, patientsApi } from '../services/api';
 
 const ClaimsList = () => {
   const [claims, setClaims] = useState([]);
@@ -14,6 +14,22 @@ const ClaimsList = () => {
     fetchData();
   }, []);
 
+  // Apply claim changes pushed by the server instead of refetching everything
+  useEffect(() => {
+    const unsubscribe = eventsApi.subscribe({ topics: 'claims' }, {
+      'claim.updated': ({ claim }) => setClaims(current => current.map(existing =>
+        existing.claim_id === claim.claim_id ? { ...existing, ...claim, provider: existing.provider } : existing
+      )),
+      'claim.deleted': ({ claim_id }) => setClaims(current => current.filter(existing => existing.claim_id !== claim_id)),
+      // New claims need their patient's name, and bulk changes touch many claims, so reload for those
+      'claim.created': () => fetchData(),
+      'claims.refreshed': () => fetchData(),
+      'policy.deleted': () => fetchData(),
+      lagged: () => fetchData(),
+    });
+    return unsubscribe;
+  }, []);
+
   const fetchData = async () => {
     try {
       // Get all patients
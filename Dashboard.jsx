@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { Link } from 'react-router-dom';
-import { patientsApi, claimsApi } from '../services/api';
+import { patientsApi, claimsApi, eventsApi } from '../services/api';
 import { useAuth } from '../AuthContext';
 
 const Dashboard = () => {
@@ -53,6 +53,37 @@ const Dashboard = () => {
     fetchData();
   }, [userRole]);
 
+  // Keep the recent claims and their count current, including the first claim of a patient without any yet
+  const claimsPatientId = recentPatients[0]?.patient_id;
+  useEffect(() => {
+    if (userRole !== 'insurance' || claimsPatientId === undefined) {
+      return undefined;
+    }
+    return eventsApi.subscribe({ patient_id: claimsPatientId }, {
+      'claim.created': ({ claim }) => {
+        setRecentClaims(current => [...current, claim]);
+        setStats(current => ({ ...current, claimCount: current.claimCount + 1 }));
+      },
+      'claim.updated': ({ claim }) => setRecentClaims(current => current.map(existing =>
+        existing.claim_id === claim.claim_id ? { ...existing, ...claim, provider: existing.provider } : existing
+      )),
+      'claim.deleted': ({ claim_id }) => {
+        setRecentClaims(current => current.filter(existing => existing.claim_id !== claim_id));
+        setStats(current => ({ ...current, claimCount: Math.max(current.claimCount - 1, 0) }));
+      },
+      // Events were dropped (slow client, or the server restarted), so reload the claims instead
+      lagged: async () => {
+        try {
+          const claimsRes = await claimsApi.getForPatient(claimsPatientId);
+          setRecentClaims(claimsRes.data);
+          setStats(current => ({ ...current, claimCount: claimsRes.data.length }));
+        } catch (error) {
+          console.error('Error refreshing dashboard claims:', error);
+        }
+      },
+    });
+  }, [userRole, claimsPatientId]);
+
   if (loading) {
     return <div className="loading-spinner"></div>;
   }
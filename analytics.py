@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import queries
+from database import get_sql_connection, Neo4jConnection
+
+# How long an analytics result is served before it is recomputed
+ANALYTICS_TTL_SECONDS = float(os.getenv("ANALYTICS_TTL_SECONDS", "300"))
+
+# Server-side time budget for a single analytics refresh query
+ANALYTICS_QUERY_TIMEOUT = float(os.getenv("ANALYTICS_QUERY_TIMEOUT", "30"))
+
+# Upper bound on distinct parameter combinations kept in memory
+ANALYTICS_CACHE_SIZE = 128
+
+
+class AnalyticsCache:
+    """TTL cache that serves stale results while a single refresh per key is running."""
+
+    def __init__(self, ttl=ANALYTICS_TTL_SECONDS, max_entries=ANALYTICS_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._refreshing = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                value, expires_at = entry
+                if time.monotonic() < expires_at:
+                    return value
+            refresh_lock = self._refreshing.setdefault(key, threading.Lock())
+
+        # Only one caller recomputes a key; the others get the stale value if there is one
+        if not refresh_lock.acquire(blocking=entry is None):
+            return entry[0]
+        try:
+            with self._lock:
+                current = self._entries.get(key)
+            if current is not None and time.monotonic() < current[1]:
+                return current[0]
+
+            value = compute()
+            with self._lock:
+                self._entries[key] = (value, time.monotonic() + self.ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    evicted, _ = self._entries.popitem(last=False)
+                    self._refreshing.pop(evicted, None)
+            return value
+        finally:
+            refresh_lock.release()
+
+    def invalidate(self):
+        # Expire everything but keep the values so readers are not blocked by the next refresh
+        with self._lock:
+            for key, (value, _) in self._entries.items():
+                self._entries[key] = (value, 0.0)
+
+
+cache = AnalyticsCache()
+
+
+# Called by claim and policy writes
+def invalidate():
+    cache.invalidate()
+
+
+def _query_graph(query, parameters=None):
+    neo4j_conn = Neo4jConnection()
+    try:
+        return neo4j_conn.query(query, parameters, timeout=ANALYTICS_QUERY_TIMEOUT) or []
+    finally:
+        neo4j_conn.close()
+
+
+# ----- PROVIDERS -----
+
+TOP_PROVIDERS_QUERY = queries.cypher("analytics.top_providers", """
+MATCH (c:Claim)-[:FILED_UNDER]->(p:InsurancePolicy)
+WITH p.provider AS provider, count(c) AS claim_count, sum(c.amount) AS total_amount,
+     count(DISTINCT p) AS policy_count
+RETURN provider, claim_count, total_amount, policy_count
+ORDER BY total_amount DESC
+LIMIT $limit
+""")
+
+
+def _compute_top_providers(limit):
+    rows = _query_graph(TOP_PROVIDERS_QUERY, {"limit": limit})
+    return [
+        {
+            "provider": row["provider"],
+            "claim_count": row["claim_count"],
+            "policy_count": row["policy_count"],
+            "total_amount": float(row["total_amount"] or 0)
+        }
+        for row in rows
+    ]
+
+
+def top_providers(limit=20):
+    return cache.get(("providers", limit), lambda: _compute_top_providers(limit))
+
+
+# ----- ANOMALOUS CLAIM FREQUENCY -----
+
+# Distribution of claims per patient, aggregated without collecting rows
+CLAIM_COUNT_STATS_QUERY = queries.cypher("analytics.claim_count_stats", """
+MATCH (c:Claim)-[:FILED_UNDER]->(p:InsurancePolicy)
+WITH p.patient_id AS patient_id, count(c) AS claim_count
+RETURN avg(claim_count) AS mean, stDev(claim_count) AS stdev, count(*) AS patients
+""")
+
+HIGH_CLAIM_PATIENTS_QUERY = queries.cypher("analytics.high_claim_patients", """
+MATCH (c:Claim)-[:FILED_UNDER]->(p:InsurancePolicy)
+WITH p.patient_id AS patient_id, count(c) AS claim_count, sum(c.amount) AS total_amount
+WHERE claim_count >= $min_count
+RETURN patient_id, claim_count, total_amount
+ORDER BY claim_count DESC
+LIMIT $limit
+""")
+
+
+def _compute_anomalous_patients(z_threshold, limit):
+    # First pass: distribution of claims per patient
+    stats = _query_graph(CLAIM_COUNT_STATS_QUERY)
+    if not stats or not stats[0]["stdev"]:
+        return []
+    mean, stdev = stats[0]["mean"], stats[0]["stdev"]
+
+    # Second pass: only patients above the cut-off are returned
+    rows = _query_graph(HIGH_CLAIM_PATIENTS_QUERY, {"min_count": mean + z_threshold * stdev, "limit": limit})
+    return [
+        {
+            "patient_id": row["patient_id"],
+            "claim_count": row["claim_count"],
+            "total_amount": float(row["total_amount"] or 0),
+            "z_score": round((row["claim_count"] - mean) / stdev, 3)
+        }
+        for row in rows
+    ]
+
+
+def anomalous_patients(z_threshold=2.0, limit=50):
+    return cache.get(("anomalous", z_threshold, limit),
+                     lambda: _compute_anomalous_patients(z_threshold, limit))
+
+
+# ----- SHARED DOCTOR / DIAGNOSIS CLUSTERS -----
+
+# Largest groups of distinct patients seen by the same doctor for the same diagnosis
+CARE_CLUSTERS_QUERY = queries.sql("analytics.care_clusters", """
+WITH clusters AS (
+    SELECT TOP (?) m.doctor_id, m.diagnosis, COUNT(DISTINCT m.patient_id) AS patient_count
+    FROM MedicalRecords m
+    GROUP BY m.doctor_id, m.diagnosis
+    HAVING COUNT(DISTINCT m.patient_id) >= ?
+    ORDER BY patient_count DESC
+)
+SELECT c.doctor_id, d.first_name, d.last_name, d.specialization, c.diagnosis,
+       c.patient_count, m.record_id
+FROM clusters c
+JOIN Doctors d ON d.doctor_id = c.doctor_id
+JOIN MedicalRecords m ON m.doctor_id = c.doctor_id AND m.diagnosis = c.diagnosis
+""")
+
+CLUSTER_CLAIM_TOTALS_QUERY = queries.cypher("analytics.cluster_claim_totals", """
+UNWIND $record_ids AS record_id
+MATCH (c:Claim {record_id: record_id})
+RETURN record_id, count(c) AS claim_count, sum(c.amount) AS total_amount
+""")
+
+
+def _compute_care_clusters(min_patients, limit):
+    conn = get_sql_connection()
+    cursor = conn.cursor()
+    cursor.execute(CARE_CLUSTERS_QUERY, (limit, min_patients))
+
+    clusters = {}
+    record_cluster = {}
+    for doctor_id, first_name, last_name, specialization, diagnosis, patient_count, record_id in cursor.fetchall():
+        key = (doctor_id, diagnosis)
+        if key not in clusters:
+            clusters[key] = {
+                "doctor_id": doctor_id,
+                "doctor_name": f"{first_name} {last_name}",
+                "specialization": specialization,
+                "diagnosis": diagnosis,
+                "patient_count": patient_count,
+                "record_count": 0,
+                "claim_count": 0,
+                "total_claim_amount": 0.0
+            }
+        clusters[key]["record_count"] += 1
+        record_cluster[record_id] = key
+
+    cursor.close()
+    conn.close()
+
+    if not record_cluster:
+        return []
+
+    # Claim totals for the member records in one UNWIND round trip
+    rows = _query_graph(CLUSTER_CLAIM_TOTALS_QUERY, {"record_ids": list(record_cluster)})
+    for row in rows:
+        cluster = clusters[record_cluster[row["record_id"]]]
+        cluster["claim_count"] += row["claim_count"]
+        cluster["total_claim_amount"] += float(row["total_amount"] or 0)
+
+    return sorted(clusters.values(), key=lambda c: (c["patient_count"], c["total_claim_amount"]), reverse=True)
+
+
+def care_clusters(min_patients=2, limit=20):
+    return cache.get(("clusters", min_patients, limit), lambda: _compute_care_clusters(min_patients, limit))
@@ -12,6 +12,25 @@ const api = axios.create({
   },
 });
 
+// Read-your-writes: the server hands out a session token after writes, and reads that send it
+// back are only served by database replicas that already have those writes
+let sessionToken = null;
+
+api.interceptors.request.use((config) => {
+  if (sessionToken) {
+    config.headers['X-Session-Token'] = sessionToken;
+  }
+  return config;
+});
+
+api.interceptors.response.use((response) => {
+  const token = response.headers['x-session-token'];
+  if (token) {
+    sessionToken = token;
+  }
+  return response;
+});
+
 // Handle API errors consistently
 const handleApiError = (error) => {
   console.error('API Error:', error);
@@ -36,8 +55,11 @@ const handleApiError = (error) => {
 export const patientsApi = {
   getAll: () => api.get('/patients/').catch(handleApiError),
   getById: (id) => api.get(`/patients/${id}`).catch(handleApiError),
-  getComplete: (id) => api.get(`/patients/${id}/complete`).catch(handleApiError),
-  getMedicalRecords: (id) => api.get(`/patients/${id}/medical_records`).catch(handleApiError),
+  // Records come back as headers; the patient form also shows each record's treatment
+  getComplete: (id) => api.get(`/patients/${id}/complete`, { params: { include: 'treatment' } }).catch(handleApiError),
+  getMedicalRecords: (id, include) => api.get(`/patients/${id}/medical_records`, { params: { include } }).catch(handleApiError),
+  getTimeline: (id, params) => api.get(`/patients/${id}/timeline`, { params }).catch(handleApiError),
+  batchGet: (ids) => api.post('/patients:batchGet', { ids }).catch(handleApiError),
   create: (data) => api.post('/patients/', data).catch(handleApiError),
   update: (id, data) => api.put(`/patients/${id}`, data).catch(handleApiError),
   delete: (id) => api.delete(`/patients/${id}`).catch(handleApiError),
@@ -46,6 +68,8 @@ export const patientsApi = {
 // Medical Records API functions
 export const medicalRecordsApi = {
   getById: (id) => api.get(`/medical_records/${id}`).catch(handleApiError),
+  getText: (id, fields = 'treatment,notes') => api.get(`/medical_records/${id}/text`, { params: { fields } }).catch(handleApiError),
+  batchGet: (ids) => api.post('/medical_records:batchGet', { ids }).catch(handleApiError),
   create: (data) => api.post('/medical_records/', data).catch(handleApiError),
   update: (id, data) => api.put(`/medical_records/${id}`, data).catch(handleApiError),
   delete: (id) => api.delete(`/medical_records/${id}`).catch(handleApiError),
@@ -55,6 +79,7 @@ export const medicalRecordsApi = {
 export const policiesApi = {
   getForPatient: (patientId) => api.get(`/patients/${patientId}/insurance_policies`).catch(handleApiError),
   getById: (id) => api.get(`/insurance_policies/${id}`).catch(handleApiError),
+  batchGet: (ids) => api.post('/insurance_policies:batchGet', { ids }).catch(handleApiError),
   create: (data) => api.post('/insurance_policies/', data).catch(handleApiError),
   update: (id, data) => api.put(`/insurance_policies/${id}`, data).catch(handleApiError),
   delete: (id) => api.delete(`/insurance_policies/${id}`).catch(handleApiError),
@@ -62,14 +87,38 @@ export const policiesApi = {
 
 // Claims API functions
 export const claimsApi = {
+  // params: { start, end, status, limit, cursor }; pass back next_cursor for the following page
+  list: (params) => api.get('/claims/', { params }).catch(handleApiError),
   getForPatient: (patientId) => api.get(`/patients/${patientId}/claims`).catch(handleApiError),
   getById: (id) => api.get(`/claims/${id}`).catch(handleApiError),
+  batchGet: (ids) => api.post('/claims:batchGet', { ids }).catch(handleApiError),
   getComplete: (id) => api.get(`/claims/${id}/complete`).catch(handleApiError),
   create: (data) => api.post('/claims/', data).catch(handleApiError),
   update: (id, data) => api.put(`/claims/${id}`, data).catch(handleApiError),
   delete: (id) => api.delete(`/claims/${id}`).catch(handleApiError),
 };
 
+// Federated search across patients, medical records and claims
+export const searchApi = {
+  search: (q, limit = 20) => api.get('/search', { params: { q, limit } }).catch(handleApiError),
+};
+
+// Server-Sent Events for claim and policy changes
+export const eventsApi = {
+  // params: { patient_id, policy_id, topics }; handlers map event types (claim.updated, lagged, ...) to callbacks.
+  // Returns a function that closes the stream; the browser reconnects and resumes by itself until then.
+  subscribe: (params, handlers) => {
+    const query = new URLSearchParams(
+      Object.entries(params || {}).filter(([, value]) => value !== undefined && value !== null)
+    ).toString();
+    const source = new EventSource(`${API_URL}/events${query ? `?${query}` : ''}`);
+    Object.entries(handlers).forEach(([type, handler]) => {
+      source.addEventListener(type, (event) => handler(JSON.parse(event.data)));
+    });
+    return () => source.close();
+  },
+};
+
 // Debug helper for testing backend fixes
 export const debugApi = {
   getDashboardDebug: () => api.get('/dashboard/debug').catch(handleApiError),
@@ -0,0 +1,284 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from metrics import metrics
+from ratelimit import current_client
+
+# Append-only audit log (one JSON line per event, one file per UTC day and worker process) and the index over it
+AUDIT_DIR = os.getenv("AUDIT_DIR", "audit")
+
+# Events held in memory for the writer; past this the oldest are dropped, and the log records the gap
+AUDIT_BUFFER_SIZE = int(os.getenv("AUDIT_BUFFER_SIZE", "50000"))
+
+# How often the writer flushes; each flush is one fsync however many events it writes
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "0.2"))
+
+# Queued events that wake the writer before its next scheduled flush
+AUDIT_BATCH_SIZE = 1000
+
+ENTITY_TYPES = ("patient", "medical_record", "insurance_policy", "claim")
+
+INDEX_FILE = "audit_index.sqlite3"
+
+# The index only locates events in the log, so it can always be rebuilt from the log. Every worker
+# appends to its own segments and shares the index, which numbers the events as they are indexed.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS audit_index (
+    event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    entity_type TEXT NOT NULL,
+    entity_id TEXT NOT NULL,
+    at REAL NOT NULL,
+    segment TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_audit_entity ON audit_index (entity_type, entity_id, event_id);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_audit_location ON audit_index (segment, position);
+"""
+
+INDEX_COLUMNS = "(entity_type, entity_id, at, segment, position, length)"
+
+
+def _encode(event):
+    at, actor, action, entity_type, entity_id, fields = event
+    return (json.dumps({
+        "at": at, "actor": actor, "action": action,
+        "entity_type": entity_type, "entity_id": entity_id, "fields": list(fields)
+    }, separators=(",", ":")) + "\n").encode()
+
+
+class AuditLog:
+    """Audit events queued in memory by the routes and written in batches by a background thread."""
+
+    def __init__(self, directory=AUDIT_DIR, buffer_size=AUDIT_BUFFER_SIZE, flush_seconds=AUDIT_FLUSH_SECONDS):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        # (at, actor, action, entity_type, entity_id, field names); values are never logged, only which fields
+        self._buffer = deque(maxlen=buffer_size)
+        self.dropped = 0
+        self.written = 0
+        self._segment_suffix = f".{os.getpid()}.jsonl"
+        self._index = None
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record(self, action, entity_type, entity_id, fields=()):
+        """Queue one event and return at once; the writer has it on disk within AUDIT_FLUSH_SECONDS."""
+        buffer = self._buffer
+        if len(buffer) == buffer.maxlen:
+            self.dropped += 1
+            metrics.increment("audit.dropped")
+        buffer.append((time.time(), current_client.get(), action, entity_type, str(entity_id), tuple(fields)))
+        if len(buffer) == AUDIT_BATCH_SIZE:
+            self._wake.set()
+
+    def record_many(self, action, entity_type, entity_ids, fields=()):
+        """Queue the same change to many entities (a bulk operation), one event each."""
+        at, actor, fields = time.time(), current_client.get(), tuple(fields)
+        buffer = self._buffer
+        for entity_id in entity_ids:
+            if len(buffer) == buffer.maxlen:
+                self.dropped += 1
+                metrics.increment("audit.dropped")
+            buffer.append((at, actor, action, entity_type, str(entity_id), fields))
+        if len(buffer) >= AUDIT_BATCH_SIZE:
+            self._wake.set()
+
+    # ----- WRITER -----
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, segment)
+
+    def _open_index(self):
+        if self._index is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._index = sqlite3.connect(os.path.join(self.directory, INDEX_FILE), timeout=30,
+                                          check_same_thread=False)
+            self._index.execute("PRAGMA journal_mode=WAL")
+            self._index.executescript(SCHEMA)
+            self._recover()
+        return self._index
+
+    def _recover(self):
+        """Index log lines written before a crash stopped their index rows, and cut off a torn last line.
+
+        Segments of worker processes still running are theirs to index, and are left alone.
+        """
+        # SQLite returns the length of the row holding the largest position
+        indexed = dict(self._index.execute(
+            "SELECT segment, MAX(position) + length FROM audit_index GROUP BY segment"
+        ).fetchall())
+        rows = []
+        for segment in sorted(os.listdir(self.directory)):
+            if not segment.endswith(".jsonl") or _writer_running(segment):
+                continue
+            offset = indexed.get(segment, 0)
+            with open(self._segment_path(segment), "rb+") as f:
+                f.seek(offset)
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        event = None
+                    if event is None or not line.endswith(b"\n"):
+                        f.truncate(offset)
+                        print(f"Audit log {segment}: dropped a partial line at byte {offset}")
+                        break
+                    rows.append((event["entity_type"], event["entity_id"], event["at"], segment, offset, len(line)))
+                    offset += len(line)
+        if rows:
+            # Another worker starting at the same time may be recovering the same segment
+            self._index.executemany(f"INSERT OR IGNORE INTO audit_index {INDEX_COLUMNS} VALUES (?, ?, ?, ?, ?, ?)",
+                                    rows)
+            self._index.commit()
+            print(f"Audit log: indexed {len(rows)} event(s) missing from the index")
+
+    def flush(self):
+        """Write everything queued so far: the log lines, one fsync, then their index rows."""
+        with self._write_lock:
+            index = self._open_index()
+            batch = []
+            while True:
+                try:
+                    batch.append(self._buffer.popleft())
+                except IndexError:
+                    break
+            dropped, self.dropped = self.dropped, 0
+            if dropped:
+                batch.insert(0, (time.time(), None, "audit.dropped", "audit", str(dropped), ()))
+            if not batch:
+                return 0
+
+            started = time.perf_counter()
+            rows = []
+            segment = time.strftime("%Y-%m-%d", time.gmtime(batch[0][0])) + self._segment_suffix
+            with open(self._segment_path(segment), "ab") as f:
+                start = offset = f.tell()
+                lines = []
+                for event in batch:
+                    line = _encode(event)
+                    rows.append((event[3], event[4], event[0], segment, offset, len(line)))
+                    lines.append(line)
+                    offset += len(line)
+                try:
+                    f.write(b"".join(lines))
+                    f.flush()
+                    os.fsync(f.fileno())
+                except OSError:
+                    # Put the batch back for the next flush, without leaving part of it in the log
+                    f.truncate(start)
+                    self._requeue(batch[1:] if dropped else batch, dropped)
+                    raise
+            try:
+                index.executemany(f"INSERT INTO audit_index {INDEX_COLUMNS} VALUES (?, ?, ?, ?, ?, ?)", rows)
+                index.commit()
+            except sqlite3.Error:
+                # The events are in the log; reopening the index indexes them from there
+                index.close()
+                self._index = None
+                raise
+            self.written += len(batch)
+            metrics.increment("audit.written", len(batch))
+            metrics.observe("audit.flush", time.perf_counter() - started)
+            return len(batch)
+
+    def _requeue(self, events, dropped):
+        # Ahead of what was queued meanwhile; as in record(), the oldest events give way when that is too many
+        overflow = max(len(events) + len(self._buffer) - self._buffer.maxlen, 0)
+        if overflow:
+            metrics.increment("audit.dropped", overflow)
+        self.dropped += dropped + overflow
+        self._buffer.extendleft(reversed(events[overflow:]))
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Audit log flush failed: {e}")
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the writer and write whatever is still queued."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_seconds + 5)
+            self._thread = None
+        self.flush()
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+
+    # ----- QUERIES -----
+
+    def history(self, entity_type, entity_id, limit=100, before=None):
+        """An entity's events, newest first: those still queued, then written ones located via the index."""
+        entity_id = str(entity_id)
+        events = []
+        if before is None:
+            # Copied in one step, so the writer can keep draining while this filters
+            for at, actor, action, event_type, event_entity_id, fields in reversed(list(self._buffer)):
+                if event_type == entity_type and event_entity_id == entity_id:
+                    events.append({"event_id": None, "at": at, "actor": actor, "action": action,
+                                   "entity_type": entity_type, "entity_id": entity_id, "fields": list(fields)})
+        remaining = limit - len(events)
+        if remaining <= 0:
+            return events[:limit]
+
+        path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(path):
+            return events
+        conn = sqlite3.connect(path)
+        rows = conn.execute("""
+        SELECT event_id, segment, position, length FROM audit_index
+        WHERE entity_type = ? AND entity_id = ? AND event_id < ?
+        ORDER BY event_id DESC LIMIT ?
+        """, (entity_type, entity_id, before if before is not None else 2 ** 62, remaining)).fetchall()
+        conn.close()
+
+        files = {}
+        try:
+            for event_id, segment, offset, length in rows:
+                if segment not in files:
+                    files[segment] = open(self._segment_path(segment), "rb")
+                f = files[segment]
+                f.seek(offset)
+                events.append({**json.loads(f.read(length)), "event_id": event_id})
+        finally:
+            for f in files.values():
+                f.close()
+        return events
+
+    def snapshot(self):
+        return {"queued": len(self._buffer), "dropped": self.dropped, "written": self.written}
+
+
+# "2024-05-01.1234.jsonl" -> whether worker process 1234 is still running (and so still writing it)
+def _writer_running(segment):
+    parts = segment.split(".")
+    if len(parts) != 3 or not parts[1].isdigit() or int(parts[1]) == os.getpid():
+        return False
+    try:
+        os.kill(int(parts[1]), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Running, under another user
+        return True
+    return True
+
+
+log = AuditLog()
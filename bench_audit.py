@@ -0,0 +1,66 @@
+"""Cost an audit event adds to a write: queueing it for the background writer versus a synchronous insert."""
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import audit
+
+QUEUED_EVENTS = 100_000
+SYNC_EVENTS = 500
+FIELDS = ("address", "date_of_birth", "email", "first_name", "gender", "last_name", "phone")
+
+
+# What a route pays per write with the audit pipeline: one tuple appended to the ring buffer
+def time_record(log):
+    started = time.perf_counter()
+    for i in range(QUEUED_EVENTS):
+        log.record("patient.updated", "patient", i, FIELDS)
+    return (time.perf_counter() - started) / QUEUED_EVENTS
+
+
+# The writer's side: log lines, one fsync and the index rows for everything queued
+def time_flush(log):
+    started = time.perf_counter()
+    written = log.flush()
+    return (time.perf_counter() - started) / written, written
+
+
+# The alternative: an audit row inserted and committed (fsynced) inside every write request
+def time_synchronous(directory):
+    conn = sqlite3.connect(os.path.join(directory, "sync_audit.sqlite3"), isolation_level=None)
+    conn.execute("PRAGMA synchronous=FULL")
+    conn.execute("CREATE TABLE audit (at REAL, action TEXT, entity_type TEXT, entity_id TEXT, fields TEXT)")
+    timings = []
+    for i in range(SYNC_EVENTS):
+        started = time.perf_counter()
+        conn.execute("INSERT INTO audit VALUES (?, ?, ?, ?, ?)",
+                     (time.time(), "patient.updated", "patient", str(i), ",".join(FIELDS)))
+        timings.append(time.perf_counter() - started)
+    conn.close()
+    return statistics.median(timings), statistics.quantiles(timings, n=100)[98]
+
+
+def time_history(log):
+    started = time.perf_counter()
+    for i in range(1000):
+        log.history("patient", i * 97, limit=10)
+    return (time.perf_counter() - started) / 1000
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        log = audit.AuditLog(directory, buffer_size=QUEUED_EVENTS)
+        queued = time_record(log)
+        flushed, written = time_flush(log)
+        history = time_history(log)
+        sync_median, sync_p99 = time_synchronous(directory)
+        log.stop()
+
+    print("Audit overhead per write")
+    print(f"  {'queued (audit.record)':<34}{queued * 1e6:>10.2f} us")
+    print(f"  {'synchronous insert, median':<34}{sync_median * 1e6:>10.2f} us")
+    print(f"  {'synchronous insert, p99':<34}{sync_p99 * 1e6:>10.2f} us")
+    print(f"  {'background writer per event':<34}{flushed * 1e6:>10.2f} us  ({written} events, 1 fsync)")
+    print(f"  {'history lookup (index + log)':<34}{history * 1e6:>10.2f} us")
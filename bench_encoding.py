@@ -0,0 +1,105 @@
+"""Bytes on the wire and serialization CPU per 10k rows for each response encoding."""
+import random
+import string
+import sys
+import time
+from datetime import date, timedelta
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+import serialization
+from compression import CODERS
+from models import Claim, MedicalRecord, Patient
+
+ROWS = 10_000
+REPEAT = 3
+
+
+# A fixed vocabulary, so generated notes compress roughly like real clinical text rather than random letters
+_VOCABULARY_RNG = random.Random(0)
+VOCABULARY = ["".join(_VOCABULARY_RNG.choices(string.ascii_lowercase, k=_VOCABULARY_RNG.randint(2, 10)))
+              for _ in range(3000)]
+
+
+def _text(rng, words):
+    return " ".join(rng.choices(VOCABULARY, k=words))
+
+
+def make_rows(kind, n=ROWS, seed=42):
+    rng = random.Random(seed)
+    diagnoses = ["Hypertension", "Type 2 Diabetes", "Asthma", "Migraine", "Influenza", "Back Pain"]
+    rows = []
+    for i in range(1, n + 1):
+        if kind == "patients":
+            rows.append(Patient(
+                patient_id=i, first_name=_text(rng, 1).title(), last_name=_text(rng, 1).title(),
+                date_of_birth=date(1940, 1, 1) + timedelta(days=rng.randint(0, 25000)),
+                gender=rng.choice(["Male", "Female"]), address=f"{rng.randint(1, 999)} {_text(rng, 2)} St",
+                phone=f"555-{rng.randint(1000, 9999)}", email=f"user{i}@example.com"
+            ))
+        elif kind == "medical_records":
+            # Notes and treatments are VARCHAR(MAX) and dominate the payload
+            rows.append(MedicalRecord(
+                record_id=i, patient_id=rng.randint(1, n // 4), doctor_id=rng.randint(1, 50),
+                diagnosis=rng.choice(diagnoses), treatment=_text(rng, rng.randint(20, 80)),
+                notes=_text(rng, rng.randint(40, 160)),
+                record_date=str(date(2020, 1, 1) + timedelta(days=rng.randint(0, 1500)))
+            ))
+        else:
+            rows.append(Claim(
+                claim_id=f"CLM{i:06d}", policy_id=f"POL{rng.randint(1, n // 4):05d}", record_id=i,
+                claim_date=str(date(2020, 1, 1) + timedelta(days=rng.randint(0, 1500))),
+                amount=round(rng.uniform(50, 20000), 2), status=rng.choice(["Pending", "Approved", "Denied"]),
+                description=_text(rng, rng.randint(5, 25))
+            ))
+    return rows
+
+
+def timed(fn):
+    best = None
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best * 1000
+
+
+def bench(kind, model):
+    rows = make_rows(kind)
+    adapter = TypeAdapter(List[model])
+    results = []
+
+    # What FastAPI sends today for response_model=List[...]
+    json_body, json_ms = timed(lambda: adapter.dump_json(rows))
+    results.append(("json", len(json_body), json_ms))
+
+    if serialization.msgpack is not None:
+        body, ms = timed(lambda: serialization.encode_msgpack(jsonable_encoder(rows)))
+        results.append(("msgpack", len(body), ms))
+
+    arrow_body, arrow_ms = timed(lambda: serialization.encode_arrow(serialization._to_python(rows)))
+    results.append(("arrow", len(arrow_body), arrow_ms))
+
+    # CPU for compressed encodings is serialize + compress
+    for name, coder in CODERS.items():
+        for label, body, base_ms in (("json", json_body, json_ms), ("arrow", arrow_body, arrow_ms)):
+            def compress():
+                compressor = coder()
+                return compressor.compress(body) + compressor.finish()
+            compressed, ms = timed(compress)
+            results.append((f"{label}+{name}", len(compressed), base_ms + ms))
+
+    print(f"\n{kind} ({ROWS} rows)")
+    print(f"  {'encoding':<16}{'bytes':>14}{'vs json':>10}{'cpu ms':>10}")
+    for name, size, ms in results:
+        print(f"  {name:<16}{size:>14,}{size / len(json_body):>9.1%}{ms:>10.1f}")
+
+
+if __name__ == "__main__":
+    kinds = sys.argv[1:] or ["patients", "medical_records", "claims"]
+    models = {"patients": Patient, "medical_records": MedicalRecord, "claims": Claim}
+    for kind in kinds:
+        bench(kind, models[kind])
@@ -0,0 +1,85 @@
+"""Memory per row of a large federated record list: dicts and models per row versus a ColumnTable."""
+import gc
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from columnar import ColumnTable
+from models import MedicalRecordSummary
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+
+COLUMNS = ["record_id", "patient_id", "doctor_id", "diagnosis", "record_date", "treatment_length", "notes_length"]
+DIAGNOSES = ["Hypertension", "Type 2 Diabetes", "Asthma", "Migraine", "Influenza", "Back Pain"]
+
+
+# Like a driver's fetchall(): new tuples, strings and dates for every row, even for repeated values
+def fetch_rows(n=ROWS, seed=42):
+    rng = random.Random(seed)
+    return [
+        (i, 1, rng.randint(1, 50), rng.choice(DIAGNOSES).encode().decode(),
+         date(2020, 1, 1) + timedelta(days=rng.randint(0, 1500)), rng.randint(20, 2000), rng.randint(20, 4000))
+        for i in range(1, n + 1)
+    ]
+
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, date) else value
+
+
+# What the hospital sources and the federated route built before: a dict per row, then a model per row
+def as_dicts(rows):
+    return [{column: _iso(value) for column, value in zip(COLUMNS, row)} for row in rows]
+
+
+def as_models(dicts):
+    return [MedicalRecordSummary(**record) for record in dicts]
+
+
+def dicts_and_models(rows):
+    dicts = as_dicts(rows)
+    return dicts, as_models(dicts)
+
+
+def as_table(rows):
+    return ColumnTable.from_rows(COLUMNS, rows).convert("record_date", _iso).compact()
+
+
+# Models are only built for the response, from one row dict at a time
+def table_and_models(rows):
+    table = as_table(rows)
+    return table, table.to_models(lambda record: MedicalRecordSummary(**record))
+
+
+def measure(build):
+    """Bytes still held per row once the fetched rows are released, the peak while building, and the time."""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows = fetch_rows()
+    result = build(rows)
+    del rows
+    gc.collect()
+    elapsed = time.perf_counter() - started
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return retained / ROWS, peak / ROWS, elapsed * 1000
+
+
+def report(name, retained, peak, ms, baseline=None):
+    ratio = f"{baseline / retained:>6.1f}x smaller" if baseline else ""
+    print(f"  {name:<34}{retained:>9.0f} B/row {peak:>9.0f} B/row peak {ms:>9.1f} ms  {ratio}")
+
+
+if __name__ == "__main__":
+    print(f"Medical record summaries ({ROWS} rows; tracemalloc timings include its overhead)")
+    print("  before")
+    dicts = measure(as_dicts)
+    report("dict per row", *dicts)
+    report("dict + model per row", *measure(dicts_and_models))
+    print("  after")
+    report("ColumnTable (compacted)", *measure(as_table), baseline=dicts[0])
+    report("ColumnTable + models at the edge", *measure(table_and_models))
@@ -0,0 +1,93 @@
+"""Startup time: importing the app, serving the first request, and the init_db schema check."""
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+RUNS = 5
+TARGET_MS = 1000
+
+# Modules that should only be imported when the feature that needs them is first used
+HEAVY_MODULES = ("neo4j", "numpy", "pyarrow", "duckdb")
+
+IMPORT_SCRIPT = f"""
+import sys, time
+started = time.perf_counter()
+import main
+elapsed = (time.perf_counter() - started) * 1000
+print(elapsed, ",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))
+"""
+
+INIT_DB_SCRIPT = """
+import time
+import main
+started = time.perf_counter()
+main.init_db(seed=False)
+print((time.perf_counter() - started) * 1000)
+"""
+
+
+def _python(script):
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+    return result.stdout.strip().splitlines()[-1]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_import():
+    timings, loaded = [], ""
+    for _ in range(RUNS):
+        elapsed, _, loaded = _python(IMPORT_SCRIPT).partition(" ")
+        timings.append(float(elapsed))
+    return statistics.median(timings), loaded
+
+
+# From launching uvicorn to the first answered request, lifespan startup included
+def time_first_request(timeout=30):
+    timings = []
+    for _ in range(RUNS):
+        port = _free_port()
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            while time.perf_counter() - started < timeout:
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                        if response.status == 200:
+                            break
+                except OSError:
+                    time.sleep(0.01)
+            else:
+                raise RuntimeError("server did not answer in time")
+            timings.append((time.perf_counter() - started) * 1000)
+        finally:
+            server.terminate()
+            server.wait()
+    return statistics.median(timings)
+
+
+def report(name, ms):
+    verdict = "ok" if ms <= TARGET_MS else f"over the {TARGET_MS} ms target"
+    print(f"  {name:<28}{ms:>10.1f} ms  {verdict}")
+
+
+if __name__ == "__main__":
+    print(f"Startup ({RUNS} runs, median)")
+    import_ms, loaded = time_import()
+    report("import main", import_ms)
+    print(f"  {'heavy modules at import':<28}{loaded or 'none'}")
+    report("first request", time_first_request())
+    # Needs both databases; with current schema versions this is just two version reads
+    if "--with-db" in sys.argv:
+        report("init_db (schema check)", float(_python(INIT_DB_SCRIPT)))
+    else:
+        print("  init_db skipped (pass --with-db with database settings to include it)")
\ No newline at end of file
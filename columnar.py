@@ -0,0 +1,140 @@
+import json
+from array import array
+
+
+class ColumnTable:
+    """Rows stored column by column (struct of arrays), for large federated and batch result sets.
+
+    A list of dicts pays for a hash table per row and a Pydantic model per row on top of it; here each
+    column is one list (or a typed array once compacted), and rows become dicts or models only when a
+    response is built from them.
+    """
+    __slots__ = ("names", "columns")
+
+    def __init__(self, names, columns=None):
+        self.names = list(names)
+        self.columns = columns if columns is not None else [[] for _ in self.names]
+
+    @classmethod
+    def from_rows(cls, names, rows):
+        columns = [list(column) for column in zip(*rows)] if rows else None
+        return cls(names, columns)
+
+    @classmethod
+    def from_cursor(cls, cursor, rows=None):
+        """A table of a DB-API cursor's result (pyodbc or sqlite3); rows defaults to fetchall()."""
+        names = [column[0] for column in cursor.description]
+        return cls.from_rows(names, cursor.fetchall() if rows is None else rows)
+
+    @classmethod
+    def from_dicts(cls, dicts):
+        """A table of dicts (Neo4j nodes, JSON documents); keys missing from a dict become None."""
+        names, columns, count = [], {}, 0
+        for item in dicts:
+            for name in item:
+                if name not in columns:
+                    names.append(name)
+                    columns[name] = [None] * count
+            for name in names:
+                columns[name].append(item.get(name))
+            count += 1
+        return cls(names, [columns[name] for name in names])
+
+    @classmethod
+    def concat(cls, tables):
+        tables = list(tables)
+        if not tables:
+            return cls([])
+        names = tables[0].names
+        return cls(names, [[value for table in tables for value in table.column(name)] for name in names])
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def column(self, name):
+        return self.columns[self.names.index(name)]
+
+    def append(self, row):
+        for column, value in zip(self.columns, row):
+            column.append(value)
+
+    def with_column(self, name, values):
+        """Add a column, or replace the one with this name."""
+        if name in self.names:
+            self.columns[self.names.index(name)] = values
+        else:
+            self.names.append(name)
+            self.columns.append(values)
+        return self
+
+    def convert(self, name, fn):
+        if name in self.names:
+            self.with_column(name, [fn(value) for value in self.column(name)])
+        return self
+
+    def take(self, positions):
+        """A new table of the rows at the given positions, in that order."""
+        return ColumnTable(self.names, [[column[i] for i in positions] for column in self.columns])
+
+    def index(self, key):
+        """Key value -> row position, for lookups and for putting rows back in request order."""
+        return {value: position for position, value in enumerate(self.column(key))}
+
+    def group(self, key):
+        """Key value -> row positions, for joining another table on this one."""
+        groups = {}
+        for position, value in enumerate(self.column(key)):
+            groups.setdefault(value, []).append(position)
+        return groups
+
+    def rows(self):
+        return zip(*self.columns)
+
+    def iter_dicts(self):
+        """One dict at a time, so only the row being converted exists as a dict."""
+        names = self.names
+        for row in zip(*self.columns):
+            yield dict(zip(names, row))
+
+    def to_dicts(self):
+        return list(self.iter_dicts())
+
+    def to_models(self, factory):
+        """Models (or anything built from a row dict) for the response edge."""
+        return [factory(row) for row in self.iter_dicts()]
+
+    def compact(self):
+        """Store whole-number and float columns as typed arrays and share repeated strings.
+
+        Columns with NULLs, mixed types or values out of range stay lists; strings are deduplicated
+        within each column only (statuses, genders, diagnoses), not interned process-wide.
+        """
+        for i, column in enumerate(self.columns):
+            if not isinstance(column, list) or not column:
+                continue
+            kinds = {type(value) for value in column}
+            if kinds == {int}:
+                try:
+                    self.columns[i] = array("q", column)
+                except OverflowError:
+                    pass
+            elif kinds <= {int, float} and float in kinds:
+                self.columns[i] = array("d", column)
+            elif kinds <= {str, type(None)}:
+                shared = {}
+                self.columns[i] = [value if value is None else shared.setdefault(value, value) for value in column]
+        return self
+
+    def to_arrow(self, schema=None):
+        """An Arrow table built straight from the columns (pyarrow is imported on first use)."""
+        import pyarrow as pa
+        data = {}
+        for name, column in zip(self.names, self.columns):
+            # Nested objects have no fixed shape, so they travel as JSON text (as in serialization.arrow_table)
+            if isinstance(column, list) and any(isinstance(value, (dict, list)) for value in column):
+                column = [json.dumps(value) if isinstance(value, (dict, list)) else value for value in column]
+            data[name] = column
+        if schema is not None:
+            return pa.Table.from_pydict({field.name: data.get(field.name, [None] * len(self)) for field in schema},
+                                        schema=schema)
+        return pa.Table.from_pydict(data)
@@ -0,0 +1,206 @@
+import os
+import zlib
+
+from metrics import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Bodies smaller than this are sent as-is; compressing them costs more than it saves
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+
+# Levels tuned for dynamic responses: most of the size win for a fraction of the CPU of the maximum
+GZIP_LEVEL = 4
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-msgpack",
+    "application/vnd.apache.arrow.stream",
+    "application/javascript",
+    "text/",
+)
+
+# Event streams must reach the client as soon as each event is written
+UNCOMPRESSED_TYPES = ("text/event-stream",)
+
+
+class _Gzip:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _Brotli:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class _Zstd:
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+# Server preference order; codings whose library is not installed are never offered
+CODERS = {
+    name: coder for name, coder, available in (
+        ("zstd", _Zstd, zstandard is not None),
+        ("br", _Brotli, brotli is not None),
+        ("gzip", _Gzip, True),
+    ) if available
+}
+
+
+def choose_encoding(accept_encoding):
+    """Pick the preferred coding the client accepts (q > 0), or None for identity."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    wildcard = accepted.get("*", 0.0)
+    candidates = [(accepted.get(name, wildcard), -rank, name) for rank, name in enumerate(CODERS)]
+    quality, _, name = max(candidates, default=(0.0, 0, None))
+    return name if quality > 0 else None
+
+
+def _header(headers, name):
+    for key, value in headers:
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+class CompressionMiddleware:
+    """Negotiated gzip/brotli/zstd response compression, including streamed (chunked) bodies."""
+
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(_header(scope["headers"], b"accept-encoding") or "")
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        coder = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, coder, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                content_type = _header(message["headers"], b"content-type") or ""
+                passthrough = (
+                    message["status"] in (204, 304)
+                    or _header(message["headers"], b"content-encoding") is not None
+                    or not content_type.startswith(COMPRESSIBLE_TYPES)
+                    or content_type.startswith(UNCOMPRESSED_TYPES)
+                )
+                if passthrough:
+                    await send(message)
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if coder is None:
+                if not more_body and len(body) < self.minimum_size:
+                    # Small complete body: send it untouched
+                    start["headers"] = _with_vary(start["headers"])
+                    await send(start)
+                    await send(message)
+                    passthrough = True
+                    return
+                coder = CODERS[encoding]()
+                start["headers"] = _compressed_headers(start["headers"], encoding)
+                if not more_body:
+                    # Whole body in one message: compress it in one go and keep Content-Length
+                    compressed = coder.compress(body) + coder.finish()
+                    start["headers"].append((b"content-length", str(len(compressed)).encode()))
+                    metrics.increment(f"compression.{encoding}.bytes_in", len(body))
+                    metrics.increment(f"compression.{encoding}.bytes_out", len(compressed))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+                await send(start)
+
+            # Streaming: flush after every chunk so the client receives data as it is produced
+            chunk = coder.compress(body) + (coder.flush() if more_body else coder.finish())
+            metrics.increment(f"compression.{encoding}.bytes_in", len(body))
+            metrics.increment(f"compression.{encoding}.bytes_out", len(chunk))
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+def _with_vary(headers):
+    vary = _header(headers, b"vary")
+    if vary and "accept-encoding" in vary.lower():
+        return list(headers)
+    headers = [(key, value) for key, value in headers if key.lower() != b"vary"]
+    headers.append((b"vary", (f"{vary}, Accept-Encoding" if vary else "Accept-Encoding").encode()))
+    return headers
+
+
+def _compressed_headers(headers, encoding):
+    result = []
+    for key, value in _with_vary(headers):
+        name = key.lower()
+        if name == b"content-length":
+            continue
+        if name == b"etag" and not value.startswith(b"W/"):
+            # The compressed bytes differ from the identity representation, so the validator becomes weak
+            value = b"W/" + value
+        result.append((key, value))
+    result.append((b"content-encoding", encoding.encode()))
+    return result
@@ -1,67 +1,467 @@
 import os
+import threading
+import time
 import pyodbc
-from neo4j import GraphDatabase
 from dotenv import load_dotenv
+import replication
+from metrics import metrics
+from profiling import slow_queries
+from resilience import BackendUnavailable, CircuitBreaker, breakers
 
 # Load environment variables
 load_dotenv()
 
+# Connection and statement time limits (seconds)
+SQL_CONNECT_TIMEOUT = int(os.getenv("SQL_CONNECT_TIMEOUT", "5"))
+SQL_QUERY_TIMEOUT = int(os.getenv("SQL_QUERY_TIMEOUT", "30"))
+NEO4J_CONNECT_TIMEOUT = float(os.getenv("NEO4J_CONNECT_TIMEOUT", "5"))
+NEO4J_QUERY_TIMEOUT = float(os.getenv("NEO4J_QUERY_TIMEOUT", "30"))
 
-# SQL Server Connection
-def get_sql_connection():
-    try:
-        conn = pyodbc.connect(
+# Idle SQL connections kept for reuse, and how long an idle one may sit before it is closed
+SQL_POOL_SIZE = int(os.getenv("SQL_POOL_SIZE", "10"))
+SQL_POOL_IDLE_SECONDS = float(os.getenv("SQL_POOL_IDLE_SECONDS", "300"))
+
+# SQLSTATE classes that mean SQL Server is unreachable or too slow, rather than the statement being wrong
+SQL_UNAVAILABLE_STATES = ("08", "HYT")
+
+
+def _sql_unavailable(error):
+    state = error.args[0] if error.args else ""
+    return isinstance(state, str) and state.startswith(SQL_UNAVAILABLE_STATES)
+
+
+# Registered statements (see queries.py) carry a name; anything else is reported as adhoc
+def statement_name(statement):
+    return getattr(statement, "name", "adhoc")
+
+
+# Close a cursor's open result set without discarding its prepared statement
+def _drain(cursor):
+    while cursor.nextset():
+        pass
+
+
+class PooledConnection:
+    """A pyodbc connection plus one prepared cursor per registered statement executed on it."""
+
+    def __init__(self, conn, server):
+        self.conn = conn
+        self.server = server
+        self.prepared = {}
+        self.active = None
+        self.broken = False
+        self.idle_since = 0.0
+
+    # pyodbc re-executes the same text on the same cursor without preparing it again
+    def cursor_for(self, statement):
+        cursor = self.prepared.get(statement)
+        if cursor is None:
+            cursor = self.prepared[statement] = self.conn.cursor()
+        return cursor
+
+    # Without MARS only one result set may be open per connection, so finish the previous one first
+    def activate(self, cursor):
+        if self.active is not None and self.active is not cursor:
+            _drain(self.active)
+        self.active = cursor
+
+    # Make the connection safe to hand to the next caller
+    def reset(self):
+        if self.active is not None:
+            _drain(self.active)
+            self.active = None
+        if self.conn.autocommit:
+            self.conn.autocommit = False
+        else:
+            self.conn.rollback()
+
+    def close(self):
+        try:
+            self.conn.close()
+        except pyodbc.Error:
+            pass
+
+
+class SqlPool:
+    """Idle SQL Server connections, reused most-recent first so their prepared statements stay warm."""
+
+    def __init__(self, name="sql", size=SQL_POOL_SIZE, idle_seconds=SQL_POOL_IDLE_SECONDS):
+        self.name = name
+        self.size = size
+        self.idle_seconds = idle_seconds
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        now = time.monotonic()
+        stale = []
+        pooled = None
+        with self._lock:
+            while self._idle:
+                candidate = self._idle.pop()
+                if now - candidate.idle_since < self.idle_seconds:
+                    pooled = candidate
+                    break
+                stale.append(candidate)
+        for candidate in stale:
+            candidate.close()
+        metrics.increment(f"{self.name}.pool.reused" if pooled else f"{self.name}.pool.missed")
+        return pooled
+
+    def release(self, pooled):
+        if not pooled.broken:
+            try:
+                pooled.reset()
+            except pyodbc.Error as e:
+                print(f"Discarding SQL connection: {e}")
+                pooled.broken = True
+        if not pooled.broken:
+            pooled.idle_since = time.monotonic()
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append(pooled)
+                    return
+        pooled.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            pooled.close()
+
+    def snapshot(self):
+        with self._lock:
+            return {"idle": len(self._idle), "size": self.size}
+
+
+# Cursor wrapper that reports SQL Server health to its circuit breaker and times each statement
+class SqlCursor:
+    def __init__(self, pooled):
+        self._pooled = pooled
+        self._adhoc = None
+        self._cursor = None
+        # The last statement run, held until its rows have been read: (name, sql, params, seconds)
+        self._statement = None
+        self._rows = 0
+
+    def _current(self):
+        if self._cursor is None:
+            self._cursor = self._adhoc = self._pooled.conn.cursor()
+        return self._cursor
+
+    # Slow-query log entries count the rows the caller actually fetched
+    def _finish(self):
+        if self._statement is not None:
+            name, sql, params, seconds = self._statement
+            self._statement = None
+            slow_queries.record("sql", name, seconds, self._rows, params, sql)
+
+    def _run(self, method_name, sql, params):
+        self._finish()
+        name = statement_name(sql)
+        if name == "adhoc":
+            if self._adhoc is None:
+                self._adhoc = self._pooled.conn.cursor()
+            cursor = self._adhoc
+        else:
+            cursor = self._pooled.cursor_for(sql)
+        server = self._pooled.server
+        breaker = server.breaker
+        started = time.perf_counter()
+        try:
+            self._pooled.activate(cursor)
+            self._cursor = cursor
+            getattr(cursor, method_name)(sql, *params)
+        except pyodbc.Error as e:
+            if _sql_unavailable(e):
+                self._pooled.broken = True
+                breaker.record_failure()
+                raise BackendUnavailable(server.name, str(e)) from e
+            # The server answered, so it is healthy even though the statement failed
+            breaker.record_success()
+            raise
+        except BaseException:
+            breaker.release_trial()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe(f"sql.{name}", elapsed)
+        breaker.record_success()
+        self._statement = (name, sql, params, elapsed)
+        # Rows affected for DML; pyodbc reports -1 for queries, whose rows are counted as they are fetched
+        self._rows = max(getattr(cursor, "rowcount", -1), 0)
+        return self
+
+    def execute(self, sql, *params):
+        return self._run("execute", sql, params)
+
+    def executemany(self, sql, *params):
+        return self._run("executemany", sql, params)
+
+    def fetchone(self):
+        row = self._current().fetchone()
+        if row is not None:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._current().fetchmany(*args)
+        self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._current().fetchall()
+        self._rows += len(rows)
+        return rows
+
+    # Prepared cursors belong to the connection and stay open for the next caller
+    def close(self):
+        self._finish()
+        if self._adhoc is not None:
+            if self._pooled.active is self._adhoc:
+                self._pooled.active = None
+            self._adhoc.close()
+            self._adhoc = None
+        self._cursor = None
+
+    def __iter__(self):
+        for row in self._current():
+            self._rows += 1
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._current(), name)
+
+
+# A leased pooled connection; close() hands it back to the pool
+class SqlConnection:
+    def __init__(self, pooled):
+        self._pooled = pooled
+        self._cursors = []
+
+    def cursor(self):
+        cursor = SqlCursor(self._pooled)
+        self._cursors.append(cursor)
+        return cursor
+
+    # Commits on a primary with replicas are remembered, so the client's next reads see them
+    def commit(self):
+        self._pooled.conn.commit()
+        if self._pooled.server.replica_set is not None:
+            replication.record_sql_write()
+
+    @property
+    def autocommit(self):
+        return self._pooled.conn.autocommit
+
+    @autocommit.setter
+    def autocommit(self, value):
+        self._pooled.conn.autocommit = value
+
+    def close(self):
+        # Cursors left open still report their last statement
+        for cursor in self._cursors:
+            cursor._finish()
+        self._cursors = []
+        if self._pooled is not None:
+            self._pooled.server.pool.release(self._pooled)
+            self._pooled = None
+
+    def __getattr__(self, name):
+        return getattr(self._pooled.conn, name)
+
+
+class SqlServer:
+    """A SQL Server database with its own connection pool and circuit breaker."""
+
+    # Settings come from <env_prefix>_SERVER, _DATABASE, _USERNAME and _PASSWORD; read replicas
+    # of the same database are listed (host names only) in <env_prefix>_REPLICAS
+    def __init__(self, name="sql", env_prefix="SQL", pool_size=SQL_POOL_SIZE, host=None):
+        self.name = name
+        self.env_prefix = env_prefix
+        self.host = host
+        self.pool = SqlPool(name, pool_size)
+        self.breaker = breakers.setdefault(name, CircuitBreaker(name))
+        self.replica_set = None
+        replica_hosts = [] if host else [h.strip() for h in os.getenv(f"{env_prefix}_REPLICAS", "").split(",") if h.strip()]
+        if replica_hosts:
+            self.replica_set = replication.ReplicaSet([
+                SqlServer(f"{name}-replica-{index}", env_prefix, pool_size, replica_host)
+                for index, replica_host in enumerate(replica_hosts, 1)
+            ])
+
+    def connection_string(self):
+        prefix = self.env_prefix
+        return (
             f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-            f"SERVER={os.getenv('SQL_SERVER')};"
-            f"DATABASE={os.getenv('SQL_DATABASE')};"
-            f"UID={os.getenv('SQL_USERNAME')};"
-            f"PWD={os.getenv('SQL_PASSWORD')}"
+            f"SERVER={self.host or os.getenv(f'{prefix}_SERVER')};"
+            f"DATABASE={os.getenv(f'{prefix}_DATABASE')};"
+            f"UID={os.getenv(f'{prefix}_USERNAME')};"
+            f"PWD={os.getenv(f'{prefix}_PASSWORD')}"
+            # Readable secondaries behind an availability group listener only accept read intent
+            + (";ApplicationIntent=ReadOnly" if self.host else "")
         )
-        return conn
-    except Exception as e:
-        print(f"Error connecting to SQL Server: {e}")
-        return None
+
+    # Reads (see replication.read_only) go to a replica that is current enough, when there is one
+    def connect(self, read_only=None):
+        if read_only is None:
+            read_only = replication.read_only.get()
+        if read_only and self.replica_set is not None:
+            state = replication.session.get()
+            replica = self.replica_set.choose(state.sql_written_at if state else None)
+            if replica is not None:
+                try:
+                    conn = replica.connect(read_only=False)
+                    metrics.increment(f"{replica.name}.reads")
+                    return conn
+                except BackendUnavailable:
+                    # The primary serves the read; the replica's breaker keeps it out until it recovers
+                    pass
+        self.breaker.before_call()
+        pooled = self.pool.acquire()
+        if pooled is not None:
+            return SqlConnection(pooled)
+        try:
+            conn = pyodbc.connect(self.connection_string(), timeout=SQL_CONNECT_TIMEOUT)
+        except Exception as e:
+            print(f"Error connecting to SQL Server ({self.name}): {e}")
+            self.breaker.record_failure()
+            raise BackendUnavailable(self.name, f"Error connecting to SQL Server: {e}") from e
+        # Statement timeout for every cursor on this connection
+        conn.timeout = SQL_QUERY_TIMEOUT
+        return SqlConnection(PooledConnection(conn, self))
+
+
+# The hospital database configured in .env
+sql_server = SqlServer()
+sql_pool = sql_server.pool
+
+
+# SQL Server Connection
+def get_sql_connection():
+    return sql_server.connect()
+
+
+class Neo4jServer:
+    """A Neo4j database with its own circuit breaker and one driver per process."""
+
+    # The driver pools Bolt connections, and the server caches plans by query text.
+    # Settings come from <env_prefix>_URI, _USERNAME and _PASSWORD
+    def __init__(self, name="neo4j", env_prefix="NEO4J"):
+        self.name = name
+        self.env_prefix = env_prefix
+        self.breaker = breakers.setdefault(name, CircuitBreaker(name))
+        # neo4j:// URIs route through the cluster: reads to followers and read replicas, writes to the leader
+        self.routing = (os.getenv(f"{env_prefix}_URI") or "").startswith("neo4j")
+        self._driver = None
+        self._lock = threading.Lock()
+
+    def driver(self):
+        with self._lock:
+            if self._driver is None:
+                # The neo4j package is slow to import, so it is loaded with the first graph query
+                from neo4j import GraphDatabase
+                prefix = self.env_prefix
+                self._driver = GraphDatabase.driver(
+                    os.getenv(f"{prefix}_URI"),
+                    auth=(os.getenv(f"{prefix}_USERNAME"), os.getenv(f"{prefix}_PASSWORD")),
+                    connection_timeout=NEO4J_CONNECT_TIMEOUT,
+                    connection_acquisition_timeout=NEO4J_CONNECT_TIMEOUT
+                )
+            return self._driver
+
+    def close(self):
+        with self._lock:
+            driver, self._driver = self._driver, None
+        if driver:
+            driver.close()
+
+
+# The insurance graph configured in .env
+neo4j_server = Neo4jServer()
+
+
+# Close pooled connections to both stores (on app shutdown)
+def close_connections():
+    sql_server.pool.clear()
+    neo4j_server.close()
 
 
 # Neo4j Connection
 class Neo4jConnection:
-    def __init__(self):
+    def __init__(self, server=None):
+        self.server = server or neo4j_server
         self.driver = None
         try:
-            self.driver = GraphDatabase.driver(
-                os.getenv("NEO4J_URI"),
-                auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD"))
-            )
+            self.driver = self.server.driver()
         except Exception as e:
-            print(f"Error connecting to Neo4j: {e}")
+            print(f"Error connecting to Neo4j ({self.server.name}): {e}")
 
+    # The driver is shared by the process; close_connections() shuts it down
     def close(self):
-        if self.driver:
-            self.driver.close()
+        pass
+
+    def query(self, query, parameters=None, timeout=None):
+        from neo4j import READ_ACCESS, WRITE_ACCESS, Bookmarks, Query
+        from neo4j.exceptions import (ConnectionAcquisitionTimeoutError, Neo4jError, ServiceUnavailable,
+                                      SessionExpired, TransientError)
+        name = self.server.name
+        breaker = self.server.breaker
+        breaker.before_call()
+        if self.driver is None:
+            breaker.record_failure()
+            raise BackendUnavailable(name, "Neo4j driver not initialized")
 
-    def query(self, query, parameters=None):
-        assert self.driver is not None, "Driver not initialized!"
         session = None
-        response = None
+        session_options = {}
+        reading = replication.read_only.get()
+        if self.server.routing:
+            # Bookmarks of the client's last writes make a read server wait until it has applied them
+            bookmarks = replication.graph_bookmarks() if reading else []
+            session_options = {
+                "default_access_mode": READ_ACCESS if reading else WRITE_ACCESS,
+                "bookmarks": Bookmarks.from_raw_values(bookmarks) if bookmarks else None
+            }
+        started = time.perf_counter()
         try:
-            session = self.driver.session()
-            response = list(session.run(query, parameters))
-        except Exception as e:
+            session = self.driver.session(**session_options)
+            # Server-side transaction timeout in seconds
+            response = list(session.run(Query(str(query), timeout=timeout or NEO4J_QUERY_TIMEOUT), parameters))
+            if self.server.routing and not reading:
+                replication.record_graph_write(session.last_bookmarks().raw_values)
+        except (ServiceUnavailable, SessionExpired, TransientError, ConnectionAcquisitionTimeoutError) as e:
+            print(f"Query failed: {e}")
+            breaker.record_failure()
+            raise BackendUnavailable(name, f"Neo4j query failed: {e}") from e
+        except Neo4jError as e:
             print(f"Query failed: {e}")
+            if "TransactionTimedOut" in (e.code or ""):
+                breaker.record_failure()
+                raise BackendUnavailable(name, f"Neo4j query timed out: {e}") from e
+            breaker.record_success()
+            raise
+        except BaseException:
+            # Client-side errors (bad parameters, consumed results, cancellation) say nothing about Neo4j's health
+            breaker.release_trial()
+            raise
         finally:
             if session:
                 session.close()
+            elapsed = time.perf_counter() - started
+            metrics.observe(f"cypher.{statement_name(query)}", elapsed)
+        breaker.record_success()
+        slow_queries.record("neo4j", statement_name(query), elapsed, len(response), parameters, query)
         return response
 
 
 # Test connections
 def test_connections():
     # Test SQL connection
-    sql_conn = get_sql_connection()
-    if sql_conn:
+    try:
+        sql_conn = get_sql_connection()
         print("SQL Server connection successful!")
         sql_conn.close()
-    else:
+    except BackendUnavailable:
         print("SQL Server connection failed!")
 
     # Test Neo4j connection
@@ -74,4 +474,4 @@ def test_connections():
 
 
 if __name__ == "__main__":
-    test_connections()
\ No newline at end of file
+    test_connections()
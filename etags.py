@@ -0,0 +1,109 @@
+import hashlib
+
+from fastapi import Response
+
+import queries
+from database import get_sql_connection, Neo4jConnection
+from reference_data import cache as reference_cache
+from resilience import BackendUnavailable
+
+# Cache-Control per resource; responses carry patient data, so shared caches must never store them
+CACHE_POLICIES = {
+    "patient": "private, no-cache",
+    "medical_record": "private, no-cache",
+    # Policies change rarely; clients may reuse them briefly before revalidating
+    "insurance_policy": "private, max-age=60, must-revalidate",
+    "claim": "private, no-cache",
+    "complete": "private, no-cache",
+}
+
+
+def make_etag(kind, key, version):
+    digest = hashlib.sha1(repr((kind, key, version)).encode()).hexdigest()[:24]
+    return f'"{digest}"'
+
+
+# If-None-Match uses the weak comparison: W/"x" matches "x"
+def etag_matches(if_none_match, etag):
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+
+def not_modified(etag, kind):
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_POLICIES[kind]})
+
+
+def set_cache_headers(response, etag, kind):
+    if etag:
+        response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_POLICIES[kind]
+
+
+# ----- VERSION LOOKUPS (no row or node bodies are read) -----
+
+def _sql_one(query, params):
+    conn = get_sql_connection()
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    row = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    return tuple(row) if row else None
+
+
+def _graph_one(query, params):
+    neo4j_conn = Neo4jConnection()
+    result = neo4j_conn.query(query, params)
+    neo4j_conn.close()
+    return dict(result[0]) if result else None
+
+
+def patient_version(patient_id):
+    row = _sql_one(queries.PATIENT_VERSION, (patient_id,))
+    return row[0] if row else None
+
+
+def medical_record_version(record_id):
+    row = _sql_one(queries.MEDICAL_RECORD_VERSION, (record_id,))
+    # Records embed the doctor from the reference cache
+    return (row[0], reference_cache.versions()) if row else None
+
+
+def insurance_policy_version(policy_id):
+    row = _graph_one(queries.POLICY_VERSION, {"policy_id": policy_id})
+    return row["version"] if row else None
+
+
+def claim_version(claim_id):
+    row = _graph_one(queries.CLAIM_VERSION, {"claim_id": claim_id})
+    # Claims embed the provider from the reference cache
+    return (row["version"], row["policy_version"], reference_cache.versions()) if row else None
+
+
+def complete_patient_version(patient_id):
+    row = _sql_one(queries.COMPLETE_PATIENT_SQL_VERSION, (patient_id,))
+    if not row:
+        return None
+    graph = _graph_one(queries.COMPLETE_PATIENT_GRAPH_VERSION, {"patient_id": patient_id})
+    return (row, sorted(graph["policies"]), sorted(graph["claims"]), reference_cache.versions())
+
+
+def complete_claim_version(claim_id):
+    graph = _graph_one(queries.COMPLETE_CLAIM_GRAPH_VERSION, {"claim_id": claim_id})
+    if not graph:
+        return None
+    row = _sql_one(queries.COMPLETE_CLAIM_SQL_VERSION, (graph["record_id"], graph["patient_id"]))
+    return (graph["version"], graph["policy_version"], row, reference_cache.versions())
+
+
+# ETag for the current version of an entity, or None when it is missing or a store is unavailable
+def current_etag(kind, key, lookup):
+    try:
+        version = lookup(key)
+    except BackendUnavailable:
+        return None
+    return make_etag(kind, key, version) if version is not None else None
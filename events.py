@@ -0,0 +1,195 @@
+import asyncio
+import json
+import os
+import threading
+from collections import defaultdict, deque
+
+from fastapi.encoders import jsonable_encoder
+
+from metrics import metrics
+
+# Events buffered per client; a client further behind loses its oldest events and is told to refetch
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "256"))
+
+# Open event streams allowed per worker
+MAX_EVENT_SUBSCRIBERS = int(os.getenv("MAX_EVENT_SUBSCRIBERS", "5000"))
+
+# Idle streams get a comment line this often, so proxies and browsers keep them open
+EVENT_HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+
+# Recent events kept for clients that reconnect with Last-Event-ID
+EVENT_REPLAY_SIZE = 1000
+
+HEARTBEAT = b": keep-alive\n\n"
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+# Events without an ID (notices to one client) leave the browser's Last-Event-ID as it was
+def encode_event(event_id, event_type, data):
+    payload = json.dumps(jsonable_encoder(data), separators=(",", ":"))
+    id_line = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{id_line}event: {event_type}\ndata: {payload}\n\n".encode()
+
+
+class Subscription:
+    """One client's topics and its bounded queue of encoded events."""
+    __slots__ = ("topics", "queue", "size", "dropped", "wakeup")
+
+    def __init__(self, topics, size=EVENT_QUEUE_SIZE):
+        self.topics = topics
+        self.queue = deque()
+        self.size = size
+        self.dropped = 0
+        self.wakeup = asyncio.Event()
+
+    def offer(self, message):
+        if len(self.queue) >= self.size:
+            self.queue.popleft()
+            self.dropped += 1
+        self.queue.append(message)
+        self.wakeup.set()
+
+
+class EventBroker:
+    """Fans claim and policy changes out to subscribed event streams, by topic."""
+
+    def __init__(self, max_subscribers=MAX_EVENT_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._topics = defaultdict(set)
+        self._subscribers = 0
+        self._last_id = 0
+        self._recent = deque(maxlen=EVENT_REPLAY_SIZE)
+        self._loop = None
+        self._loop_thread = None
+
+    # Remember the event loop, so publishes from worker threads can be handed to it
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+
+    def subscribe(self, topics, last_event_id=None):
+        if self._subscribers >= self.max_subscribers:
+            metrics.increment("events.rejected")
+            raise TooManySubscribers("Too many open event streams")
+        subscription = Subscription(frozenset(topics))
+        for topic in subscription.topics:
+            self._topics[topic].add(subscription)
+        self._subscribers += 1
+        metrics.increment("events.subscribed")
+        # Replay what a reconnecting client missed; if that is no longer buffered (or the worker
+        # restarted since), the client is told it lagged and refetches instead
+        if last_event_id is not None:
+            oldest = self._recent[0][0] if self._recent else self._last_id + 1
+            if last_event_id > self._last_id or oldest > last_event_id + 1:
+                subscription.dropped += 1
+            for event_id, event_topics, message in self._recent:
+                if event_id > last_event_id and event_topics & subscription.topics:
+                    subscription.offer(message)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        for topic in subscription.topics:
+            subscribers = self._topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._topics[topic]
+        self._subscribers -= 1
+
+    def publish(self, event_type, data, topics):
+        """Send an event to every stream subscribed to any of the topics; safe to call from any thread."""
+        if self._loop is None:
+            return
+        if threading.get_ident() == self._loop_thread:
+            self._publish(event_type, data, topics)
+        else:
+            self._loop.call_soon_threadsafe(self._publish, event_type, data, topics)
+
+    def _publish(self, event_type, data, topics):
+        self._last_id += 1
+        topics = frozenset(topics)
+        # Encoded once, however many streams receive it
+        message = encode_event(self._last_id, event_type, data)
+        self._recent.append((self._last_id, topics, message))
+        targets = set()
+        for topic in topics:
+            targets.update(self._topics.get(topic, ()))
+        for subscription in targets:
+            subscription.offer(message)
+        metrics.increment(f"events.{event_type}")
+        metrics.increment("events.delivered", len(targets))
+
+    async def stream(self, subscription):
+        """Server-Sent Events body for one subscription; unsubscribes when the client goes away."""
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                if not subscription.queue:
+                    subscription.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(subscription.wakeup.wait(), EVENT_HEARTBEAT_SECONDS)
+                    except asyncio.TimeoutError:
+                        yield HEARTBEAT
+                        continue
+                if subscription.dropped:
+                    metrics.increment("events.lagged")
+                    yield encode_event(None, "lagged", {"dropped": subscription.dropped})
+                    subscription.dropped = 0
+                # Everything queued goes out in one write
+                messages = list(subscription.queue)
+                subscription.queue.clear()
+                yield b"".join(messages)
+        finally:
+            self.unsubscribe(subscription)
+
+    def snapshot(self):
+        return {"subscribers": self._subscribers, "topics": len(self._topics), "last_event_id": self._last_id}
+
+
+broker = EventBroker()
+
+
+# ----- CLAIM AND POLICY EVENTS -----
+
+def claim_topics(claim_id, policy_id, patient_id):
+    topics = ["claims", f"claim:{claim_id}", f"policy:{policy_id}"]
+    if patient_id is not None:
+        topics.append(f"patient:{patient_id}")
+    return topics
+
+
+def claim_changed(event_type, claim, patient_id=None):
+    broker.publish(event_type, {"claim": claim, "patient_id": patient_id},
+                   claim_topics(claim.claim_id, claim.policy_id, patient_id))
+
+
+def claim_deleted(claim_id, policy_id, patient_id=None):
+    broker.publish("claim.deleted", {"claim_id": claim_id, "policy_id": policy_id, "patient_id": patient_id},
+                   claim_topics(claim_id, policy_id, patient_id))
+
+
+def policy_changed(event_type, policy):
+    broker.publish(event_type, {"policy": policy},
+                   ["policies", f"policy:{policy.policy_id}", f"patient:{policy.patient_id}"])
+
+
+# Bulk changes (adjudication) are announced once to the claims topic; clients refetch what they show
+def claims_refreshed(reason, summary=None):
+    broker.publish("claims.refreshed", {"reason": reason, "summary": summary}, ["claims"])
+
+
+# Each adjudicated claim also reaches the streams following it, its policy or its patient
+def claims_adjudicated(claims, summary=None):
+    for claim in claims:
+        topics = [topic for topic in claim_topics(claim["claim_id"], claim["policy_id"], claim["patient_id"])
+                  if topic != "claims"]
+        broker.publish("claim.updated", {"claim": claim, "patient_id": claim["patient_id"]}, topics)
+    claims_refreshed("adjudicated", summary)
+
+
+def policy_deleted(policy_id, patient_id):
+    broker.publish("policy.deleted", {"policy_id": policy_id, "patient_id": patient_id},
+                   ["policies", "claims", f"policy:{policy_id}", f"patient:{patient_id}"])
\ No newline at end of file
@@ -0,0 +1,291 @@
+import functools
+import json
+import os
+import re
+import shutil
+import sys
+import time
+import uuid
+from datetime import date, datetime, timezone
+
+import queries
+from columnar import ColumnTable
+from database import get_sql_connection, Neo4jConnection
+
+# Where snapshots are written; one sub-directory per record month
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+
+# Rows pulled per SQL fetch and per Neo4j claim lookup
+EXPORT_BATCH_SIZE = 5000
+
+WATERMARK_FILE = "_watermark.json"
+
+# A finished month partition; staging (.tmp) and swapped-out (.old) folders do not match
+PARTITION_NAME = re.compile(r"record_month=(\d{4})-(\d{2})")
+
+# One row per claim, or one row with empty claim columns for records without claims (pyarrow type names)
+EXPORT_COLUMNS = [
+    ("record_id", "int64"),
+    ("patient_id", "int64"),
+    ("doctor_id", "int64"),
+    ("diagnosis", "string"),
+    ("record_date", "date32"),
+    ("patient_gender", "string"),
+    ("patient_birth_year", "int32"),
+    ("claim_id", "string"),
+    ("claim_date", "date32"),
+    ("amount", "float64"),
+    ("status", "string"),
+    ("insurer_payment", "float64"),
+    ("policy_id", "string"),
+    ("provider", "string"),
+    ("coverage_type", "string"),
+]
+
+# The claim half of an export row, as returned by CLAIMS_FOR_RECORDS_QUERY
+CLAIM_COLUMNS = [name for name, _ in EXPORT_COLUMNS[7:]]
+
+
+# pyarrow is imported on first export, not when the app starts
+@functools.lru_cache(maxsize=None)
+def export_schema():
+    import pyarrow as pa
+    return pa.schema([(name, getattr(pa, type_name)()) for name, type_name in EXPORT_COLUMNS])
+
+
+RECORDS_QUERY = queries.sql("export.records", """
+SELECT m.record_id, m.patient_id, m.doctor_id, m.diagnosis, m.record_date,
+       p.gender, YEAR(p.date_of_birth)
+FROM MedicalRecords m
+JOIN Patients p ON p.patient_id = m.patient_id
+WHERE m.record_date >= ? AND m.record_date < ?
+ORDER BY m.record_date, m.record_id
+""")
+
+CLAIMS_FOR_RECORDS_QUERY = queries.cypher("export.claims_for_records", """
+UNWIND $record_ids AS record_id
+MATCH (c:Claim {record_id: record_id})
+OPTIONAL MATCH (c)-[:FILED_UNDER]->(p:InsurancePolicy)
+RETURN c.record_id AS record_id, c.claim_id AS claim_id, c.claim_date AS claim_date,
+       c.amount AS amount, c.status AS status, c.insurer_payment AS insurer_payment,
+       c.policy_id AS policy_id, p.provider AS provider, p.coverage_type AS coverage_type
+""")
+
+ALL_MONTHS_QUERY = queries.sql("export.all_months", """
+SELECT DISTINCT YEAR(record_date), MONTH(record_date)
+FROM MedicalRecords WHERE record_date IS NOT NULL
+""")
+
+CHANGED_MONTHS_QUERY = queries.sql("export.changed_months", """
+SELECT DISTINCT YEAR(m.record_date), MONTH(m.record_date)
+FROM MedicalRecords m
+JOIN Patients p ON p.patient_id = m.patient_id
+WHERE m.record_date IS NOT NULL AND (m.modified_at > ? OR p.modified_at > ?)
+""")
+
+# Months that lost a record: the record and claim write statements leave tombstones (see queries.py)
+TOMBSTONE_MONTHS_QUERY = queries.sql("export.tombstone_months", """
+SELECT DISTINCT YEAR(record_month), MONTH(record_month)
+FROM ExportTombstones WHERE changed_at > ? AND record_month IS NOT NULL
+""")
+
+# Records with a claim changed, added, removed or moved away
+CHANGED_CLAIM_RECORDS_QUERY = queries.cypher("export.changed_claim_records", """
+MATCH (c:Claim) WHERE c.updated_at > datetime($since)
+RETURN c.record_id AS record_id
+UNION
+MATCH (t:ClaimTombstone) WHERE t.removed_at > datetime($since)
+RETURN t.record_id AS record_id
+""")
+
+# Tombstones the run just written has taken into account
+PRUNE_TOMBSTONES = queries.sql("export.prune_tombstones", "DELETE FROM ExportTombstones WHERE changed_at <= ?")
+
+PRUNE_CLAIM_TOMBSTONES = queries.cypher("export.prune_claim_tombstones", """
+MATCH (t:ClaimTombstone) WHERE t.removed_at <= datetime($watermark) DELETE t
+""")
+
+MONTHS_FOR_RECORDS_QUERY = queries.sql("export.months_for_records", """
+SELECT DISTINCT YEAR(m.record_date), MONTH(m.record_date)
+FROM MedicalRecords m
+JOIN OPENJSON(?) WITH (id INT '$') ids ON ids.id = m.record_id
+WHERE m.record_date IS NOT NULL
+""")
+
+
+def _to_date(value):
+    if value is None or isinstance(value, date):
+        return value
+    if hasattr(value, "to_native"):
+        return value.to_native()
+    return date.fromisoformat(str(value)[:10])
+
+
+def _month_bounds(month):
+    year, mon = month
+    return date(year, mon, 1), date(year + mon // 12, mon % 12 + 1, 1)
+
+
+def read_watermark(output_dir):
+    path = os.path.join(output_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)["watermark"]
+
+
+def _write_watermark(output_dir, watermark, summary):
+    path = os.path.join(output_dir, WATERMARK_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"watermark": watermark, **summary}, f)
+    os.replace(path + ".tmp", path)
+
+
+# ----- CHANGE DETECTION -----
+
+def _all_months(cursor):
+    cursor.execute(ALL_MONTHS_QUERY)
+    return {tuple(row) for row in cursor.fetchall()}
+
+
+def _changed_months(cursor, since):
+    # Records or their patients changed in SQL Server, and months records were deleted from or left
+    cursor.execute(CHANGED_MONTHS_QUERY, (since, since))
+    months = {tuple(row) for row in cursor.fetchall()}
+    cursor.execute(TOMBSTONE_MONTHS_QUERY, (since,))
+    months.update(tuple(row) for row in cursor.fetchall())
+
+    # Claims changed or removed in Neo4j, mapped back to the month of the record they were (or are) filed for
+    neo4j_conn = Neo4jConnection()
+    result = neo4j_conn.query(CHANGED_CLAIM_RECORDS_QUERY, {"since": since}) or []
+    neo4j_conn.close()
+
+    record_ids = [row["record_id"] for row in result if row["record_id"] is not None]
+    if record_ids:
+        cursor.execute(MONTHS_FOR_RECORDS_QUERY, (json.dumps(record_ids),))
+        months.update(tuple(row) for row in cursor.fetchall())
+    return months
+
+
+def _partitions(output_dir):
+    """(year, month) -> directory of every finished partition in the snapshot."""
+    partitions = {}
+    for name in os.listdir(output_dir):
+        match = PARTITION_NAME.fullmatch(name)
+        if match:
+            partitions[(int(match[1]), int(match[2]))] = os.path.join(output_dir, name)
+    return partitions
+
+
+# ----- STREAMING JOIN -----
+
+def _join_batch(rows, neo4j_conn):
+    # Claims for the whole page in one UNWIND round trip
+    claims = ColumnTable(["record_id"] + CLAIM_COLUMNS)
+    result = neo4j_conn.query(CLAIMS_FOR_RECORDS_QUERY, {"record_ids": [row[0] for row in rows]}) or []
+    for claim in result:
+        claims.append([claim[name] for name in claims.names])
+    claims.convert("claim_date", _to_date)
+    claims_by_record = claims.group("record_id")
+    claim_rows = list(zip(*claims.columns[1:]))
+
+    # One row per claim, or one row with empty claim columns for records without claims
+    joined = ColumnTable([name for name, _ in EXPORT_COLUMNS])
+    no_claim = [(None,) * len(CLAIM_COLUMNS)]
+    for record_id, patient_id, doctor_id, diagnosis, record_date, gender, birth_year in rows:
+        record = (record_id, patient_id, doctor_id, diagnosis, _to_date(record_date), gender, birth_year)
+        for claim in [claim_rows[i] for i in claims_by_record.get(record_id, ())] or no_claim:
+            joined.append(record + claim)
+    return joined.to_arrow(export_schema())
+
+
+def _export_month(cursor, neo4j_conn, output_dir, month, run_id, batch_size):
+    """Rewrite one month partition; the new files replace the old directory only when complete.
+
+    A month left without records loses its partition.
+    """
+    start, end = _month_bounds(month)
+    partition = os.path.join(output_dir, f"record_month={start:%Y-%m}")
+    staging = f"{partition}.{run_id}.tmp"
+    os.makedirs(staging, exist_ok=True)
+
+    import pyarrow.parquet as pq
+    rows_written = 0
+    writer = pq.ParquetWriter(os.path.join(staging, "part-00000.parquet"), export_schema(), compression="zstd")
+    cursor.execute(RECORDS_QUERY, (start, end))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        table = _join_batch(rows, neo4j_conn)
+        writer.write_table(table)
+        rows_written += table.num_rows
+    writer.close()
+
+    # Moved aside rather than deleted first, so readers only miss the month between two renames
+    retired = f"{partition}.{run_id}.old"
+    if os.path.exists(partition):
+        os.replace(partition, retired)
+    if rows_written:
+        os.replace(staging, partition)
+    else:
+        shutil.rmtree(staging)
+    if os.path.exists(retired):
+        shutil.rmtree(retired)
+    return rows_written
+
+
+def export_federated(output_dir=EXPORT_DIR, full=False, batch_size=EXPORT_BATCH_SIZE, progress=None):
+    """Export records joined with their claims to Parquet, by record month.
+
+    Incremental runs (the default once a watermark exists) only rewrite the months that
+    contain records, patients or claims changed since the previous run, or that records or
+    claims were deleted from or moved out of (from the tombstones their writes leave). Full
+    runs also drop partitions of months that no longer have any records.
+    """
+    started = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    run_id = uuid.uuid4().hex[:12]
+
+    # Taken before reading so changes made during the run are picked up next time
+    new_watermark = datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+    since = None if full else read_watermark(output_dir)
+
+    conn = get_sql_connection()
+    cursor = conn.cursor()
+    months = sorted(_all_months(cursor) if since is None else _changed_months(cursor, since))
+
+    neo4j_conn = Neo4jConnection()
+    rows_written = 0
+    for index, month in enumerate(months):
+        rows_written += _export_month(cursor, neo4j_conn, output_dir, month, run_id, batch_size)
+        if progress:
+            progress((index + 1) / len(months), f"exported {month[0]}-{month[1]:02d}")
+    if since is None:
+        for month, path in _partitions(output_dir).items():
+            if month not in months:
+                shutil.rmtree(path)
+
+    summary = {
+        "run_id": run_id,
+        "mode": "full" if since is None else "incremental",
+        "since": since,
+        "months": len(months),
+        "rows": rows_written,
+        "seconds": round(time.perf_counter() - started, 3)
+    }
+    _write_watermark(output_dir, new_watermark, summary)
+
+    # Everything up to the new watermark is in the snapshot now; later tombstones stay for the next run
+    cursor.execute(PRUNE_TOMBSTONES, (new_watermark,))
+    conn.commit()
+    neo4j_conn.query(PRUNE_CLAIM_TOMBSTONES, {"watermark": new_watermark})
+    neo4j_conn.close()
+    cursor.close()
+    conn.close()
+    print(f"Exported {rows_written} rows across {len(months)} month(s) in {summary['seconds']}s")
+    return summary
+
+
+if __name__ == "__main__":
+    export_federated(full="--full" in sys.argv)
@@ -0,0 +1,368 @@
+import asyncio
+import importlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import analytics
+import events
+from audit import log as audit_log
+from metrics import metrics
+
+# Local queue file; jobs still queued or running when the app stops are picked up on the next start
+JOBS_DB = os.getenv("JOBS_DB", "jobs.sqlite3")
+
+# CPU-bound jobs run in worker processes, I/O-bound ones in threads
+JOB_PROCESS_WORKERS = int(os.getenv("JOB_PROCESS_WORKERS", "2"))
+JOB_IO_WORKERS = int(os.getenv("JOB_IO_WORKERS", "4"))
+
+JOB_POLL_SECONDS = 2.0
+
+# An app process renews its lease every poll; once it is this old, the process is gone and its jobs are requeued
+OWNER_LEASE_SECONDS = float(os.getenv("JOB_OWNER_LEASE_SECONDS", "60"))
+
+# Minimum seconds between progress writes, so chatty jobs do not hammer the queue file
+PROGRESS_INTERVAL = 0.5
+
+# Job type -> (function, worker kind, accepted parameters); functions take a progress(fraction, message) callback
+JOB_TYPES = {
+    "adjudicate": ("adjudication:adjudicate_pending_claims", "process", {"limit", "batch_size"}),
+    "export": ("export:export_federated", "io", {"full", "batch_size"}),
+    "reindex": ("search:rebuild_search_indexes", "io", set()),
+    # Runs in a thread so the rebuilt index replaces the one this process serves
+    "patient_index": ("sources:rebuild_patient_index", "io", set()),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    job_type TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS job_owners (
+    owner TEXT PRIMARY KEY,
+    lease_until REAL NOT NULL
+);
+"""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+# Owners are "<pid>:<random id>", unique per app process start; a pid alone is reused after a container restart
+def _live_owners(conn, now=None):
+    now = time.time() if now is None else now
+    return {row["owner"] for row in conn.execute("SELECT owner FROM job_owners WHERE lease_until > ?", (now,))}
+
+
+def _row_to_job(row):
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    job["cancel_requested"] = bool(job["cancel_requested"])
+    return job
+
+
+# ----- EXECUTION (runs in a worker thread or process) -----
+
+def _resolve(target):
+    module_name, function_name = target.split(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def execute_job(job_id, target, db_path=JOBS_DB):
+    """Run one claimed job to completion and record its outcome."""
+    conn = _connect(db_path)
+    row = conn.execute("SELECT params FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    last_write = [0.0]
+
+    def progress(fraction, message=None):
+        # Cancellation is cooperative: it is noticed the next time the job reports progress
+        if conn.execute("SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,)).fetchone()[0]:
+            raise JobCancelled()
+        now = time.monotonic()
+        if fraction >= 1.0 or now - last_write[0] >= PROGRESS_INTERVAL:
+            last_write[0] = now
+            conn.execute("UPDATE jobs SET progress = ?, message = ? WHERE job_id = ?",
+                         (round(min(max(fraction, 0.0), 1.0), 4), message, job_id))
+            conn.commit()
+
+    try:
+        result = _resolve(target)(progress=progress, **json.loads(row["params"]))
+        conn.execute("""
+        UPDATE jobs SET status = 'succeeded', progress = 1, result = ?, finished_at = ? WHERE job_id = ?
+        """, (json.dumps(result, default=str), _now(), job_id))
+        status = "succeeded"
+    except JobCancelled:
+        conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE job_id = ?", (_now(), job_id))
+        status = "cancelled"
+    except Exception as e:
+        print(f"Job {job_id} failed: {e}")
+        conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE job_id = ?",
+                     (str(e), _now(), job_id))
+        status = "failed"
+    conn.commit()
+    conn.close()
+    return status
+
+
+# ----- QUEUE -----
+
+class JobQueue:
+    """SQLite-backed job queue with a scheduler task on the app's event loop."""
+
+    def __init__(self, db_path=JOBS_DB, process_workers=JOB_PROCESS_WORKERS, io_workers=JOB_IO_WORKERS):
+        self.db_path = db_path
+        self.process_workers = process_workers
+        self.io_workers = io_workers
+        self._running = {"process": 0, "io": 0}
+        self._processes = None
+        self._threads = None
+        self._wake = None
+        self._task = None
+        self.owner = None
+
+    def _db(self):
+        conn = _connect(self.db_path)
+        conn.executescript(SCHEMA)
+        return conn
+
+    # ----- API -----
+
+    def submit(self, job_type, params=None):
+        if job_type not in JOB_TYPES:
+            raise ValueError(f"Unknown job type: {job_type}")
+        params = params or {}
+        unknown = set(params) - JOB_TYPES[job_type][2]
+        if unknown:
+            raise ValueError(f"Unknown parameter(s) for {job_type}: {', '.join(sorted(unknown))}")
+
+        job_id = uuid.uuid4().hex
+        conn = self._db()
+        conn.execute("""
+        INSERT INTO jobs (job_id, job_type, params, status, created_at) VALUES (?, ?, ?, 'queued', ?)
+        """, (job_id, job_type, json.dumps(params), _now()))
+        conn.commit()
+        conn.close()
+        metrics.increment(f"jobs.{job_type}.submitted")
+        return self.get(job_id)
+
+    def get(self, job_id):
+        conn = self._db()
+        row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        conn.close()
+        return _row_to_job(row) if row else None
+
+    def list(self, status=None, limit=50):
+        conn = self._db()
+        if status:
+            rows = conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?",
+                                (status, limit)).fetchall()
+        else:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        conn.close()
+        return [_row_to_job(row) for row in rows]
+
+    def cancel(self, job_id):
+        conn = self._db()
+        # Queued jobs are cancelled outright; running ones stop at their next progress report
+        conn.execute("""
+        UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE job_id = ? AND status = 'queued'
+        """, (_now(), job_id))
+        conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND status = 'running'", (job_id,))
+        conn.commit()
+        conn.close()
+        return self.get(job_id)
+
+    # ----- SCHEDULER -----
+
+    # Wake the scheduler after a submit instead of waiting for the next poll; call from the event loop
+    def notify(self):
+        if self._wake:
+            self._wake.set()
+
+    # Renew this process's lease, so other workers leave its running jobs alone
+    def _renew_lease(self):
+        conn = self._db()
+        conn.execute("INSERT OR REPLACE INTO job_owners (owner, lease_until) VALUES (?, ?)",
+                     (self.owner, time.time() + OWNER_LEASE_SECONDS))
+        conn.commit()
+        conn.close()
+
+    def _release_lease(self):
+        conn = self._db()
+        conn.execute("DELETE FROM job_owners WHERE owner = ?", (self.owner,))
+        conn.commit()
+        conn.close()
+
+    def _recover(self):
+        conn = self._db()
+        # Queue files from before jobs had owners
+        if "owner" not in {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}:
+            conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+
+        # Jobs interrupted by a shutdown or crash run again from the start; other workers' running jobs are theirs
+        live = _live_owners(conn) | {self.owner}
+        rows = conn.execute("SELECT job_id, owner, cancel_requested FROM jobs WHERE status = 'running'").fetchall()
+        orphaned = [row for row in rows if row["owner"] not in live]
+        conn.executemany("""
+        UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE job_id = ? AND status = 'running'
+        """, [(_now(), row["job_id"]) for row in orphaned if row["cancel_requested"]])
+        recovered = 0
+        for row in orphaned:
+            if not row["cancel_requested"]:
+                recovered += conn.execute("""
+                UPDATE jobs SET status = 'queued', progress = 0, message = 'requeued after restart',
+                    started_at = NULL, owner = NULL
+                WHERE job_id = ? AND status = 'running'
+                """, (row["job_id"],)).rowcount
+        conn.execute("DELETE FROM job_owners WHERE lease_until <= ?", (time.time(),))
+        conn.commit()
+        conn.close()
+        if recovered:
+            print(f"Requeued {recovered} interrupted job(s)")
+
+    def _claim(self, kind, slots):
+        job_types = [name for name, (_, job_kind, _) in JOB_TYPES.items() if job_kind == kind]
+        conn = self._db()
+        rows = conn.execute(f"""
+        SELECT job_id, job_type FROM jobs
+        WHERE status = 'queued' AND job_type IN ({', '.join('?' * len(job_types))})
+        ORDER BY created_at LIMIT ?
+        """, (*job_types, slots)).fetchall()
+        claimed = []
+        for row in rows:
+            updated = conn.execute("""
+            UPDATE jobs SET status = 'running', started_at = ?, owner = ? WHERE job_id = ? AND status = 'queued'
+            """, (_now(), self.owner, row["job_id"])).rowcount
+            if updated:
+                claimed.append((row["job_id"], row["job_type"]))
+        conn.commit()
+        conn.close()
+        return claimed
+
+    async def _execute(self, kind, job_id, job_type):
+        loop = asyncio.get_running_loop()
+        executor = self._processes if kind == "process" else self._threads
+        started = time.perf_counter()
+        try:
+            target = JOB_TYPES[job_type][0]
+            status = await loop.run_in_executor(executor, execute_job, job_id, target, self.db_path)
+            metrics.increment(f"jobs.{job_type}.{status}")
+            # Jobs may have rewritten claims in another process, so cached aggregates are stale
+            if status == "succeeded":
+                analytics.invalidate()
+                if job_type == "adjudicate":
+                    await self._announce_adjudication(job_id)
+        except Exception as e:
+            # The worker itself died (e.g. a killed process); the job stays visible as failed
+            print(f"Job {job_id} worker error: {e}")
+            conn = self._db()
+            conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE job_id = ?",
+                         (f"worker error: {e}", _now(), job_id))
+            conn.commit()
+            conn.close()
+        finally:
+            metrics.observe(f"jobs.{job_type}", time.perf_counter() - started)
+            self._running[kind] -= 1
+            self._wake.set()
+
+    # The worker process wrote the claims; read back which, to announce and audit each one
+    async def _announce_adjudication(self, job_id):
+        import adjudication
+        try:
+            result = (await asyncio.to_thread(self.get, job_id))["result"] or {}
+            claims = await asyncio.to_thread(adjudication.adjudicated_claims, result.get("adjudicated_at"))
+        except Exception as e:
+            # The job itself succeeded; clients still get the bulk refresh
+            print(f"Job {job_id} adjudicated claims could not be read back: {e}")
+            result, claims = {}, []
+        events.claims_adjudicated(claims, {"job_id": job_id, **result})
+        audit_log.record_many("claim.adjudicated", "claim", [claim["claim_id"] for claim in claims],
+                              adjudication.ADJUDICATED_FIELDS)
+        if not claims and result.get("claims") != 0:
+            # Which claims changed is unknown; the run is still recorded
+            audit_log.record("claims.adjudicated", "claim", "*")
+
+    async def _run(self):
+        limits = {"process": self.process_workers, "io": self.io_workers}
+        last_renewal = time.monotonic()
+        while True:
+            try:
+                # Renewing also picks up jobs whose worker died since this process started
+                if time.monotonic() - last_renewal >= OWNER_LEASE_SECONDS / 4:
+                    await asyncio.to_thread(self._renew_lease)
+                    await asyncio.to_thread(self._recover)
+                    last_renewal = time.monotonic()
+                for kind, limit in limits.items():
+                    slots = limit - self._running[kind]
+                    if slots <= 0:
+                        continue
+                    for job_id, job_type in await asyncio.to_thread(self._claim, kind, slots):
+                        self._running[kind] += 1
+                        asyncio.create_task(self._execute(kind, job_id, job_type))
+            except Exception as e:
+                # A locked or unreadable queue file must not stop the scheduler; it tries again next poll
+                print(f"Job scheduler error: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def start(self):
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._renew_lease()
+        self._recover()
+        # Spawned, not forked: a fork could copy locks held by the app's driver and SQLite threads
+        self._processes = ProcessPoolExecutor(max_workers=self.process_workers,
+                                              mp_context=multiprocessing.get_context("spawn"))
+        self._threads = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix="job")
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        # Running jobs are abandoned and requeued by the next _recover, here or in another worker
+        if self.owner:
+            self._release_lease()
+        if self._processes:
+            self._processes.shutdown(wait=False, cancel_futures=True)
+        if self._threads:
+            self._threads.shutdown(wait=False, cancel_futures=True)
+
+
+queue = JobQueue()
@@ -1,30 +1,98 @@
-from fastapi import FastAPI
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 import uvicorn
 from routes import router
 import sql_scripts
 import neo4j_scripts
+from reference_data import cache as reference_cache
+from outbox import dispatcher as outbox_dispatcher
+from events import broker as event_broker
+from audit import log as audit_log
+from jobs import queue as job_queue
+from resilience import BackendUnavailable, LoadSheddingMiddleware
+from compression import CompressionMiddleware
+from ratelimit import RateLimitMiddleware
+from database import close_connections, sql_server
+from replication import SESSION_HEADER, ReadRoutingMiddleware, monitor as replica_monitor
+import sources
+
+
+# Start and stop background services with the application
+@asynccontextmanager
+async def lifespan(app):
+    # Doctors and insurance providers are served from memory by the routes
+    reference_cache.start()
+    # Cross-store updates written to the outbox tables are applied in the background
+    outbox_dispatcher.start()
+    # Long-running operations submitted through /api/jobs
+    job_queue.start()
+    # Claim and policy changes pushed to /api/events subscribers
+    event_broker.start()
+    # Replication lag of the SQL read replicas, when SQL_REPLICAS lists any
+    replica_monitor.start([sql_server])
+    # Audit events queued by the write routes are appended to the audit log in batches
+    audit_log.start()
+    yield
+    await job_queue.stop()
+    replica_monitor.stop()
+    # After the job queue, so events from jobs finishing at shutdown are written too
+    audit_log.stop()
+    outbox_dispatcher.stop()
+    reference_cache.stop()
+    sources.catalog.close()
+    close_connections()
+
 
 # Create FastAPI app
 app = FastAPI(
     title="Healthcare and Insurance Integration System",
     description="A federated database system connecting healthcare providers and insurance companies",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-# Add CORS middleware
+# Send read-only requests to replicas, honouring the client's session token for its own writes
+app.add_middleware(ReadRoutingMiddleware)
+
+# Shed load with 503 + Retry-After before requests pile up in the worker
+app.add_middleware(LoadSheddingMiddleware)
+
+# Per-client token buckets: 429 + Retry-After for clients over their limits, before they take a concurrency slot
+app.add_middleware(RateLimitMiddleware)
+
+# Negotiated gzip/brotli/zstd compression of responses above a size threshold
+app.add_middleware(CompressionMiddleware)
+
+# Add CORS middleware (added last so it wraps every response, including shed ones)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allow all origins (not recommended for production)
     allow_credentials=True,
     allow_methods=["*"],  # Allow all methods
     allow_headers=["*"],  # Allow all headers
+    expose_headers=[SESSION_HEADER, "Retry-After"],  # Read-your-writes token, and when to retry a 429/503
 )
 
 # Include routes
 app.include_router(router, prefix="/api")
 
 
+# A backend that is down or fenced off by its circuit breaker is a 503, not a 500
+@app.exception_handler(BackendUnavailable)
+async def backend_unavailable_handler(request: Request, exc: BackendUnavailable):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc), "backend": exc.backend},
+        headers={"Retry-After": str(int(exc.retry_after))}
+    )
+
+
 # Root endpoint
 @app.get("/")
 async def root():
@@ -41,27 +109,47 @@ async def root():
             "/api/medical_records/",
             "/api/insurance_policies/",
             "/api/claims/",
-            "/api/claims/{claim_id}/complete"
+            "/api/claims/{claim_id}/complete",
+            "/api/sources",
+            "/api/sources/{source}/patients/{patient_id}/complete",
+            "/api/patient_index/{source}/{patient_id}",
+            "/api/events"
         ]
     }
 
 
-# Initialize database function
-def init_db():
+# Sample data is only written to development databases, when asked for
+SEED_SAMPLE_DATA = os.getenv("SEED_SAMPLE_DATA", "").lower() in ("1", "true", "yes")
+
+
+# Initialize database function (non-destructive: schemas are applied only when their stored version is stale)
+def init_db(seed=SEED_SAMPLE_DATA):
     print("Initializing databases...")
-    try:
-        # Create SQL Server database
-        sql_scripts.create_hospital_database()
+    started = time.perf_counter()
+
+    # Both stores are checked at the same time
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        checks = {
+            "SQL Server": executor.submit(sql_scripts.ensure_hospital_schema),
+            "Neo4j": executor.submit(neo4j_scripts.ensure_insurance_schema),
+        }
+    for name, check in checks.items():
+        try:
+            check.result()
+        except Exception as e:
+            print(f"Error initializing {name}: {e}")
 
-        # Create Neo4j database
-        neo4j_scripts.create_insurance_database()
+    if seed:
+        try:
+            sql_scripts.insert_hospital_data()
+            neo4j_scripts.insert_insurance_data()
+        except Exception as e:
+            print(f"Error inserting sample data: {e}")
 
-        print("Databases initialized successfully!")
-    except Exception as e:
-        print(f"Error initializing databases: {e}")
+    print(f"Databases initialized in {(time.perf_counter() - started) * 1000:.0f} ms")
 
 
 # Run the application
 if __name__ == "__main__":
-    init_db()  # Initialize databases before starting the app
+    init_db(seed=SEED_SAMPLE_DATA or "--seed" in sys.argv)  # Initialize databases before starting the app
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
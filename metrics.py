@@ -0,0 +1,47 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class Metrics:
+    """Process-wide counters and timings, exposed through GET /api/metrics."""
+
+    def __init__(self):
+        self._counters = defaultdict(int)
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            count, total, worst = self._timings.get(name, (0, 0.0, 0.0))
+            self._timings[name] = (count + 1, total + seconds, max(worst, seconds))
+
+    @contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            timings = {
+                name: {
+                    "count": count,
+                    "avg_ms": round(total / count * 1000, 3) if count else 0.0,
+                    "max_ms": round(worst * 1000, 3),
+                    "total_ms": round(total * 1000, 3)
+                }
+                for name, (count, total, worst) in self._timings.items()
+            }
+        return {"counters": counters, "timings": timings}
+
+
+metrics = Metrics()
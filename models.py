@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 from datetime import date
@@ -33,6 +33,27 @@ class MedicalRecord(BaseModel):
     treatment: str
     notes: Optional[str] = None
     record_date: str
+    doctor: Optional[Doctor] = None
+
+
+# Record header for list and federated views; large text columns only when requested with include=
+class MedicalRecordSummary(BaseModel):
+    record_id: int
+    patient_id: int
+    doctor_id: int
+    diagnosis: str
+    record_date: str
+    doctor: Optional[Doctor] = None
+    treatment_length: Optional[int] = None
+    notes_length: Optional[int] = None
+    treatment: Optional[str] = None
+    notes: Optional[str] = None
+
+
+class MedicalRecordText(BaseModel):
+    record_id: int
+    treatment: Optional[str] = None
+    notes: Optional[str] = None
 
 
 # Insurance (Neo4j) models
@@ -47,26 +68,221 @@ class InsurancePolicy(BaseModel):
     coverage_details: Dict[str, Any]
 
 
+class InsuranceProvider(BaseModel):
+    name: str
+    policy_count: int
+    coverage_types: List[str] = []
+
+
 class Claim(BaseModel):
     claim_id: Optional[str] = None
     policy_id: str
     record_id: int
-    claim_date: str
+    claim_date: date
     amount: float
     status: str = "Pending"
     description: str
+    allowed_amount: Optional[float] = None
+    patient_responsibility: Optional[float] = None
+    insurer_payment: Optional[float] = None
+    # Set by the outbox dispatcher: pending, valid or missing_record
+    record_status: Optional[str] = None
+    provider: Optional[InsuranceProvider] = None
+
+
+# Time-windowed, keyset-paginated listings
+class MedicalRecordPage(BaseModel):
+    items: List[MedicalRecordSummary]
+    next_cursor: Optional[str] = None
+
+
+class ClaimPage(BaseModel):
+    items: List[Claim]
+    next_cursor: Optional[str] = None
 
 
 # Federated models (combining data from both sources)
 class PatientComplete(BaseModel):
     patient_info: Patient
     insurance_policies: List[InsurancePolicy]
-    medical_records: List[MedicalRecord]
+    medical_records: List[MedicalRecordSummary]
     claims: List[Claim]
+    partial: bool = False
+    unavailable_sources: List[str] = []
 
 
 class ClaimComplete(BaseModel):
     claim_info: Claim
     policy_info: InsurancePolicy
-    medical_record: MedicalRecord
-    patient_info: Patient
\ No newline at end of file
+    medical_record: Optional[MedicalRecord] = None
+    patient_info: Optional[Patient] = None
+    partial: bool = False
+    unavailable_sources: List[str] = []
+
+
+class TimelineEntry(BaseModel):
+    date: date
+    kind: str
+    medical_record: Optional[MedicalRecordSummary] = None
+    claim: Optional[Claim] = None
+
+
+class PatientTimeline(BaseModel):
+    patient_id: int
+    entries: List[TimelineEntry]
+
+
+# Multi-source federation models (several hospitals and insurers, keyed by source name)
+class SourceInfo(BaseModel):
+    name: str
+    kind: str
+    backend: str
+    timeout: float
+    patient_source: Optional[str] = None
+
+
+class FederatedPatient(BaseModel):
+    patient_info: Patient
+    source: str
+    master_id: int
+    # Local patient IDs of this patient at each hospital that knows them
+    identities: Dict[str, List[int]]
+    medical_records: Dict[str, List[MedicalRecordSummary]]
+    insurance_policies: Dict[str, List[InsurancePolicy]]
+    claims: Dict[str, List[Claim]]
+    partial: bool = False
+    unavailable_sources: List[str] = []
+
+
+class PatientIdentity(BaseModel):
+    source: str
+    patient_id: int
+    master_id: int
+    identities: Dict[str, List[int]]
+
+
+class AuditEvent(BaseModel):
+    # None while the event is still queued for the audit writer
+    event_id: Optional[int] = None
+    at: datetime
+    actor: Optional[str] = None
+    action: str
+    entity_type: str
+    entity_id: str
+    # Names of the fields a write sent; values are not kept in the audit log
+    fields: List[str] = []
+
+
+# Batch lookup models
+MAX_BATCH_IDS = 5000
+
+
+class BatchGetIdsRequest(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=MAX_BATCH_IDS)
+
+
+class BatchGetKeysRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_IDS)
+
+
+class PatientBatch(BaseModel):
+    items: List[Patient]
+    missing: List[int]
+
+
+class MedicalRecordBatch(BaseModel):
+    items: List[MedicalRecord]
+    missing: List[int]
+
+
+class InsurancePolicyBatch(BaseModel):
+    items: List[InsurancePolicy]
+    missing: List[str]
+
+
+class ClaimBatch(BaseModel):
+    items: List[Claim]
+    missing: List[str]
+
+
+# Analytics models (aggregations over the claims graph)
+class ProviderClaimTotal(BaseModel):
+    provider: Optional[str] = None
+    claim_count: int
+    policy_count: int
+    total_amount: float
+
+
+class AnomalousPatient(BaseModel):
+    patient_id: Optional[int] = None
+    claim_count: int
+    total_amount: float
+    z_score: float
+
+
+class SnapshotQueryResult(BaseModel):
+    columns: List[str]
+    rows: List[List[Any]]
+    snapshot: Dict[str, Any]
+    took_ms: float
+
+
+class CareCluster(BaseModel):
+    doctor_id: int
+    doctor_name: str
+    specialization: Optional[str] = None
+    diagnosis: Optional[str] = None
+    patient_count: int
+    record_count: int
+    claim_count: int
+    total_claim_amount: float
+
+
+# Search models (hits merged across both stores)
+class SearchHit(BaseModel):
+    entity: str
+    id: str
+    patient_id: Optional[int] = None
+    title: Optional[str] = None
+    snippet: Optional[str] = None
+    score: float
+    context: Dict[str, Any] = {}
+
+
+class SearchResults(BaseModel):
+    query: str
+    took_ms: float
+    hits: List[SearchHit]
+    unavailable_sources: List[str] = []
+
+
+# Operations models
+class SlowQuery(BaseModel):
+    at: str
+    backend: str
+    statement: str
+    duration_ms: float
+    rows: int
+    params: Optional[Any] = None
+    text: Optional[str] = None
+
+
+# Background job models
+class JobRequest(BaseModel):
+    job_type: str
+    params: Dict[str, Any] = {}
+
+
+class Job(BaseModel):
+    job_id: str
+    job_type: str
+    params: Dict[str, Any]
+    status: str
+    progress: float
+    message: Optional[str] = None
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
@@ -1,126 +1,136 @@
 from database import Neo4jConnection
 
+# Bump whenever create_insurance_schema changes, so existing graphs apply it on their next start
+SCHEMA_VERSION = 7
 
-def create_insurance_database():
-    neo4j_conn = Neo4jConnection()
-
+SCHEMA_STATEMENTS = [
     # Create constraints for unique IDs
-    neo4j_conn.query("CREATE CONSTRAINT policy_id IF NOT EXISTS FOR (p:InsurancePolicy) REQUIRE p.policy_id IS UNIQUE")
-    neo4j_conn.query("CREATE CONSTRAINT claim_id IF NOT EXISTS FOR (c:Claim) REQUIRE c.claim_id IS UNIQUE")
+    "CREATE CONSTRAINT policy_id IF NOT EXISTS FOR (p:InsurancePolicy) REQUIRE p.policy_id IS UNIQUE",
+    "CREATE CONSTRAINT claim_id IF NOT EXISTS FOR (c:Claim) REQUIRE c.claim_id IS UNIQUE",
+    # Indexes used by federated joins and claim analytics
+    "CREATE INDEX policy_patient_id IF NOT EXISTS FOR (p:InsurancePolicy) ON (p.patient_id)",
+    "CREATE INDEX claim_record_id IF NOT EXISTS FOR (c:Claim) ON (c.record_id)",
+    "CREATE INDEX claim_status IF NOT EXISTS FOR (c:Claim) ON (c.status)",
+    "CREATE INDEX claim_updated_at IF NOT EXISTS FOR (c:Claim) ON (c.updated_at)",
+    "CREATE INDEX claim_date IF NOT EXISTS FOR (c:Claim) ON (c.claim_date)",
+    # Finds the claims one adjudication run wrote (see adjudication.adjudicated_claims)
+    "CREATE INDEX claim_adjudicated_at IF NOT EXISTS FOR (c:Claim) ON (c.adjudicated_at)",
+    # Records that lost a claim since the last export (see queries.CLAIM_TOMBSTONE)
+    "CREATE INDEX claim_tombstone_removed_at IF NOT EXISTS FOR (t:ClaimTombstone) ON (t.removed_at)",
+    "CREATE FULLTEXT INDEX claim_description IF NOT EXISTS FOR (c:Claim) ON EACH [c.description]",
+    "CREATE INDEX outbox_created_at IF NOT EXISTS FOR (e:OutboxEvent) ON (e.created_at)",
+    "CREATE CONSTRAINT outbox_event_id IF NOT EXISTS FOR (e:OutboxEvent) REQUIRE e.event_id IS UNIQUE",
+    "CREATE CONSTRAINT schema_version_component IF NOT EXISTS FOR (v:SchemaVersion) REQUIRE v.component IS UNIQUE",
+]
+
+# Sample insurance policies with flattened properties instead of nested maps
+SAMPLE_POLICIES = [
+    {"policy_id": "POL001", "patient_id": 1041, "provider": "BlueCross", "policy_number": "BC12345",
+     "coverage_type": "Family", "start_date": "2023-01-01", "end_date": "2023-12-31",
+     "deductible": 500, "copay": 20, "max_out_of_pocket": 5000, "coverage_percentage": 80},
+    {"policy_id": "POL002", "patient_id": 1042, "provider": "Aetna", "policy_number": "AE67890",
+     "coverage_type": "Individual", "start_date": "2023-01-01", "end_date": "2023-12-31",
+     "deductible": 1000, "copay": 30, "max_out_of_pocket": 6000, "coverage_percentage": 70},
+    {"policy_id": "POL003", "patient_id": 1043, "provider": "UnitedHealth", "policy_number": "UH54321",
+     "coverage_type": "Individual", "start_date": "2023-01-01", "end_date": "2023-12-31",
+     "deductible": 750, "copay": 25, "max_out_of_pocket": 5500, "coverage_percentage": 75},
+]
 
-    # Clear existing data to avoid conflicts
-    neo4j_conn.query("MATCH (c:Claim) DETACH DELETE c")
-    neo4j_conn.query("MATCH (p:InsurancePolicy) DELETE p")
+SAMPLE_CLAIMS = [
+    {"claim_id": "CLM001", "policy_id": "POL001", "record_id": 1, "claim_date": "2023-01-15",
+     "amount": 150.00, "status": "Approved", "description": "Office visit and prescription"},
+    {"claim_id": "CLM002", "policy_id": "POL001", "record_id": 2, "claim_date": "2023-03-20",
+     "amount": 75.00, "status": "Approved", "description": "Follow-up visit"},
+    {"claim_id": "CLM003", "policy_id": "POL002", "record_id": 3, "claim_date": "2023-02-25",
+     "amount": 350.00, "status": "Processing", "description": "X-ray and orthopedic consult"},
+    {"claim_id": "CLM004", "policy_id": "POL003", "record_id": 4, "claim_date": "2023-04-10",
+     "amount": 560.00, "status": "Pending", "description": "Cardiology tests and consultation"},
+]
 
-    # Create sample insurance policies with flattened properties instead of nested maps
+
+def schema_version(neo4j_conn):
+    """Schema version recorded in the graph (0 when none has been recorded)."""
+    result = neo4j_conn.query(
+        "OPTIONAL MATCH (v:SchemaVersion {component: 'insurance'}) RETURN coalesce(v.version, 0) AS version"
+    )
+    return result[0]["version"] if result else 0
+
+
+def ensure_insurance_schema():
+    """Apply the insurance schema only when the recorded version is older than SCHEMA_VERSION."""
+    neo4j_conn = Neo4jConnection()
+    if schema_version(neo4j_conn) >= SCHEMA_VERSION:
+        neo4j_conn.close()
+        return False
+    create_insurance_schema(neo4j_conn)
     neo4j_conn.query("""
-    MERGE (p1:InsurancePolicy {
-        policy_id: 'POL001',
-        patient_id: 1041,
-        provider: 'BlueCross',
-        policy_number: 'BC12345',
-        coverage_type: 'Family',
-        start_date: '2023-01-01',
-        end_date: '2023-12-31',
-        deductible: 500,
-        copay: 20,
-        max_out_of_pocket: 5000,
-        coverage_percentage: 80
-    })
-
-    MERGE (p2:InsurancePolicy {
-        policy_id: 'POL002',
-        patient_id: 1042,
-        provider: 'Aetna',
-        policy_number: 'AE67890',
-        coverage_type: 'Individual',
-        start_date: '2023-01-01',
-        end_date: '2023-12-31',
-        deductible: 1000,
-        copay: 30,
-        max_out_of_pocket: 6000,
-        coverage_percentage: 70
-    })
-
-    MERGE (p3:InsurancePolicy {
-        policy_id: 'POL003',
-        patient_id: 1043,
-        provider: 'UnitedHealth',
-        policy_number: 'UH54321',
-        coverage_type: 'Individual',
-        start_date: '2023-01-01',
-        end_date: '2023-12-31',
-        deductible: 750,
-        copay: 25,
-        max_out_of_pocket: 5500,
-        coverage_percentage: 75
-    })
-    """)
+    MERGE (v:SchemaVersion {component: 'insurance'})
+    SET v.version = $version, v.applied_at = datetime()
+    """, {"version": SCHEMA_VERSION})
+    neo4j_conn.close()
+    print(f"Insurance schema upgraded to version {SCHEMA_VERSION}.")
+    return True
+
+
+def create_insurance_schema(neo4j_conn):
+    for statement in SCHEMA_STATEMENTS:
+        neo4j_conn.query(statement)
+    migrate_claim_dates(neo4j_conn)
+    migrate_policy_years(neo4j_conn)
 
-    # Create sample claims with proper WITH clauses between MERGE and MATCH
+
+def insert_insurance_data():
+    """Create the sample policies and claims that are missing; existing nodes are left untouched."""
+    neo4j_conn = Neo4jConnection()
     neo4j_conn.query("""
-    MERGE (c1:Claim {
-        claim_id: 'CLM001',
-        policy_id: 'POL001',
-        record_id: 1,
-        claim_date: '2023-01-15',
-        amount: 150.00,
-        status: 'Approved',
-        description: 'Office visit and prescription'
-    })
-    WITH c1
-    MATCH (p:InsurancePolicy {policy_id: 'POL001'})
-    MERGE (c1)-[:FILED_UNDER]->(p)
-    """)
+    UNWIND $policies AS policy
+    MERGE (p:InsurancePolicy {policy_id: policy.policy_id})
+    ON CREATE SET p += policy, p.version = 1
+    """, {"policies": SAMPLE_POLICIES})
 
     neo4j_conn.query("""
-    MERGE (c2:Claim {
-        claim_id: 'CLM002',
-        policy_id: 'POL001',
-        record_id: 2,
-        claim_date: '2023-03-20',
-        amount: 75.00,
-        status: 'Approved',
-        description: 'Follow-up visit'
-    })
-    WITH c2
-    MATCH (p:InsurancePolicy {policy_id: 'POL001'})
-    MERGE (c2)-[:FILED_UNDER]->(p)
-    """)
+    UNWIND $claims AS claim
+    MATCH (p:InsurancePolicy {policy_id: claim.policy_id})
+    MERGE (c:Claim {claim_id: claim.claim_id})
+    ON CREATE SET c += claim, c.claim_date = date(claim.claim_date), c.version = 1
+    MERGE (c)-[:FILED_UNDER]->(p)
+    """, {"claims": SAMPLE_CLAIMS})
+    neo4j_conn.close()
+    print("Insurance sample data inserted.")
+
+
+def create_insurance_database():
+    neo4j_conn = Neo4jConnection()
+    create_insurance_schema(neo4j_conn)
+    neo4j_conn.close()
+    insert_insurance_data()
+    print("Insurance database created successfully with sample data!")
+
 
+def migrate_claim_dates(neo4j_conn):
+    """Convert claim_date values stored as ISO strings to native dates, so date ranges can use the index."""
     neo4j_conn.query("""
-    MERGE (c3:Claim {
-        claim_id: 'CLM003',
-        policy_id: 'POL002',
-        record_id: 3,
-        claim_date: '2023-02-25',
-        amount: 350.00,
-        status: 'Processing',
-        description: 'X-ray and orthopedic consult'
-    })
-    WITH c3
-    MATCH (p:InsurancePolicy {policy_id: 'POL002'})
-    MERGE (c3)-[:FILED_UNDER]->(p)
+    MATCH (c:Claim)
+    WHERE c.claim_date IS NOT NULL AND toString(c.claim_date) = c.claim_date
+    CALL {
+        WITH c
+        SET c.claim_date = date(c.claim_date), c.version = coalesce(c.version, 0) + 1
+    } IN TRANSACTIONS OF 10000 ROWS
     """)
 
+
+
+def migrate_policy_years(neo4j_conn):
+    """Turn policy years stored as anniversary counts into the calendar year the policy year began."""
     neo4j_conn.query("""
-    MERGE (c4:Claim {
-        claim_id: 'CLM004',
-        policy_id: 'POL003',
-        record_id: 4,
-        claim_date: '2023-04-10',
-        amount: 560.00,
-        status: 'Pending',
-        description: 'Cardiology tests and consultation'
-    })
-    WITH c4
-    MATCH (p:InsurancePolicy {policy_id: 'POL003'})
-    MERGE (c4)-[:FILED_UNDER]->(p)
+    MATCH (c:Claim)-[:FILED_UNDER]->(p:InsurancePolicy)
+    WHERE c.policy_year IS NOT NULL AND c.policy_year < 1000 AND p.start_date IS NOT NULL
+    CALL {
+        WITH c, p
+        SET c.policy_year = date(p.start_date).year + c.policy_year, c.version = coalesce(c.version, 0) + 1
+    } IN TRANSACTIONS OF 10000 ROWS
     """)
 
-    neo4j_conn.close()
-    print("Insurance database created successfully with sample data!")
-
 
 if __name__ == "__main__":
     create_insurance_database()
\ No newline at end of file
@@ -0,0 +1,219 @@
+import json
+import os
+import threading
+
+import analytics
+import queries
+from database import get_sql_connection, Neo4jConnection
+from metrics import metrics
+
+# How often the dispatcher looks for undelivered events when nothing wakes it earlier
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+
+# Events applied per round trip to the other store
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+
+# ----- SQL SERVER -> NEO4J -----
+
+# Graph updates for each SQL-side event type, applied to a whole batch with UNWIND
+GRAPH_UPDATES = {
+    # Policies and claims of a deleted patient are removed with it
+    "patient_deleted": queries.cypher("outbox.patient_deleted", """
+    UNWIND $payloads AS payload
+    MATCH (p:InsurancePolicy {patient_id: payload.patient_id})
+    OPTIONAL MATCH (c:Claim)-[:FILED_UNDER]->(p)
+    DETACH DELETE c, p
+    """),
+    # Claims filed for a deleted record no longer have anything to pay for
+    "medical_record_deleted": queries.cypher("outbox.medical_record_deleted", """
+    UNWIND $payloads AS payload
+    MATCH (c:Claim {record_id: payload.record_id})
+    DETACH DELETE c
+    """),
+}
+
+ENQUEUE_SQL_EVENT = queries.sql("outbox.enqueue", "INSERT INTO FederationOutbox (event_type, payload) VALUES (?, ?)")
+
+PENDING_SQL_EVENTS = queries.sql("outbox.pending_sql_events", """
+SELECT TOP (?) event_id, event_type, payload
+FROM FederationOutbox
+WHERE dispatched_at IS NULL
+ORDER BY event_id
+""")
+
+MARK_SQL_EVENTS_FAILED = queries.sql("outbox.mark_failed", """
+UPDATE o SET attempts = attempts + 1, last_error = ?
+FROM FederationOutbox o
+JOIN OPENJSON(?) WITH (id BIGINT '$') ids ON ids.id = o.event_id
+""")
+
+MARK_SQL_EVENTS_DISPATCHED = queries.sql("outbox.mark_dispatched", """
+UPDATE o SET dispatched_at = SYSUTCDATETIME()
+FROM FederationOutbox o
+JOIN OPENJSON(?) WITH (id BIGINT '$') ids ON ids.id = o.event_id
+""")
+
+
+# Append an event to the SQL outbox; call before conn.commit() so it shares the write's transaction
+def enqueue_sql(cursor, event_type, payload):
+    cursor.execute(ENQUEUE_SQL_EVENT, (event_type, json.dumps(payload)))
+
+
+def _dispatch_sql_events():
+    conn = get_sql_connection()
+    cursor = conn.cursor()
+    cursor.execute(PENDING_SQL_EVENTS, (OUTBOX_BATCH_SIZE,))
+    events = cursor.fetchall()
+    if not events:
+        cursor.close()
+        conn.close()
+        return 0
+
+    # Group consecutive events of the same type so ordering across types is preserved
+    batches = []
+    for event_id, event_type, payload in events:
+        if not batches or batches[-1][0] != event_type:
+            batches.append((event_type, [], []))
+        batches[-1][1].append(event_id)
+        batches[-1][2].append(json.loads(payload))
+
+    neo4j_conn = Neo4jConnection()
+    dispatched = []
+    try:
+        for event_type, event_ids, payloads in batches:
+            query = GRAPH_UPDATES.get(event_type)
+            if query is None:
+                print(f"Unknown outbox event type: {event_type}")
+            else:
+                # Updates are idempotent, so a batch retried after a crash is harmless
+                neo4j_conn.query(query, {"payloads": payloads})
+            dispatched.extend(event_ids)
+    except Exception as e:
+        print(f"Outbox dispatch to Neo4j failed: {e}")
+        failed = [event_id for _, event_ids, _ in batches for event_id in event_ids if event_id not in dispatched]
+        cursor.execute(MARK_SQL_EVENTS_FAILED, (str(e)[:4000], json.dumps(failed)))
+        metrics.increment("outbox.sql.failed", len(failed))
+    finally:
+        neo4j_conn.close()
+
+    if dispatched:
+        cursor.execute(MARK_SQL_EVENTS_DISPATCHED, (json.dumps(dispatched),))
+        analytics.invalidate()
+    conn.commit()
+    cursor.close()
+    conn.close()
+    metrics.increment("outbox.sql.dispatched", len(dispatched))
+    return len(dispatched)
+
+
+# ----- NEO4J -> SQL SERVER -----
+
+# Claim writes create OutboxEvent nodes in the same statement (see queries.CLAIM_VALIDATION_EVENT)
+PENDING_GRAPH_EVENTS_QUERY = queries.cypher("outbox.pending_graph_events", """
+MATCH (e:OutboxEvent)
+RETURN e.event_id AS event_id, e.claim_id AS claim_id, e.record_id AS record_id
+ORDER BY e.created_at
+LIMIT $limit
+""")
+
+APPLY_RECORD_CHECKS_QUERY = queries.cypher("outbox.apply_record_checks", """
+UNWIND $checks AS check
+MATCH (c:Claim {claim_id: check.claim_id})
+WHERE c.record_id = check.record_id
+SET c.record_status = check.record_status, c.version = coalesce(c.version, 0) + 1, c.updated_at = datetime()
+WITH count(*) AS updated
+MATCH (e:OutboxEvent) WHERE e.event_id IN $event_ids
+DETACH DELETE e
+""")
+
+EXISTING_RECORDS = queries.sql("outbox.existing_records", """
+SELECT m.record_id
+FROM MedicalRecords m
+JOIN OPENJSON(?) WITH (id INT '$') ids ON ids.id = m.record_id
+""")
+
+
+def _dispatch_graph_events():
+    neo4j_conn = Neo4jConnection()
+    try:
+        events = neo4j_conn.query(PENDING_GRAPH_EVENTS_QUERY, {"limit": OUTBOX_BATCH_SIZE})
+        if not events:
+            return 0
+
+        # One SQL round trip tells which of the referenced records exist
+        record_ids = sorted({event["record_id"] for event in events if event["record_id"] is not None})
+        conn = get_sql_connection()
+        cursor = conn.cursor()
+        cursor.execute(EXISTING_RECORDS, (json.dumps(record_ids),))
+        existing = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+        conn.close()
+
+        checks = [
+            {
+                "claim_id": event["claim_id"],
+                "record_id": event["record_id"],
+                "record_status": "valid" if event["record_id"] in existing else "missing_record"
+            }
+            for event in events
+        ]
+        neo4j_conn.query(APPLY_RECORD_CHECKS_QUERY, {
+            "checks": checks,
+            "event_ids": [event["event_id"] for event in events]
+        })
+    finally:
+        neo4j_conn.close()
+
+    invalid = sum(1 for check in checks if check["record_status"] != "valid")
+    metrics.increment("outbox.graph.dispatched", len(checks))
+    metrics.increment("outbox.graph.missing_record", invalid)
+    return len(checks)
+
+
+# ----- DISPATCHER -----
+
+class OutboxDispatcher:
+    """Background thread that delivers outbox events from each store to the other."""
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def dispatch_once(self):
+        delivered = {}
+        for name, dispatch in (("sql", _dispatch_sql_events), ("graph", _dispatch_graph_events)):
+            try:
+                delivered[name] = dispatch()
+            except Exception as e:
+                print(f"Outbox dispatch ({name}) failed: {e}")
+                delivered[name] = 0
+        return delivered
+
+    # Ask for a dispatch soon after a write instead of waiting for the next poll
+    def notify(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(OUTBOX_POLL_SECONDS)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            # Drain full batches back to back, then go back to waiting
+            while not self._stop.is_set():
+                delivered = self.dispatch_once()
+                if max(delivered.values()) < OUTBOX_BATCH_SIZE:
+                    break
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+
+dispatcher = OutboxDispatcher()
@@ -0,0 +1,377 @@
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import defaultdict
+from datetime import date, datetime, timezone
+
+from metrics import metrics
+
+# Local file holding the cross-reference, so it survives restarts without rescanning every hospital
+PATIENT_INDEX_DB = os.getenv("PATIENT_INDEX_DB", "patient_index.sqlite3")
+
+# Score at or above which two patient records are taken to be the same person
+MATCH_THRESHOLD = float(os.getenv("PATIENT_MATCH_THRESHOLD", "0.85"))
+
+# Blocks larger than this (a shared placeholder phone, say) are too unspecific to compare against
+MAX_BLOCK_SIZE = 500
+
+# Field weights for match_score; contact details only add evidence, since people move and change numbers
+NAME_WEIGHTS = (0.25, 0.35)
+DOB_WEIGHT = 0.3
+CONTACT_WEIGHT = 0.1
+
+# First-name similarity below which a shared phone or email no longer counts: relatives share those
+# (twins "Anna" and "Emma" with the household phone), the same person spelled differently does not
+MIN_FIRST_NAME_FOR_CONTACT = 0.9
+
+GENDERS = {"f": "f", "female": "f", "m": "m", "male": "m", "u": "", "unknown": ""}
+
+# The C implementation is used when installed; the pure-Python version below gives the same scores
+try:
+    from rapidfuzz.distance import JaroWinkler as _rapidfuzz_jaro_winkler
+except ImportError:
+    _rapidfuzz_jaro_winkler = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patient_xref (
+    source TEXT NOT NULL,
+    local_id INTEGER NOT NULL,
+    master_id INTEGER NOT NULL,
+    first_name TEXT,
+    last_name TEXT,
+    date_of_birth TEXT,
+    phone TEXT,
+    email TEXT,
+    gender TEXT,
+    match_score REAL,
+    unmatched_sources TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (source, local_id)
+);
+CREATE INDEX IF NOT EXISTS ix_patient_xref_master ON patient_xref (master_id);
+"""
+
+
+# ----- NORMALIZATION AND MATCHING -----
+
+def _name(value):
+    value = unicodedata.normalize("NFKD", value or "").encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z]", "", value.lower())
+
+
+def _phone(value):
+    digits = re.sub(r"\D", "", value or "")
+    return digits[-10:] if len(digits) >= 7 else ""
+
+
+def _gender(value):
+    value = _name(value)
+    return GENDERS.get(value, value)
+
+
+def _dob(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()[:10]
+    return (value or "")[:10]
+
+
+# (first name, last name, date of birth, phone, email, gender), each reduced to a comparable form
+def normalize(patient):
+    return (
+        _name(patient.get("first_name")),
+        _name(patient.get("last_name")),
+        _dob(patient.get("date_of_birth")),
+        _phone(patient.get("phone")),
+        (patient.get("email") or "").strip().lower(),
+        _gender(patient.get("gender"))
+    )
+
+
+def blocking_keys(record):
+    """Keys of the blocks a record is compared within; only records sharing a block are scored."""
+    first, last, dob, phone, email, _ = record
+    keys = []
+    if dob:
+        keys.append(f"dob:{dob}")
+        # Catches day/month typos for people whose names agree
+        keys.append(f"name:{last[:4]}:{first[:1]}:{dob[:4]}")
+    if phone:
+        keys.append(f"phone:{phone}")
+    if email:
+        keys.append(f"email:{email}")
+    return keys
+
+
+def jaro_winkler(a, b, prefix_scale=0.1):
+    if a == b:
+        return 1.0 if a else 0.0
+    if not a or not b:
+        return 0.0
+    if _rapidfuzz_jaro_winkler is not None:
+        return _rapidfuzz_jaro_winkler.similarity(a, b, prefix_weight=prefix_scale)
+
+    window = max(max(len(a), len(b)) // 2 - 1, 0)
+    a_matched = [False] * len(a)
+    b_matched = [False] * len(b)
+    matches = 0
+    for i, char in enumerate(a):
+        for j in range(max(0, i - window), min(i + window + 1, len(b))):
+            if not b_matched[j] and b[j] == char:
+                a_matched[i] = b_matched[j] = True
+                matches += 1
+                break
+    if not matches:
+        return 0.0
+
+    transpositions = 0
+    j = 0
+    for i, char in enumerate(a):
+        if a_matched[i]:
+            while not b_matched[j]:
+                j += 1
+            if char != b[j]:
+                transpositions += 1
+            j += 1
+    jaro = (matches / len(a) + matches / len(b) + (matches - transpositions / 2) / matches) / 3
+
+    # As in rapidfuzz (and Winkler's original), only fairly similar strings get the common-prefix boost
+    if jaro <= 0.7:
+        return jaro
+    prefix = 0
+    for x, y in zip(a[:4], b[:4]):
+        if x != y:
+            break
+        prefix += 1
+    return jaro + prefix * prefix_scale * (1 - jaro)
+
+
+def match_score(a, b):
+    """Weighted similarity of two normalized records, between 0 and 1; 0 when their genders differ."""
+    if a[5] and b[5] and a[5] != b[5]:
+        return 0.0
+    first_weight, last_weight = NAME_WEIGHTS
+    first = jaro_winkler(a[0], b[0])
+    score = first_weight * first + last_weight * jaro_winkler(a[1], b[1])
+    if a[2] and a[2] == b[2]:
+        score += DOB_WEIGHT
+    if first >= MIN_FIRST_NAME_FOR_CONTACT and ((a[3] and a[3] == b[3]) or (a[4] and a[4] == b[4])):
+        score += CONTACT_WEIGHT
+    return score
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+# ----- INDEX -----
+
+class PatientIndex:
+    """Master patient index: links each hospital's patient records to one master ID per person."""
+
+    def __init__(self, db_path=PATIENT_INDEX_DB):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._loaded = False
+        # (source, local_id) -> (master_id, normalized record)
+        self._entries = {}
+        # master_id -> {(source, local_id)}
+        self._members = defaultdict(set)
+        # blocking key -> {(source, local_id)}
+        self._blocks = defaultdict(set)
+        # (source, local_id) -> sources that were down when it was indexed, so its matches there are still unknown
+        self._unmatched = {}
+        self._next_master = 1
+        self._migrated = False
+
+    def _db(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.executescript(SCHEMA)
+        # Index files from before gender was compared; their rows match without it until the next rebuild
+        if not self._migrated:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(patient_xref)")}
+            if "gender" not in columns:
+                conn.execute("ALTER TABLE patient_xref ADD COLUMN gender TEXT")
+            if "unmatched_sources" not in columns:
+                conn.execute("ALTER TABLE patient_xref ADD COLUMN unmatched_sources TEXT")
+            self._migrated = True
+        return conn
+
+    # Read the stored cross-reference on first use
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            conn = self._db()
+            rows = conn.execute("""
+            SELECT source, local_id, master_id, first_name, last_name, date_of_birth, phone, email, gender,
+                   unmatched_sources
+            FROM patient_xref
+            """).fetchall()
+            conn.close()
+            for source, local_id, master_id, *record, unmatched in rows:
+                self._link((source, local_id), master_id, tuple(field or "" for field in record))
+                if unmatched:
+                    self._unmatched[(source, local_id)] = tuple(unmatched.split(","))
+                self._next_master = max(self._next_master, master_id + 1)
+            self._loaded = True
+
+    def _link(self, ref, master_id, record):
+        self._entries[ref] = (master_id, record)
+        self._members[master_id].add(ref)
+        for key in blocking_keys(record):
+            self._blocks[key].add(ref)
+
+    def _unlink(self, ref):
+        entry = self._entries.pop(ref, None)
+        if entry is None:
+            return
+        master_id, record = entry
+        self._members[master_id].discard(ref)
+        if not self._members[master_id]:
+            del self._members[master_id]
+        for key in blocking_keys(record):
+            self._blocks[key].discard(ref)
+
+    def _best_match(self, ref, record):
+        candidates = set()
+        for key in blocking_keys(record):
+            block = self._blocks.get(key, ())
+            if len(block) <= MAX_BLOCK_SIZE:
+                candidates.update(block)
+        candidates.discard(ref)
+        best, best_score = None, 0.0
+        for candidate in candidates:
+            score = match_score(record, self._entries[candidate][1])
+            if score > best_score:
+                best, best_score = candidate, score
+        metrics.increment("patient_index.comparisons", len(candidates))
+        return best, best_score
+
+    def _add(self, conn, source, patient):
+        ref = (source, patient["patient_id"])
+        record = normalize(patient)
+        # Re-adding a record re-matches it with its current demographics
+        self._unlink(ref)
+        best, score = self._best_match(ref, record)
+        if best is not None and score >= MATCH_THRESHOLD:
+            master_id = self._entries[best][0]
+            metrics.increment("patient_index.matched")
+        else:
+            master_id, score = self._next_master, None
+            self._next_master += 1
+            metrics.increment("patient_index.created")
+        self._link(ref, master_id, record)
+        unmatched = self._unmatched.get(ref)
+        conn.execute("""
+        INSERT OR REPLACE INTO patient_xref
+            (source, local_id, master_id, first_name, last_name, date_of_birth, phone, email, gender,
+             match_score, unmatched_sources, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (*ref, master_id, *record, score, ",".join(unmatched) if unmatched else None, _now()))
+        return master_id
+
+    def add(self, source, patient):
+        """Index (or re-index) one patient record; returns its master ID."""
+        self._ensure_loaded()
+        with self._lock:
+            conn = self._db()
+            master_id = self._add(conn, source, patient)
+            conn.commit()
+            conn.close()
+        return master_id
+
+    # unmatched: (source, local_id) -> sources its matches could not be searched at; empty marks the search done
+    def add_many(self, records, unmatched=None):
+        """Index (source, patient) pairs in one transaction."""
+        self._ensure_loaded()
+        with self._lock:
+            conn = self._db()
+            for ref, sources in (unmatched or {}).items():
+                if sources:
+                    self._unmatched[ref] = tuple(sources)
+                else:
+                    self._unmatched.pop(ref, None)
+                conn.execute("UPDATE patient_xref SET unmatched_sources = ? WHERE source = ? AND local_id = ?",
+                             (",".join(sources) if sources else None, *ref))
+            for source, patient in records:
+                self._add(conn, source, patient)
+            conn.commit()
+            conn.close()
+
+    def remove(self, source, local_id):
+        self._ensure_loaded()
+        with self._lock:
+            self._unlink((source, local_id))
+            self._unmatched.pop((source, local_id), None)
+            conn = self._db()
+            conn.execute("DELETE FROM patient_xref WHERE source = ? AND local_id = ?", (source, local_id))
+            conn.commit()
+            conn.close()
+
+    def master_id(self, source, local_id):
+        self._ensure_loaded()
+        entry = self._entries.get((source, local_id))
+        return entry[0] if entry else None
+
+    # Sources still to be searched for this record's matches (they were down when it was indexed)
+    def unmatched_sources(self, source, local_id):
+        self._ensure_loaded()
+        return self._unmatched.get((source, local_id), ())
+
+    def members(self, master_id):
+        """Local patient IDs of one person, by source."""
+        self._ensure_loaded()
+        identities = defaultdict(list)
+        with self._lock:
+            refs = sorted(self._members.get(master_id, ()))
+        for source, local_id in refs:
+            identities[source].append(local_id)
+        return dict(identities)
+
+    def identities(self, source, local_id):
+        master_id = self.master_id(source, local_id)
+        return None if master_id is None else self.members(master_id)
+
+    def rebuild(self, records, progress=None):
+        """Replace the index with the given (source, patient) pairs, matched from scratch."""
+        records = list(records)
+        with self._lock:
+            self._entries.clear()
+            self._members.clear()
+            self._blocks.clear()
+            self._unmatched.clear()
+            self._next_master = 1
+            self._loaded = True
+            conn = self._db()
+            try:
+                conn.execute("DELETE FROM patient_xref")
+                for count, (source, patient) in enumerate(records, 1):
+                    self._add(conn, source, patient)
+                    if progress and count % 1000 == 0:
+                        progress(count / len(records), f"indexed {count} of {len(records)} patients")
+                conn.commit()
+            except BaseException:
+                # The stored index is untouched; drop the partial one and reload it on next use
+                conn.rollback()
+                self._entries.clear()
+                self._members.clear()
+                self._blocks.clear()
+                self._unmatched.clear()
+                self._loaded = False
+                raise
+            finally:
+                conn.close()
+        return self.snapshot()
+
+    def snapshot(self):
+        self._ensure_loaded()
+        with self._lock:
+            linked = sum(1 for refs in self._members.values() if len({source for source, _ in refs}) > 1)
+            return {"records": len(self._entries), "patients": len(self._members), "linked_across_sources": linked}
+
+
+index = PatientIndex()
\ No newline at end of file
@@ -0,0 +1,141 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+
+from metrics import metrics
+
+# Statements slower than this are logged; 0 logs every statement, a negative value turns the log off
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "250"))
+
+# Most recent slow statements kept for GET /api/slow_queries
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200"))
+
+# The sampling profiler is opt-in: it walks every thread's stack while it runs
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "").lower() in ("1", "true", "yes")
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
+
+
+# ----- SLOW-QUERY LOG -----
+
+# Parameter values may be patient data, so only their types and sizes are logged
+def _redact_value(value):
+    if value is None:
+        return "null"
+    if isinstance(value, (str, bytes, list, tuple, set, dict)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def redact_params(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: _redact_value(value) for key, value in params.items()}
+    # pyodbc takes either one sequence of values or the values as separate arguments
+    if len(params) == 1 and isinstance(params[0], (list, tuple)):
+        params = params[0]
+    return [_redact_value(value) for value in params]
+
+
+class SlowQueryLog:
+    """Recent statements over the SLOW_QUERY_MS threshold, by registry name and with redacted parameters."""
+
+    def __init__(self, threshold_ms=SLOW_QUERY_MS, size=SLOW_QUERY_LOG_SIZE):
+        self.threshold_ms = threshold_ms
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, backend, name, seconds, rows, params, text=None):
+        duration_ms = seconds * 1000
+        if self.threshold_ms < 0 or duration_ms < self.threshold_ms:
+            return
+        entry = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "backend": backend,
+            "statement": name,
+            "duration_ms": round(duration_ms, 3),
+            "rows": rows,
+            "params": redact_params(params)
+        }
+        # Unregistered statements have no name, so show the start of the (parameterized) text instead
+        if name == "adhoc" and text:
+            entry["text"] = " ".join(str(text).split())[:200]
+        with self._lock:
+            self._entries.append(entry)
+        metrics.increment(f"slow_queries.{backend}")
+        print(f"Slow {backend} statement {name}: {entry['duration_ms']} ms, {rows} rows, params {entry['params']}")
+
+    def entries(self, backend=None, limit=None):
+        with self._lock:
+            entries = [entry for entry in self._entries if backend is None or entry["backend"] == backend]
+        entries.reverse()
+        return entries[:limit] if limit else entries
+
+
+slow_queries = SlowQueryLog()
+
+
+# ----- SAMPLING PROFILER -----
+
+# Leaf frames of threads that are parked rather than working
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _is_idle(frame):
+    return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread in this worker and folds them for flame graphs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def sample(self, seconds, interval=0.005, include_idle=False):
+        """Return folded stacks ("thread;outer;...;inner count" per line) sampled over `seconds`."""
+        seconds = min(max(seconds, 0.1), PROFILER_MAX_SECONDS)
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already being captured")
+        try:
+            stacks = Counter()
+            own_id = threading.get_ident()
+            deadline = time.monotonic() + seconds
+            samples = 0
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id or (not include_idle and _is_idle(frame)):
+                        continue
+                    labels = []
+                    while frame is not None:
+                        labels.append(_frame_label(frame))
+                        frame = frame.f_back
+                    labels.append(names.get(thread_id, f"thread-{thread_id}"))
+                    stacks[";".join(reversed(labels))] += 1
+                samples += 1
+                time.sleep(interval)
+        finally:
+            self._lock.release()
+        metrics.increment("profiler.samples", samples)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+profiler = SamplingProfiler()
\ No newline at end of file
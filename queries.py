@@ -0,0 +1,332 @@
+"""Named SQL and Cypher statements used by the routes, declared once and reused as-is."""
+import threading
+
+# Every registered statement by name
+REGISTRY = {}
+
+_variants = {}
+_variants_lock = threading.Lock()
+
+
+class Statement(str):
+    """Statement text tagged with its registry name; it passes anywhere a plain string does."""
+
+    def __new__(cls, name, backend, text):
+        statement = super().__new__(cls, text)
+        statement.name = name
+        statement.backend = backend
+        return statement
+
+    # Fill a template's placeholders; each distinct text is built once, so it is a stable plan-cache key
+    def format(self, **parts):
+        text = str.format(self, **parts)
+        with _variants_lock:
+            variant = _variants.get(text)
+            if variant is None:
+                variant = _variants[text] = Statement(self.name, self.backend, text)
+        return variant
+
+
+def _register(backend, name, text):
+    if name in REGISTRY:
+        raise ValueError(f"Statement {name} is already registered")
+    statement = REGISTRY[name] = Statement(name, backend, text)
+    return statement
+
+
+def sql(name, text):
+    return _register("sql", name, text)
+
+
+def cypher(name, text):
+    return _register("cypher", name, text)
+
+
+# ----- PATIENTS (SQL SERVER) -----
+
+PATIENTS_ALL = sql("patients.all", "SELECT * FROM Patients")
+
+PATIENT_BY_ID = sql("patients.by_id", "SELECT * FROM Patients WHERE patient_id = ?")
+
+PATIENT_INSERT = sql("patients.insert", """
+INSERT INTO Patients (first_name, last_name, date_of_birth, gender, address, phone, email)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+""")
+
+PATIENT_UPDATE = sql("patients.update", """
+UPDATE Patients
+SET first_name = ?, last_name = ?, date_of_birth = ?,
+    gender = ?, address = ?, phone = ?, email = ?,
+    modified_at = SYSUTCDATETIME()
+WHERE patient_id = ?
+""")
+
+PATIENT_DELETE = sql("patients.delete", "DELETE FROM Patients WHERE patient_id = ?")
+
+# The model's columns only: batch rows can go out as Arrow without passing through the model
+PATIENT_COLUMNS = "patient_id, first_name, last_name, date_of_birth, gender, address, phone, email"
+
+# OPENJSON keeps the text the same for any number of IDs and avoids the 2100-parameter limit
+PATIENTS_BY_IDS = sql("patients.by_ids", f"""
+SELECT {PATIENT_COLUMNS} FROM Patients t
+JOIN OPENJSON(?) WITH (id INT '$') ids ON ids.id = t.patient_id
+""")
+
+LAST_IDENTITY = sql("identity.last", "SELECT @@IDENTITY AS ID")
+
+# ----- MEDICAL RECORDS (SQL SERVER) -----
+
+# Header columns; the VARCHAR(MAX) text columns are only read when asked for
+RECORD_SUMMARY_COLUMNS = (
+    "record_id, patient_id, doctor_id, diagnosis, record_date, "
+    "DATALENGTH(treatment) AS treatment_length, DATALENGTH(notes) AS notes_length"
+)
+
+# The model's columns, as for patients
+MEDICAL_RECORD_COLUMNS = "record_id, patient_id, doctor_id, diagnosis, treatment, notes, record_date"
+
+MEDICAL_RECORD_BY_ID = sql("medical_records.by_id", "SELECT * FROM MedicalRecords WHERE record_id = ?")
+
+MEDICAL_RECORD_INSERT = sql("medical_records.insert", """
+INSERT INTO MedicalRecords (patient_id, doctor_id, diagnosis, treatment, notes, record_date)
+VALUES (?, ?, ?, ?, ?, ?)
+""")
+
+# The record's old month goes to ExportTombstones when record_date leaves it, so the export rewrites it
+MEDICAL_RECORD_UPDATE = sql("medical_records.update", """
+UPDATE MedicalRecords
+SET patient_id = ?, doctor_id = ?, diagnosis = ?,
+    treatment = ?, notes = ?, record_date = ?,
+    modified_at = SYSUTCDATETIME()
+OUTPUT CASE WHEN inserted.record_date IS NULL OR DATEDIFF(MONTH, deleted.record_date, inserted.record_date) <> 0
+            THEN DATEFROMPARTS(YEAR(deleted.record_date), MONTH(deleted.record_date), 1) END
+    INTO ExportTombstones (record_month)
+WHERE record_id = ?
+""")
+
+MEDICAL_RECORD_DELETE = sql("medical_records.delete", """
+DELETE FROM MedicalRecords
+OUTPUT DATEFROMPARTS(YEAR(deleted.record_date), MONTH(deleted.record_date), 1) INTO ExportTombstones (record_month)
+WHERE record_id = ?
+""")
+
+MEDICAL_RECORDS_BY_IDS = sql("medical_records.by_ids", f"""
+SELECT {MEDICAL_RECORD_COLUMNS} FROM MedicalRecords t
+JOIN OPENJSON(?) WITH (id INT '$') ids ON ids.id = t.record_id
+""")
+
+# Templates: {text_columns} and {where} come from fixed fragments, never from request values
+MEDICAL_RECORDS_FOR_PATIENT = sql("medical_records.for_patient", (
+    f"SELECT {RECORD_SUMMARY_COLUMNS}{{text_columns}} FROM MedicalRecords WHERE {{where}} "
+    "ORDER BY record_date, record_id"
+))
+
+MEDICAL_RECORDS_PAGE = sql("medical_records.page", (
+    f"SELECT TOP (?) {RECORD_SUMMARY_COLUMNS} FROM MedicalRecords WHERE {{where}} "
+    "ORDER BY record_date, record_id"
+))
+
+MEDICAL_RECORD_TEXT = sql("medical_records.text",
+                          "SELECT record_id{text_columns} FROM MedicalRecords WHERE record_id = ?")
+
+# ----- INSURANCE POLICIES (NEO4J) -----
+
+POLICIES_FOR_PATIENT = cypher("policies.for_patient",
+                              "MATCH (p:InsurancePolicy) WHERE p.patient_id = $patient_id RETURN p")
+
+POLICY_BY_ID = cypher("policies.by_id", "MATCH (p:InsurancePolicy {policy_id: $policy_id}) RETURN p")
+
+POLICY_CREATE = cypher("policies.create", """
+CREATE (p:InsurancePolicy {
+    policy_id: $policy_id,
+    patient_id: $patient_id,
+    provider: $provider,
+    policy_number: $policy_number,
+    coverage_type: $coverage_type,
+    start_date: $start_date,
+    end_date: $end_date,
+    coverage_details: $coverage_details,
+    version: 1
+})
+RETURN p
+""")
+
+POLICY_UPDATE = cypher("policies.update", """
+MATCH (p:InsurancePolicy {policy_id: $policy_id})
+SET p.patient_id = $patient_id,
+    p.provider = $provider,
+    p.policy_number = $policy_number,
+    p.coverage_type = $coverage_type,
+    p.start_date = $start_date,
+    p.end_date = $end_date,
+    p.coverage_details = $coverage_details,
+    p.version = coalesce(p.version, 0) + 1
+RETURN p
+""")
+
+# Notes the record a claim leaves (deleted, or moved to another record), so the export rewrites its month
+CLAIM_TOMBSTONE = """
+CREATE (:ClaimTombstone {record_id: c.record_id, removed_at: datetime()})
+"""
+
+POLICY_DELETE_CLAIMS = cypher("policies.delete_claims", """
+MATCH (c:Claim)-[r:FILED_UNDER]->(p:InsurancePolicy {policy_id: $policy_id})""" + CLAIM_TOMBSTONE + """DETACH DELETE c
+""")
+
+POLICY_DELETE = cypher("policies.delete", "MATCH (p:InsurancePolicy {policy_id: $policy_id}) DELETE p")
+
+POLICIES_BY_IDS = cypher("policies.by_ids", """
+UNWIND $ids AS id
+MATCH (p:InsurancePolicy {policy_id: id})
+RETURN p
+""")
+
+
+# ----- CLAIMS (NEO4J) -----
+
+# Creates the outbox node in the same statement (and so the same transaction) as the claim write
+CLAIM_VALIDATION_EVENT = """
+WITH c
+CREATE (:OutboxEvent {event_id: randomUUID(), event_type: 'claim_record_check',
+                      claim_id: c.claim_id, record_id: c.record_id, created_at: datetime()})
+"""
+
+CLAIMS_FOR_PATIENT = cypher("claims.for_patient", """
+MATCH (c:Claim)-[:FILED_UNDER]->(p:InsurancePolicy)
+WHERE p.patient_id = $patient_id
+  AND ($start IS NULL OR c.claim_date >= $start)
+  AND ($end IS NULL OR c.claim_date < $end)
+RETURN c, p.provider AS provider
+ORDER BY c.claim_date, c.claim_id
+""")
+
+# The first claims only, for pages such as the timeline
+CLAIMS_FOR_PATIENT_LIMIT = cypher("claims.for_patient_limit", CLAIMS_FOR_PATIENT + "LIMIT $limit")
+
+# Range predicates on claim_date are served by the claim_date index
+CLAIMS_PAGE = cypher("claims.page", """
+MATCH (c:Claim)
+WHERE c.claim_date >= coalesce($start, date('0001-01-01'))
+  AND ($end IS NULL OR c.claim_date < $end)
+  AND ($status IS NULL OR c.status = $status)
+  AND ($after_date IS NULL OR c.claim_date > $after_date
+       OR (c.claim_date = $after_date AND c.claim_id > $after_id))
+OPTIONAL MATCH (c)-[:FILED_UNDER]->(p:InsurancePolicy)
+RETURN c, p.provider AS provider
+ORDER BY c.claim_date, c.claim_id
+LIMIT $limit
+""")
+
+CLAIM_WITH_PROVIDER = cypher("claims.with_provider", """
+MATCH (c:Claim {claim_id: $claim_id})
+OPTIONAL MATCH (c)-[:FILED_UNDER]->(p:InsurancePolicy)
+RETURN c, p.provider AS provider
+""")
+
+CLAIM_BY_ID = cypher("claims.by_id", "MATCH (c:Claim {claim_id: $claim_id}) RETURN c")
+
+CLAIM_WITH_PATIENT = cypher("claims.with_patient", """
+MATCH (c:Claim {claim_id: $claim_id})
+OPTIONAL MATCH (p:InsurancePolicy {policy_id: c.policy_id})
+RETURN c, p.patient_id AS patient_id
+""")
+
+CLAIM_POLICY = cypher("claims.policy",
+                      "MATCH (c:Claim {claim_id: $claim_id})-[:FILED_UNDER]->(p:InsurancePolicy) RETURN p")
+
+CLAIM_COUNT = cypher("claims.count", "MATCH (c:Claim) RETURN COUNT(c) as count")
+
+# The medical record is checked against SQL Server asynchronously through the outbox
+CLAIM_CREATE = cypher("claims.create", """
+MATCH (p:InsurancePolicy {policy_id: $policy_id})
+CREATE (c:Claim {
+    claim_id: $claim_id,
+    policy_id: $policy_id,
+    record_id: $record_id,
+    claim_date: $claim_date,
+    amount: $amount,
+    status: $status,
+    description: $description,
+    record_status: 'pending',
+    version: 1,
+    updated_at: datetime()
+})
+CREATE (c)-[:FILED_UNDER]->(p)
+""" + CLAIM_VALIDATION_EVENT + """
+WITH c
+OPTIONAL MATCH (p:InsurancePolicy {policy_id: c.policy_id})
+RETURN c, p.patient_id AS patient_id
+""")
+
+CLAIM_UPDATE = cypher("claims.update", """
+MATCH (c:Claim {claim_id: $claim_id})
+FOREACH (_ IN CASE WHEN c.record_id <> $record_id THEN [1] ELSE [] END |""" + CLAIM_TOMBSTONE + """)
+SET c.policy_id = $policy_id,
+    c.record_id = $record_id,
+    c.claim_date = $claim_date,
+    c.amount = $amount,
+    c.status = $status,
+    c.description = $description,
+    c.record_status = 'pending',
+    c.version = coalesce(c.version, 0) + 1,
+    c.updated_at = datetime()
+""" + CLAIM_VALIDATION_EVENT + """
+WITH c
+OPTIONAL MATCH (p:InsurancePolicy {policy_id: c.policy_id})
+RETURN c, p.patient_id AS patient_id
+""")
+
+CLAIM_DELETE = cypher("claims.delete", """
+MATCH (c:Claim {claim_id: $claim_id})""" + CLAIM_TOMBSTONE + """DETACH DELETE c
+""")
+
+CLAIMS_BY_IDS = cypher("claims.by_ids", """
+UNWIND $ids AS id
+MATCH (c:Claim {claim_id: id})
+OPTIONAL MATCH (c)-[:FILED_UNDER]->(p:InsurancePolicy)
+RETURN c, p.provider AS provider
+""")
+
+# ----- VERSION LOOKUPS (ETAGS) -----
+
+PATIENT_VERSION = sql("versions.patient",
+                      "SELECT CAST(row_version AS BIGINT) FROM Patients WHERE patient_id = ?")
+
+MEDICAL_RECORD_VERSION = sql("versions.medical_record",
+                             "SELECT CAST(row_version AS BIGINT) FROM MedicalRecords WHERE record_id = ?")
+
+POLICY_VERSION = cypher("versions.policy",
+                        "MATCH (p:InsurancePolicy {policy_id: $policy_id}) RETURN coalesce(p.version, 0) AS version")
+
+CLAIM_VERSION = cypher("versions.claim", """
+MATCH (c:Claim {claim_id: $claim_id})
+OPTIONAL MATCH (c)-[:FILED_UNDER]->(p:InsurancePolicy)
+RETURN coalesce(c.version, 0) AS version, p.version AS policy_version
+""")
+
+# Rowversions only grow, so count + max also catches deleted records
+COMPLETE_PATIENT_SQL_VERSION = sql("versions.complete_patient_sql", """
+SELECT CAST(p.row_version AS BIGINT),
+       (SELECT COUNT(*) FROM MedicalRecords m WHERE m.patient_id = p.patient_id),
+       (SELECT MAX(CAST(m.row_version AS BIGINT)) FROM MedicalRecords m WHERE m.patient_id = p.patient_id)
+FROM Patients p WHERE p.patient_id = ?
+""")
+
+COMPLETE_PATIENT_GRAPH_VERSION = cypher("versions.complete_patient_graph", """
+OPTIONAL MATCH (p:InsurancePolicy {patient_id: $patient_id})
+OPTIONAL MATCH (c:Claim)-[:FILED_UNDER]->(p)
+WITH p, collect(c.claim_id + ':' + toString(coalesce(c.version, 0))) AS claims
+RETURN collect(p.policy_id + ':' + toString(coalesce(p.version, 0))) AS policies,
+       reduce(acc = [], list IN collect(claims) | acc + list) AS claims
+""")
+
+COMPLETE_CLAIM_GRAPH_VERSION = cypher("versions.complete_claim_graph", """
+MATCH (c:Claim {claim_id: $claim_id})-[:FILED_UNDER]->(p:InsurancePolicy)
+RETURN coalesce(c.version, 0) AS version, coalesce(p.version, 0) AS policy_version,
+       c.record_id AS record_id, p.patient_id AS patient_id
+""")
+
+COMPLETE_CLAIM_SQL_VERSION = sql("versions.complete_claim_sql", """
+SELECT (SELECT CAST(row_version AS BIGINT) FROM MedicalRecords WHERE record_id = ?),
+       (SELECT CAST(row_version AS BIGINT) FROM Patients WHERE patient_id = ?)
+""")
\ No newline at end of file
@@ -0,0 +1,317 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextvars import ContextVar
+
+from metrics import metrics
+
+# Tokens a client gets back per second, and the most it can bank for a burst (1 token = 1 plain request)
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "20"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "60"))
+
+# Per-API-key and per-route limits and route costs; without it the defaults below apply to everyone
+RATE_LIMITS_FILE = os.getenv("RATE_LIMITS_FILE", "rate_limits.json")
+
+# "memory" keeps buckets per worker; "sqlite" shares them between the workers of one host through RATE_LIMIT_DB
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", "rate_limits.sqlite3")
+
+API_KEY_HEADER = "x-api-key"
+
+# Only the API is limited; docs and the root page are not
+LIMITED_PREFIX = "/api/"
+
+# Buckets kept in memory before full (idle) ones are dropped
+MAX_BUCKETS = 100_000
+
+# The calling client (hashed API key or address), for the audit log
+current_client = ContextVar("current_client", default=None)
+
+# Tokens a request takes: federated reads fan out to several backends, bulk operations scan whole tables
+ROUTE_COSTS = {
+    "GET /api/patients/{patient_id}/complete": 5,
+    "GET /api/patients/{patient_id}/timeline": 5,
+    "GET /api/claims/{claim_id}/complete": 3,
+    "GET /api/sources/{source}/patients/{patient_id}/complete": 10,
+    "POST /api/patients:batchGet": 5,
+    "POST /api/medical_records:batchGet": 5,
+    "POST /api/insurance_policies:batchGet": 5,
+    "POST /api/claims:batchGet": 5,
+    "GET /api/search": 2,
+    "GET /api/analytics/snapshot/claims": 10,
+    "POST /api/claims/adjudicate": 20,
+}
+
+
+# "GET /api/patients/{patient_id}/claims" -> (method, regex matching the concrete paths)
+def _compile_route(route):
+    method, _, template = route.partition(" ")
+    pattern = "".join(
+        "[^/]+" if part.startswith("{") else re.escape(part) for part in re.split(r"(\{[^}]+\})", template)
+    )
+    return method.upper(), re.compile(pattern + "$")
+
+
+class RateLimitConfig:
+    """Limits by client and by route, and route costs, from RATE_LIMITS_FILE.
+
+    {"default": {"rate": 20, "burst": 60},
+     "keys": {"<api key>": {"rate": 100, "burst": 300}},
+     "routes": {"GET /api/patients/{patient_id}/claims": {"rate": 2, "burst": 10}},
+     "costs": {"GET /api/search": 4}}
+    """
+
+    def __init__(self, default=(RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST), keys=None, routes=None, costs=None):
+        self.default = default
+        # Keys are held as hashes, so API keys never reach the bucket store
+        self.keys = {client_id(key): limit for key, limit in (keys or {}).items()}
+        self.routes = routes or {}
+        self.costs = {**ROUTE_COSTS, **(costs or {})}
+        self._patterns = [(route, *_compile_route(route)) for route in {**self.costs, **self.routes}]
+
+    @classmethod
+    def load(cls, path=RATE_LIMITS_FILE):
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            data = json.load(f)
+
+        def limit(entry):
+            return float(entry["rate"]), float(entry["burst"])
+
+        default = data.get("default")
+        return cls(
+            default=limit(default) if default else (RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST),
+            keys={key: limit(entry) for key, entry in data.get("keys", {}).items()},
+            routes={route: limit(entry) for route, entry in data.get("routes", {}).items()},
+            costs=data.get("costs")
+        )
+
+    def route(self, method, path):
+        """The configured route a request falls under, or None."""
+        for route, route_method, pattern in self._patterns:
+            if route_method == method and pattern.match(path):
+                return route
+        return None
+
+
+def client_id(api_key=None, address=None):
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    return f"ip:{address}"
+
+
+# ----- BUCKET STORES -----
+
+def _refill(tokens, updated, rate, burst, now):
+    return min(burst, tokens + max(now - updated, 0.0) * rate)
+
+
+class RateLimitBackend(ABC):
+    """Where token buckets live. A store shared by several workers implements take() against it atomically."""
+    name = None
+
+    @abstractmethod
+    async def take(self, buckets):
+        """Take cost tokens from every (key, rate, burst, cost) bucket, or from none of them.
+
+        Returns 0 when the request may go ahead, else the seconds until it could.
+        """
+
+    def size(self):
+        return None
+
+
+def _take(state, buckets, now):
+    # state: key -> (tokens, updated); returns the wait and the new states, applied only when the wait is 0
+    wait, updates = 0.0, {}
+    for key, rate, burst, cost in buckets:
+        # A request costlier than the whole burst would never get through; it drains the bucket instead
+        cost = min(cost, burst)
+        tokens, updated = state.get(key, (burst, now))
+        tokens = _refill(tokens, updated, rate, burst, now)
+        if tokens < cost:
+            wait = max(wait, (cost - tokens) / rate)
+        updates[key] = (tokens - cost, now)
+    return wait, updates
+
+
+class MemoryBackend(RateLimitBackend):
+    name = "memory"
+
+    def __init__(self, max_buckets=MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = {}
+        self._limits = {}
+        self._pruned_at = 0.0
+
+    async def take(self, buckets):
+        now = time.monotonic()
+        wait, updates = _take(self._buckets, buckets, now)
+        if wait == 0:
+            self._buckets.update(updates)
+            for key, rate, burst, _ in buckets:
+                self._limits[key] = (rate, burst)
+            # At most once a second, in case most buckets are in use and pruning frees little
+            if len(self._buckets) > self.max_buckets and now - self._pruned_at >= 1.0:
+                self._prune(now)
+        return wait
+
+    # A bucket that has refilled completely is the same as no bucket
+    def _prune(self, now):
+        self._pruned_at = now
+        for key, (tokens, updated) in list(self._buckets.items()):
+            rate, burst = self._limits[key]
+            if _refill(tokens, updated, rate, burst, now) >= burst:
+                del self._buckets[key]
+                del self._limits[key]
+
+    def size(self):
+        return len(self._buckets)
+
+
+class SqliteBackend(RateLimitBackend):
+    """Buckets in a local SQLite file, so every worker process on the host draws from the same ones."""
+    name = "sqlite"
+
+    def __init__(self, db_path=RATE_LIMIT_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._pruned_at = 0.0
+
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+            self._local.conn = conn
+        return conn
+
+    def _take_sync(self, buckets):
+        conn = self._db()
+        # Wall-clock time, since the buckets are shared between processes
+        now = time.time()
+        keys = [key for key, _, _, _ in buckets]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                f"SELECT key, tokens, updated FROM buckets WHERE key IN ({', '.join('?' for _ in keys)})", keys
+            ).fetchall()
+            wait, updates = _take({key: (tokens, updated) for key, tokens, updated in rows}, buckets, now)
+            if wait == 0:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                    [(key, tokens, updated) for key, (tokens, updated) in updates.items()]
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        # Buckets idle for an hour are full again whatever their limits, so their rows can go
+        if now - self._pruned_at >= 60:
+            self._pruned_at = now
+            conn.execute("DELETE FROM buckets WHERE updated < ?", (now - 3600,))
+        return wait
+
+    async def take(self, buckets):
+        return await asyncio.to_thread(self._take_sync, buckets)
+
+
+BACKENDS = {"memory": MemoryBackend, "sqlite": SqliteBackend}
+
+
+# ----- LIMITER AND MIDDLEWARE -----
+
+class RateLimiter:
+    """Token buckets per client (configured API key, or address) and per client and route."""
+
+    def __init__(self, backend=None, config=None):
+        self.backend = backend or BACKENDS[RATE_LIMIT_BACKEND]()
+        self.config = config or RateLimitConfig.load()
+
+    def client(self, api_key, address):
+        """The bucket owner: a configured API key, else the address (unknown keys get no buckets of their own)."""
+        if api_key:
+            client = client_id(api_key)
+            if client in self.config.keys:
+                return client
+        return client_id(None, address)
+
+    async def check(self, client, method, path):
+        """Seconds the client must wait before this request is allowed; 0 when it is allowed now."""
+        config = self.config
+        route = config.route(method, path)
+        rate, burst = config.keys.get(client, config.default)
+        buckets = [(client, rate, burst, config.costs.get(route, 1))]
+        if route in config.routes:
+            route_rate, route_burst = config.routes[route]
+            buckets.append((f"{client}|{route}", route_rate, route_burst, 1))
+        try:
+            wait = await self.backend.take(buckets)
+        except Exception as e:
+            # A broken shared store should not take the API down with it
+            print(f"Rate limit backend error: {e}")
+            metrics.increment("ratelimit.backend_errors")
+            return 0
+        if wait:
+            metrics.increment("ratelimit.limited")
+        return wait
+
+    def snapshot(self):
+        return {"backend": self.backend.name, "buckets": self.backend.size(), "default": self.config.default}
+
+
+rate_limiter = RateLimiter()
+
+
+class RateLimitMiddleware:
+    """Rejects clients over their limits with 429 + Retry-After before the request reaches a database."""
+
+    def __init__(self, app, limiter=rate_limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(LIMITED_PREFIX):
+            await self.app(scope, receive, send)
+            return
+
+        api_key = None
+        for name, value in scope["headers"]:
+            if name == API_KEY_HEADER.encode():
+                api_key = value.decode("latin-1")
+                break
+        address = scope["client"][0] if scope.get("client") else None
+        client = self.limiter.client(api_key, address)
+        wait = await self.limiter.check(client, scope["method"], scope["path"])
+        if wait:
+            await send_too_many_requests(send, wait)
+            return
+        token = current_client.set(client)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_client.reset(token)
+
+
+async def send_too_many_requests(send, retry_after):
+    retry_after = max(math.ceil(retry_after), 1)
+    body = json.dumps({"detail": "Rate limit exceeded, retry later", "retry_after": retry_after}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 429,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(retry_after).encode()),
+        ]
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,177 @@
+import os
+import threading
+
+import queries
+from database import get_sql_connection, Neo4jConnection
+
+# How often the background thread checks whether the reference sets changed out of band
+REFERENCE_CHECK_SECONDS = float(os.getenv("REFERENCE_CHECK_SECONDS", "60"))
+
+DOCTOR_FINGERPRINT_QUERY = queries.sql(
+    "reference.doctor_fingerprint", "SELECT COUNT(*), CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM Doctors"
+)
+
+DOCTORS_QUERY = queries.sql(
+    "reference.doctors", "SELECT doctor_id, first_name, last_name, specialization, phone, email FROM Doctors"
+)
+
+# Policy count plus the policies' version counters, which every update through the API bumps, so
+# edits that keep the count (a provider renamed, a coverage type changed) are noticed as well
+PROVIDER_FINGERPRINT_QUERY = queries.cypher("reference.provider_fingerprint", """
+MATCH (p:InsurancePolicy)
+RETURN count(p) AS policies, max(p.version) AS max_version, sum(coalesce(p.version, 0)) AS versions
+""")
+
+PROVIDERS_QUERY = queries.cypher("reference.providers", """
+MATCH (p:InsurancePolicy)
+RETURN p.provider AS provider, count(p) AS policy_count,
+       collect(DISTINCT p.coverage_type) AS coverage_types
+""")
+
+
+class DoctorRef:
+    __slots__ = ("doctor_id", "first_name", "last_name", "specialization", "phone", "email")
+
+    def __init__(self, doctor_id, first_name, last_name, specialization, phone, email):
+        self.doctor_id = doctor_id
+        self.first_name = first_name
+        self.last_name = last_name
+        self.specialization = specialization
+        self.phone = phone
+        self.email = email
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class ProviderRef:
+    __slots__ = ("name", "policy_count", "coverage_types")
+
+    def __init__(self, name, policy_count=0, coverage_types=()):
+        self.name = name
+        self.policy_count = policy_count
+        self.coverage_types = frozenset(coverage_types)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "policy_count": self.policy_count,
+            "coverage_types": sorted(self.coverage_types)
+        }
+
+
+class ReferenceCache:
+    """In-process copy of the doctors table and the distinct insurance providers."""
+
+    def __init__(self):
+        self._doctors = {}
+        self._providers = {}
+        self._doctor_version = None
+        self._provider_version = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ----- LOADING -----
+
+    def _doctor_fingerprint(self, cursor):
+        cursor.execute(DOCTOR_FINGERPRINT_QUERY)
+        return tuple(cursor.fetchone())
+
+    def load_doctors(self):
+        conn = get_sql_connection()
+        cursor = conn.cursor()
+        version = self._doctor_fingerprint(cursor)
+        cursor.execute(DOCTORS_QUERY)
+        doctors = {row[0]: DoctorRef(*row) for row in cursor.fetchall()}
+        cursor.close()
+        conn.close()
+
+        # Readers see either the old or the new dict, never a partial one
+        self._doctors = doctors
+        self._doctor_version = version
+
+    def _provider_fingerprint(self, neo4j_conn):
+        result = neo4j_conn.query(PROVIDER_FINGERPRINT_QUERY)
+        return (result[0]["policies"], result[0]["max_version"], result[0]["versions"]) if result else None
+
+    def load_providers(self):
+        neo4j_conn = Neo4jConnection()
+        version = self._provider_fingerprint(neo4j_conn)
+        result = neo4j_conn.query(PROVIDERS_QUERY) or []
+        neo4j_conn.close()
+
+        with self._lock:
+            self._providers = {
+                row["provider"]: ProviderRef(row["provider"], row["policy_count"], row["coverage_types"])
+                for row in result if row["provider"] is not None
+            }
+            self._provider_version = version
+
+    def load(self):
+        try:
+            self.load_doctors()
+            self.load_providers()
+            print(f"Reference data loaded: {len(self._doctors)} doctors, {len(self._providers)} providers")
+        except Exception as e:
+            print(f"Error loading reference data: {e}")
+
+    # ----- VERSION CHECK -----
+
+    def check_versions(self):
+        try:
+            conn = get_sql_connection()
+            cursor = conn.cursor()
+            doctor_version = self._doctor_fingerprint(cursor)
+            cursor.close()
+            conn.close()
+            if doctor_version != self._doctor_version:
+                self.load_doctors()
+
+            neo4j_conn = Neo4jConnection()
+            provider_version = self._provider_fingerprint(neo4j_conn)
+            neo4j_conn.close()
+            if provider_version != self._provider_version:
+                self.load_providers()
+        except Exception as e:
+            print(f"Reference data version check failed: {e}")
+
+    def _run(self):
+        while not self._stop.wait(REFERENCE_CHECK_SECONDS):
+            self.check_versions()
+
+    def start(self):
+        self.load()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="reference-data", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # ----- WRITE-THROUGH UPDATES FROM POLICY ROUTES -----
+
+    # Rebuilt rather than patched: an update or delete can remove a provider's last coverage type
+    def policies_changed(self):
+        try:
+            self.load_providers()
+        except Exception as e:
+            # The background check rebuilds the set once Neo4j answers again
+            print(f"Error reloading insurance providers: {e}")
+
+    # ----- LOOKUPS -----
+
+    # Changes whenever either reference set changes; part of the ETag of responses that embed them
+    def versions(self):
+        return (self._doctor_version, self._provider_version)
+
+    def doctor(self, doctor_id):
+        ref = self._doctors.get(doctor_id)
+        return ref.to_dict() if ref else None
+
+    def provider(self, name):
+        ref = self._providers.get(name)
+        return ref.to_dict() if ref else None
+
+
+cache = ReferenceCache()
@@ -0,0 +1,238 @@
+import base64
+import itertools
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+import queries
+from metrics import metrics
+
+# Replicas further behind the primary than this are not read from
+MAX_REPLICA_LAG_SECONDS = float(os.getenv("MAX_REPLICA_LAG_SECONDS", "5"))
+
+# How often the primary heartbeat is written and each replica's copy of it read
+REPLICA_CHECK_SECONDS = float(os.getenv("REPLICA_CHECK_SECONDS", "1"))
+
+# Allowance for clock differences between API workers when comparing a write time with a heartbeat
+REPLICA_CLOCK_MARGIN_SECONDS = float(os.getenv("REPLICA_CLOCK_MARGIN_SECONDS", "0.5"))
+
+SESSION_HEADER = "x-session-token"
+
+# Requests that only read, so their statements may be served by replicas
+read_only = ContextVar("read_only", default=False)
+
+# The calling client's last writes, from its session token and from this request
+session = ContextVar("replication_session", default=None)
+
+HEARTBEAT_UPSERT = queries.sql("replication.heartbeat_upsert", """
+MERGE ReplicaHeartbeat AS target
+USING (SELECT 1 AS id) AS source ON target.id = source.id
+WHEN MATCHED THEN UPDATE SET beat_at = ?
+WHEN NOT MATCHED THEN INSERT (id, beat_at) VALUES (1, ?);
+""")
+
+HEARTBEAT_READ = queries.sql("replication.heartbeat_read", "SELECT beat_at FROM ReplicaHeartbeat WHERE id = 1")
+
+
+# ----- SESSION TOKENS (READ-YOUR-WRITES) -----
+
+class SessionState:
+    """When the client last wrote to SQL Server, and the Neo4j bookmarks of its last graph writes."""
+
+    def __init__(self, sql_written_at=None, bookmarks=()):
+        self.sql_written_at = sql_written_at
+        self.bookmarks = list(bookmarks)
+        self.changed = False
+
+    def sql_written(self):
+        self.sql_written_at = time.time()
+        self.changed = True
+
+    def graph_written(self, bookmarks):
+        self.bookmarks = list(bookmarks)
+        self.changed = True
+
+
+# The token only steers routing (a forged one can at most send reads to the primary), so it is not signed
+def encode_token(state):
+    payload = {"sql": state.sql_written_at, "neo4j": state.bookmarks}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode()
+
+
+def decode_token(token):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return SessionState(payload.get("sql"), payload.get("neo4j") or ())
+    except (ValueError, TypeError, AttributeError):
+        return SessionState()
+
+
+def record_sql_write():
+    state = session.get()
+    if state is not None:
+        state.sql_written()
+
+
+def record_graph_write(bookmarks):
+    state = session.get()
+    if state is not None and bookmarks:
+        state.graph_written(bookmarks)
+
+
+def graph_bookmarks():
+    state = session.get()
+    return state.bookmarks if state is not None else []
+
+
+# Reads shared between callers must come from sessions that route them the same way
+def session_key():
+    state = session.get()
+    if state is None:
+        return None, ()
+    return state.sql_written_at, tuple(state.bookmarks)
+
+
+# Read requests: every GET/HEAD, plus the batch lookups that are POSTed only for their request body
+def is_read_request(method, path):
+    return method in ("GET", "HEAD") or path.endswith(":batchGet")
+
+
+class ReadRoutingMiddleware:
+    """Marks read-only requests for replica routing and carries the session token in and out."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = None
+        for name, value in scope["headers"]:
+            if name == SESSION_HEADER.encode():
+                token = value.decode("latin-1")
+                break
+        state = decode_token(token) if token else SessionState()
+        read_token = read_only.set(is_read_request(scope["method"], scope["path"]))
+        session_token = session.set(state)
+
+        # Writes hand the client a new token, to send back with its following reads
+        async def send_with_token(message):
+            if message["type"] == "http.response.start" and state.changed:
+                headers = list(message.get("headers", []))
+                headers.append((SESSION_HEADER.encode(), encode_token(state).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_token)
+        finally:
+            read_only.reset(read_token)
+            session.reset(session_token)
+
+
+# ----- REPLICA SELECTION AND LAG -----
+
+class ReplicaSet:
+    """Read replicas of one SQL Server, with the lag of each measured through a heartbeat row."""
+
+    def __init__(self, replicas):
+        self.replicas = replicas
+        # Replica name -> the newest primary heartbeat it has applied (seconds since the epoch)
+        self.heartbeats = {}
+        self._next = itertools.count()
+
+    def lag(self, replica, now=None):
+        heartbeat = self.heartbeats.get(replica.name)
+        return None if heartbeat is None else max((now or time.time()) - heartbeat, 0.0)
+
+    def choose(self, written_at=None):
+        """A replica that is healthy, within MAX_REPLICA_LAG_SECONDS and has the client's last write."""
+        now = time.time()
+        eligible = []
+        for replica in self.replicas:
+            heartbeat = self.heartbeats.get(replica.name)
+            if heartbeat is None or replica.breaker.state != "closed":
+                continue
+            if now - heartbeat > MAX_REPLICA_LAG_SECONDS:
+                continue
+            if written_at is not None and heartbeat < written_at + REPLICA_CLOCK_MARGIN_SECONDS:
+                continue
+            eligible.append(replica)
+        if not eligible:
+            metrics.increment("replicas.primary_fallback")
+            return None
+        return eligible[next(self._next) % len(eligible)]
+
+    def snapshot(self):
+        now = time.time()
+        return {
+            replica.name: {
+                "lag_seconds": None if self.lag(replica, now) is None else round(self.lag(replica, now), 3),
+                "breaker": replica.breaker.state
+            }
+            for replica in self.replicas
+        }
+
+
+class ReplicaMonitor:
+    """Writes the heartbeat on the primary and reads each replica's copy of it, every REPLICA_CHECK_SECONDS."""
+
+    def __init__(self, interval=REPLICA_CHECK_SECONDS):
+        self.interval = interval
+        self._servers = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self, server):
+        conn = server.connect(read_only=False)
+        cursor = conn.cursor()
+        beat_at = time.time()
+        cursor.execute(HEARTBEAT_UPSERT, (beat_at, beat_at))
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+        for replica in server.replica_set.replicas:
+            try:
+                replica_conn = replica.connect(read_only=False)
+                replica_cursor = replica_conn.cursor()
+                replica_cursor.execute(HEARTBEAT_READ)
+                row = replica_cursor.fetchone()
+                replica_cursor.close()
+                replica_conn.close()
+            except Exception as e:
+                print(f"Replica {replica.name} check failed: {e}")
+                server.replica_set.heartbeats.pop(replica.name, None)
+                continue
+            if row:
+                server.replica_set.heartbeats[replica.name] = row[0]
+                metrics.observe(f"replicas.{replica.name}.lag", max(time.time() - row[0], 0.0))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for server in self._servers:
+                try:
+                    self.check(server)
+                except Exception as e:
+                    print(f"Replica heartbeat for {server.name} failed: {e}")
+
+    def start(self, servers):
+        self._servers = [server for server in servers if server.replica_set is not None]
+        if not self._servers or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="replica-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+
+monitor = ReplicaMonitor()
\ No newline at end of file
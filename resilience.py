@@ -0,0 +1,191 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import metrics
+
+# Consecutive failures before a backend's circuit opens
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+
+# Seconds an open circuit waits before letting a trial call through
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+# Adaptive concurrency limit bounds and the latency it steers towards
+MIN_CONCURRENT_REQUESTS = int(os.getenv("MIN_CONCURRENT_REQUESTS", "8"))
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "128"))
+TARGET_LATENCY_MS = float(os.getenv("TARGET_LATENCY_MS", "500"))
+
+# Requests allowed to wait for a slot, and for how long
+MAX_QUEUED_REQUESTS = int(os.getenv("MAX_QUEUED_REQUESTS", "64"))
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("QUEUE_TIMEOUT_SECONDS", "2"))
+
+# Long-lived streams would hold a concurrency slot for hours; the event broker caps them instead
+UNLIMITED_PATHS = ("/api/events",)
+
+
+class BackendUnavailable(Exception):
+    """A backend is down, timing out or fenced off by its circuit breaker."""
+
+    def __init__(self, backend, message="", retry_after=None):
+        super().__init__(message or f"{backend} is unavailable")
+        self.backend = backend
+        self.retry_after = retry_after or BREAKER_RESET_SECONDS
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures -> half-open trial call -> closed."""
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_progress = False
+        self._trial_started = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "closed":
+                return
+            remaining = self.opened_at + self.reset_seconds - time.monotonic()
+            if self.state == "open" and remaining <= 0:
+                self.state = "half_open"
+            # A trial that never reported back (e.g. its caller was cancelled) must not fence the backend off for good
+            trial_expired = time.monotonic() - self._trial_started > self.reset_seconds
+            if self.state == "half_open" and (not self._trial_in_progress or trial_expired):
+                self._trial_in_progress = True
+                self._trial_started = time.monotonic()
+                return
+        metrics.increment(f"backend.{self.name}.rejected")
+        raise BackendUnavailable(self.name, f"{self.name} circuit is open", retry_after=max(remaining, 1.0))
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_in_progress = False
+            self.state = "closed"
+
+    # The trial call ended without saying anything about the backend's health (e.g. a client-side error)
+    def release_trial(self):
+        with self._lock:
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        metrics.increment(f"backend.{self.name}.failures")
+        with self._lock:
+            self.failures += 1
+            self._trial_in_progress = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    metrics.increment(f"backend.{self.name}.opened")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def snapshot(self):
+        return {"state": self.state, "consecutive_failures": self.failures}
+
+
+breakers = {
+    "sql": CircuitBreaker("sql"),
+    "neo4j": CircuitBreaker("neo4j"),
+}
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit: grows while requests are fast, shrinks when latency exceeds the target."""
+
+    def __init__(self, initial=32, minimum=MIN_CONCURRENT_REQUESTS, maximum=MAX_CONCURRENT_REQUESTS,
+                 target_latency=TARGET_LATENCY_MS / 1000, max_queue=MAX_QUEUED_REQUESTS):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.target_latency = target_latency
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._waiters = deque()
+
+    async def acquire(self, timeout=QUEUE_TIMEOUT_SECONDS):
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        metrics.increment("limiter.queued")
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            return True
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # Slot was handed over just as we gave up; give it back
+                self.release(None)
+            return False
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self, latency):
+        if latency is not None:
+            if latency > self.target_latency:
+                self.limit = max(self.minimum, self.limit * 0.9)
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+        self.in_flight -= 1
+        # Hand freed slots straight to queued requests
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(True)
+
+    def snapshot(self):
+        return {"limit": int(self.limit), "in_flight": self.in_flight, "queued": len(self._waiters)}
+
+
+limiter = AdaptiveLimiter()
+
+
+class LoadSheddingMiddleware:
+    """Reject requests with 503 + Retry-After instead of letting the worker queue grow without bound."""
+
+    def __init__(self, app, limiter=limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(UNLIMITED_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        if not await self.limiter.acquire():
+            metrics.increment("limiter.shed")
+            await send_unavailable(send, "Server is overloaded, retry shortly", retry_after=1)
+            return
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.release(time.perf_counter() - started)
+
+
+async def send_unavailable(send, detail, retry_after):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(int(max(retry_after, 1))).encode()),
+        ]
+    })
+    await send({"type": "http.response.body", "body": body})
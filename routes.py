@@ -1,44 +1,118 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from typing import List, Dict, Any
+import asyncio
+import base64
+import heapq
 import json
-import pyodbc
 from datetime import datetime, date
-from database import get_sql_connection, Neo4jConnection
+from database import get_sql_connection, Neo4jConnection, sql_pool, sql_server
+from resilience import BackendUnavailable, breakers, limiter
+from ratelimit import rate_limiter
 from models import *
+import analytics
+import etags
+import events
+import jobs
+import outbox
+import profiling
+import queries
+import replication
+import search
+import serialization
+import snapshot_query
+import sources
+from reference_data import cache as reference_cache
+from metrics import metrics
+from patient_index import index as patient_index
+from audit import log as audit_log
+import audit
+from singleflight import SingleFlight
+from columnar import ColumnTable
 
 router = APIRouter()
 
+# Identical concurrent federated reads share one backend computation; the key includes the caller's
+# session so a client that just wrote never receives a read routed for someone else's replica lag
+federated_reads = SingleFlight("federated")
+
 
 # Helper function to convert SQL row to dict
 def row_to_dict(row, cursor):
     return {column[0]: value for column, value in zip(cursor.description, row)}
 
 
+# Helper function to build a MedicalRecord from a SQL row dict
+def medical_record_from_dict(record_dict):
+    # Fix: Convert date object to string if needed
+    if isinstance(record_dict.get("record_date"), (datetime, date)):
+        record_dict["record_date"] = record_dict["record_date"].isoformat()
+    record_dict["doctor"] = reference_cache.doctor(record_dict["doctor_id"])
+    return MedicalRecord(**record_dict)
+
+
+# Helper function to build a Claim from a Neo4j node (claim_date is a native Neo4j date)
+def claim_from_node(claim_node, provider=None):
+    claim_dict = dict(claim_node)
+    if hasattr(claim_dict.get("claim_date"), "to_native"):
+        claim_dict["claim_date"] = claim_dict["claim_date"].to_native()
+    claim_dict["provider"] = reference_cache.provider(provider)
+    return Claim(**claim_dict)
+
+
+# Keyset pagination cursors: an opaque token for the (date, id) of the last item returned
+def encode_cursor(item_date, item_id):
+    return base64.urlsafe_b64encode(json.dumps([item_date.isoformat(), item_id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None, None
+    try:
+        item_date, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return date.fromisoformat(item_date), item_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# Helper function to build an InsurancePolicy from a Neo4j node
+def insurance_policy_from_node(policy_node):
+    policy_dict = dict(policy_node)
+    # Fix: Check if coverage_details exists before accessing it
+    if policy_dict.get("coverage_details") is None:
+        policy_dict["coverage_details"] = {}
+    else:
+        # Convert any Python objects to JSON-serializable types
+        policy_dict["coverage_details"] = json.loads(json.dumps(policy_dict["coverage_details"]))
+    return InsurancePolicy(**policy_dict)
+
+
 # ----- HOSPITAL (SQL) ROUTES -----
 
 # Get all patients
-@router.get("/patients/", response_model=List[Patient])
-async def get_patients():
+@router.get("/patients/", response_model=List[Patient], responses=serialization.BINARY_RESPONSES)
+async def get_patients(request: Request):
     conn = get_sql_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM Patients")
+    cursor.execute(queries.PATIENTS_ALL)
     patients = []
     for row in cursor.fetchall():
         patient_dict = row_to_dict(row, cursor)
         patients.append(Patient(**patient_dict))
     cursor.close()
     conn.close()
-    return patients
+    return serialization.negotiate(request, patients)
 
 
-# Get a specific patient by ID
-@router.get("/patients/{patient_id}", response_model=Patient)
-async def get_patient(patient_id: int):
+# Load a patient by ID (shared by the patient and federated routes)
+def load_patient(patient_id):
     conn = get_sql_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM Patients WHERE patient_id = ?", (patient_id,))
+    cursor.execute(queries.PATIENT_BY_ID, (patient_id,))
     row = cursor.fetchone()
     if not row:
+        cursor.close()
+        conn.close()
         raise HTTPException(status_code=404, detail="Patient not found")
     patient_dict = row_to_dict(row, cursor)
     cursor.close()
@@ -46,19 +120,47 @@ async def get_patient(patient_id: int):
     return Patient(**patient_dict)
 
 
+# Get a specific patient by ID
+@router.get("/patients/{patient_id}", response_model=Patient)
+async def get_patient(patient_id: int, request: Request, response: Response):
+    etag = await asyncio.to_thread(etags.current_etag, "patient", patient_id, etags.patient_version)
+    if etags.etag_matches(request.headers.get("if-none-match"), etag):
+        return etags.not_modified(etag, "patient")
+    patient = await asyncio.to_thread(load_patient, patient_id)
+    etags.set_cache_headers(response, etag, "patient")
+    return patient
+
+
+# Audit trail of a write: which fields the client sent, never their values (queued, written in the background)
+def audit_write(action, entity_type, entity_id, model=None):
+    audit_log.record(action, entity_type, entity_id, sorted(model.model_fields_set) if model is not None else ())
+
+
+# Keep the patient index in step with the hospital the /patients routes write to
+def index_patient(patient=None, patient_id=None):
+    source = sources.catalog.primary_hospital
+    if source is None:
+        return
+    try:
+        if patient is None:
+            patient_index.remove(source, patient_id)
+        else:
+            patient_index.add(source, patient.model_dump())
+    except Exception as e:
+        # The patient is already committed; the next patient_index job picks it up
+        print(f"Error updating patient index: {e}")
+
+
 # Create a new patient
 @router.post("/patients/", response_model=Patient)
 async def create_patient(patient: Patient):
     conn = get_sql_connection()
     cursor = conn.cursor()
-    cursor.execute("""
-    INSERT INTO Patients (first_name, last_name, date_of_birth, gender, address, phone, email)
-    VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (
+    cursor.execute(queries.PATIENT_INSERT, (
         patient.first_name, patient.last_name, patient.date_of_birth,
         patient.gender, patient.address, patient.phone, patient.email
     ))
-    cursor.execute("SELECT @@IDENTITY AS ID")
+    cursor.execute(queries.LAST_IDENTITY)
     patient_id = cursor.fetchone()[0]
     conn.commit()
     cursor.close()
@@ -66,6 +168,8 @@ async def create_patient(patient: Patient):
 
     # Return the created patient with ID
     patient.patient_id = patient_id
+    audit_write("patient.created", "patient", patient_id, patient)
+    await asyncio.to_thread(index_patient, patient)
     return patient
 
 
@@ -76,19 +180,14 @@ async def update_patient(patient_id: int, patient: Patient):
     cursor = conn.cursor()
 
     # First check if patient exists
-    cursor.execute("SELECT * FROM Patients WHERE patient_id = ?", (patient_id,))
+    cursor.execute(queries.PATIENT_BY_ID, (patient_id,))
     if not cursor.fetchone():
         cursor.close()
         conn.close()
         raise HTTPException(status_code=404, detail="Patient not found")
 
     # Update patient
-    cursor.execute("""
-    UPDATE Patients 
-    SET first_name = ?, last_name = ?, date_of_birth = ?, 
-        gender = ?, address = ?, phone = ?, email = ?
-    WHERE patient_id = ?
-    """, (
+    cursor.execute(queries.PATIENT_UPDATE, (
         patient.first_name, patient.last_name, patient.date_of_birth,
         patient.gender, patient.address, patient.phone, patient.email,
         patient_id
@@ -100,6 +199,8 @@ async def update_patient(patient_id: int, patient: Patient):
 
     # Set the ID in the return object
     patient.patient_id = patient_id
+    audit_write("patient.updated", "patient", patient_id, patient)
+    await asyncio.to_thread(index_patient, patient)
     return patient
 
 
@@ -110,55 +211,172 @@ async def delete_patient(patient_id: int):
     cursor = conn.cursor()
 
     # Check if patient exists
-    cursor.execute("SELECT * FROM Patients WHERE patient_id = ?", (patient_id,))
+    cursor.execute(queries.PATIENT_BY_ID, (patient_id,))
     if not cursor.fetchone():
         cursor.close()
         conn.close()
         raise HTTPException(status_code=404, detail="Patient not found")
 
-    # Delete patient
-    cursor.execute("DELETE FROM Patients WHERE patient_id = ?", (patient_id,))
+    # Delete patient; the outbox event commits with it and removes the patient's policies and claims
+    cursor.execute(queries.PATIENT_DELETE, (patient_id,))
+    outbox.enqueue_sql(cursor, "patient_deleted", {"patient_id": patient_id})
     conn.commit()
     cursor.close()
     conn.close()
+    outbox.dispatcher.notify()
+    audit_write("patient.deleted", "patient", patient_id)
+    await asyncio.to_thread(index_patient, patient_id=patient_id)
 
     return {"status": "success", "message": f"Patient {patient_id} deleted successfully"}
 
 
-# Get all medical records for a patient
-@router.get("/patients/{patient_id}/medical_records", response_model=List[MedicalRecord])
-async def get_patient_medical_records(patient_id: int):
+# VARCHAR(MAX) columns that list and federated views only read when asked to
+RECORD_TEXT_COLUMNS = ("treatment", "notes")
+
+
+# Parse include=notes,treatment into a tuple of text columns (in a fixed order)
+def parse_record_include(include):
+    requested = {part.strip() for part in (include or "").split(",") if part.strip()}
+    unknown = requested - set(RECORD_TEXT_COLUMNS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown include field(s): {', '.join(sorted(unknown))}")
+    return tuple(column for column in RECORD_TEXT_COLUMNS if column in requested)
+
+
+# Text columns appended to a statement's select list
+def text_columns_sql(columns):
+    return "".join(f", {column}" for column in columns)
+
+
+# Date window over record_date: start inclusive, end exclusive (as in the analytics snapshot)
+def record_date_window(start, end):
+    conditions, params = [], []
+    if start:
+        conditions.append("record_date >= ?")
+        params.append(start)
+    if end:
+        conditions.append("record_date < ?")
+        params.append(end)
+    return conditions, params
+
+
+def record_summary_from_row(row, cursor):
+    record_dict = row_to_dict(row, cursor)
+    if isinstance(record_dict.get("record_date"), (datetime, date)):
+        record_dict["record_date"] = record_dict["record_date"].isoformat()
+    record_dict["doctor"] = reference_cache.doctor(record_dict["doctor_id"])
+    return MedicalRecordSummary(**record_dict)
+
+
+# Load the record headers for a patient, plus any requested text columns
+def load_patient_medical_records(patient_id, include=(), start=None, end=None):
+    conditions, params = record_date_window(start, end)
     conn = get_sql_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM MedicalRecords WHERE patient_id = ?", (patient_id,))
-    records = []
-    for row in cursor.fetchall():
-        record_dict = row_to_dict(row, cursor)
-        # Fix: Convert date object to string if needed
-        if isinstance(record_dict.get("record_date"), (datetime, date)):
-            record_dict["record_date"] = record_dict["record_date"].isoformat()
-        records.append(MedicalRecord(**record_dict))
+    cursor.execute(
+        queries.MEDICAL_RECORDS_FOR_PATIENT.format(
+            text_columns=text_columns_sql(include), where=" AND ".join(["patient_id = ?"] + conditions)
+        ),
+        (patient_id, *params)
+    )
+    records = [record_summary_from_row(row, cursor) for row in cursor.fetchall()]
     cursor.close()
     conn.close()
     return records
 
 
+# Get all medical records for a patient (headers; add include=notes,treatment for the text)
+@router.get("/patients/{patient_id}/medical_records", response_model=List[MedicalRecordSummary],
+            responses=serialization.BINARY_RESPONSES)
+async def get_patient_medical_records(patient_id: int, request: Request, include: Optional[str] = None,
+                                      start: Optional[date] = None, end: Optional[date] = None):
+    records = await asyncio.to_thread(
+        load_patient_medical_records, patient_id, parse_record_include(include), start, end
+    )
+    return serialization.negotiate(request, records)
+
+
+# List medical records in a date window, oldest first, one keyset page at a time
+@router.get("/medical_records/", response_model=MedicalRecordPage)
+async def list_medical_records(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    patient_id: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None
+):
+    after_date, after_id = decode_cursor(cursor)
+    conditions, params = record_date_window(start, end)
+    conditions.insert(0, "record_date IS NOT NULL")
+    if patient_id is not None:
+        conditions.append("patient_id = ?")
+        params.append(patient_id)
+    if after_date:
+        conditions.append("(record_date > ? OR (record_date = ? AND record_id > ?))")
+        params.extend([after_date, after_date, after_id])
+
+    def load_page():
+        conn = get_sql_connection()
+        sql_cursor = conn.cursor()
+        sql_cursor.execute(
+            queries.MEDICAL_RECORDS_PAGE.format(where=" AND ".join(conditions)),
+            (limit + 1, *params)
+        )
+        records = [record_summary_from_row(row, sql_cursor) for row in sql_cursor.fetchall()]
+        sql_cursor.close()
+        conn.close()
+        return records
+
+    records = await asyncio.to_thread(load_page)
+    # One extra row tells whether there is a next page
+    next_cursor = None
+    if len(records) > limit:
+        records = records[:limit]
+        last = records[-1]
+        next_cursor = encode_cursor(date.fromisoformat(last.record_date), last.record_id)
+    return MedicalRecordPage(items=records, next_cursor=next_cursor)
+
+
+# Get the large text columns of a medical record on demand
+@router.get("/medical_records/{record_id}/text", response_model=MedicalRecordText)
+async def get_medical_record_text(record_id: int, fields: str = "treatment,notes"):
+    columns = parse_record_include(fields)
+    if not columns:
+        raise HTTPException(status_code=400, detail="No text fields requested")
+    conn = get_sql_connection()
+    cursor = conn.cursor()
+    cursor.execute(queries.MEDICAL_RECORD_TEXT.format(text_columns=text_columns_sql(columns)), (record_id,))
+    row = cursor.fetchone()
+    if not row:
+        cursor.close()
+        conn.close()
+        raise HTTPException(status_code=404, detail="Medical record not found")
+    text = MedicalRecordText(**row_to_dict(row, cursor))
+    cursor.close()
+    conn.close()
+    return text
+
+
 # Get a specific medical record by ID
 @router.get("/medical_records/{record_id}", response_model=MedicalRecord)
-async def get_medical_record(record_id: int):
+async def get_medical_record(record_id: int, request: Request, response: Response):
+    etag = await asyncio.to_thread(etags.current_etag, "medical_record", record_id, etags.medical_record_version)
+    if etags.etag_matches(request.headers.get("if-none-match"), etag):
+        return etags.not_modified(etag, "medical_record")
+    etags.set_cache_headers(response, etag, "medical_record")
+
     conn = get_sql_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM MedicalRecords WHERE record_id = ?", (record_id,))
+    cursor.execute(queries.MEDICAL_RECORD_BY_ID, (record_id,))
     row = cursor.fetchone()
     if not row:
+        cursor.close()
+        conn.close()
         raise HTTPException(status_code=404, detail="Medical record not found")
-    record_dict = row_to_dict(row, cursor)
-    # Fix: Convert date object to string if needed
-    if isinstance(record_dict.get("record_date"), (datetime, date)):
-        record_dict["record_date"] = record_dict["record_date"].isoformat()
+    record = medical_record_from_dict(row_to_dict(row, cursor))
     cursor.close()
     conn.close()
-    return MedicalRecord(**record_dict)
+    return record
 
 
 # Create a new medical record
@@ -166,14 +384,11 @@ async def get_medical_record(record_id: int):
 async def create_medical_record(record: MedicalRecord):
     conn = get_sql_connection()
     cursor = conn.cursor()
-    cursor.execute("""
-    INSERT INTO MedicalRecords (patient_id, doctor_id, diagnosis, treatment, notes, record_date)
-    VALUES (?, ?, ?, ?, ?, ?)
-    """, (
+    cursor.execute(queries.MEDICAL_RECORD_INSERT, (
         record.patient_id, record.doctor_id, record.diagnosis,
         record.treatment, record.notes, record.record_date
     ))
-    cursor.execute("SELECT @@IDENTITY AS ID")
+    cursor.execute(queries.LAST_IDENTITY)
     record_id = cursor.fetchone()[0]
     conn.commit()
     cursor.close()
@@ -181,6 +396,7 @@ async def create_medical_record(record: MedicalRecord):
 
     # Return the created record with ID
     record.record_id = record_id
+    audit_write("medical_record.created", "medical_record", record_id, record)
     return record
 
 
@@ -191,19 +407,14 @@ async def update_medical_record(record_id: int, record: MedicalRecord):
     cursor = conn.cursor()
 
     # Check if record exists
-    cursor.execute("SELECT * FROM MedicalRecords WHERE record_id = ?", (record_id,))
+    cursor.execute(queries.MEDICAL_RECORD_BY_ID, (record_id,))
     if not cursor.fetchone():
         cursor.close()
         conn.close()
         raise HTTPException(status_code=404, detail="Medical record not found")
 
     # Update record
-    cursor.execute("""
-    UPDATE MedicalRecords 
-    SET patient_id = ?, doctor_id = ?, diagnosis = ?, 
-        treatment = ?, notes = ?, record_date = ?
-    WHERE record_id = ?
-    """, (
+    cursor.execute(queries.MEDICAL_RECORD_UPDATE, (
         record.patient_id, record.doctor_id, record.diagnosis,
         record.treatment, record.notes, record.record_date,
         record_id
@@ -215,6 +426,7 @@ async def update_medical_record(record_id: int, record: MedicalRecord):
 
     # Set the ID in the return object
     record.record_id = record_id
+    audit_write("medical_record.updated", "medical_record", record_id, record)
     return record
 
 
@@ -225,77 +437,65 @@ async def delete_medical_record(record_id: int):
     cursor = conn.cursor()
 
     # Check if record exists
-    cursor.execute("SELECT * FROM MedicalRecords WHERE record_id = ?", (record_id,))
+    cursor.execute(queries.MEDICAL_RECORD_BY_ID, (record_id,))
     if not cursor.fetchone():
         cursor.close()
         conn.close()
         raise HTTPException(status_code=404, detail="Medical record not found")
 
-    # Delete record
-    cursor.execute("DELETE FROM MedicalRecords WHERE record_id = ?", (record_id,))
+    # Delete record; the outbox event commits with it and removes the claims filed for it
+    cursor.execute(queries.MEDICAL_RECORD_DELETE, (record_id,))
+    outbox.enqueue_sql(cursor, "medical_record_deleted", {"record_id": record_id})
     conn.commit()
     cursor.close()
     conn.close()
+    outbox.dispatcher.notify()
+    audit_write("medical_record.deleted", "medical_record", record_id)
 
     return {"status": "success", "message": f"Medical record {record_id} deleted successfully"}
 
 
 # ----- INSURANCE (NEO4J) ROUTES -----
 
-# Get all insurance policies for a patient
-@router.get("/patients/{patient_id}/insurance_policies", response_model=List[InsurancePolicy])
-async def get_patient_insurance_policies(patient_id: int):
+# Load all insurance policies for a patient
+def load_patient_insurance_policies(patient_id):
     neo4j_conn = Neo4jConnection()
-    result = neo4j_conn.query(
-        "MATCH (p:InsurancePolicy) WHERE p.patient_id = $patient_id RETURN p",
-        {"patient_id": patient_id}
-    )
+    result = neo4j_conn.query(queries.POLICIES_FOR_PATIENT, {"patient_id": patient_id})
 
     policies = []
     for record in result:
-        policy_node = record["p"]
-        policy_dict = dict(policy_node)
-        # Fix: Check if coverage_details exists before accessing it
-        if "coverage_details" not in policy_dict:
-            policy_dict["coverage_details"] = {}
-        elif policy_dict["coverage_details"] is None:
-            policy_dict["coverage_details"] = {}
-        else:
-            # Convert any Python objects to JSON-serializable types
-            policy_dict["coverage_details"] = json.loads(json.dumps(policy_dict["coverage_details"]))
-        policies.append(InsurancePolicy(**policy_dict))
+        policies.append(insurance_policy_from_node(record["p"]))
 
     neo4j_conn.close()
     return policies
 
 
+# Get all insurance policies for a patient
+@router.get("/patients/{patient_id}/insurance_policies", response_model=List[InsurancePolicy],
+            responses=serialization.BINARY_RESPONSES)
+async def get_patient_insurance_policies(patient_id: int, request: Request):
+    return serialization.negotiate(request, load_patient_insurance_policies(patient_id))
+
+
 # Get a specific insurance policy by ID
 @router.get("/insurance_policies/{policy_id}", response_model=InsurancePolicy)
-async def get_insurance_policy(policy_id: str):
+async def get_insurance_policy(policy_id: str, request: Request, response: Response):
+    etag = await asyncio.to_thread(etags.current_etag, "insurance_policy", policy_id, etags.insurance_policy_version)
+    if etags.etag_matches(request.headers.get("if-none-match"), etag):
+        return etags.not_modified(etag, "insurance_policy")
+    etags.set_cache_headers(response, etag, "insurance_policy")
+
     neo4j_conn = Neo4jConnection()
-    result = neo4j_conn.query(
-        "MATCH (p:InsurancePolicy {policy_id: $policy_id}) RETURN p",
-        {"policy_id": policy_id}
-    )
+    result = neo4j_conn.query(queries.POLICY_BY_ID, {"policy_id": policy_id})
 
     if not result:
         neo4j_conn.close()
         raise HTTPException(status_code=404, detail="Insurance policy not found")
 
-    policy_node = result[0]["p"]
-    policy_dict = dict(policy_node)
-
-    # Fix: Check if coverage_details exists before accessing it
-    if "coverage_details" not in policy_dict:
-        policy_dict["coverage_details"] = {}
-    elif policy_dict["coverage_details"] is None:
-        policy_dict["coverage_details"] = {}
-    else:
-        # Convert any Python objects to JSON-serializable types
-        policy_dict["coverage_details"] = json.loads(json.dumps(policy_dict["coverage_details"]))
+    policy = insurance_policy_from_node(result[0]["p"])
 
     neo4j_conn.close()
-    return InsurancePolicy(**policy_dict)
+    return policy
 
 
 # Create a new insurance policy
@@ -306,19 +506,7 @@ async def create_insurance_policy(policy: InsurancePolicy):
     # Convert dictionary to string representation for Cypher
     coverage_details_str = json.dumps(policy.coverage_details)
 
-    neo4j_conn.query("""
-    CREATE (p:InsurancePolicy {
-        policy_id: $policy_id,
-        patient_id: $patient_id,
-        provider: $provider,
-        policy_number: $policy_number,
-        coverage_type: $coverage_type,
-        start_date: $start_date,
-        end_date: $end_date,
-        coverage_details: $coverage_details
-    })
-    RETURN p
-    """, {
+    neo4j_conn.query(queries.POLICY_CREATE, {
         "policy_id": policy.policy_id,
         "patient_id": policy.patient_id,
         "provider": policy.provider,
@@ -330,6 +518,10 @@ async def create_insurance_policy(policy: InsurancePolicy):
     })
 
     neo4j_conn.close()
+    analytics.invalidate()
+    reference_cache.policies_changed()
+    events.policy_changed("policy.created", policy)
+    audit_write("insurance_policy.created", "insurance_policy", policy.policy_id, policy)
     return policy
 
 
@@ -339,27 +531,14 @@ async def update_insurance_policy(policy_id: str, policy: InsurancePolicy):
     neo4j_conn = Neo4jConnection()
 
     # Check if policy exists
-    result = neo4j_conn.query(
-        "MATCH (p:InsurancePolicy {policy_id: $policy_id}) RETURN p",
-        {"policy_id": policy_id}
-    )
+    result = neo4j_conn.query(queries.POLICY_BY_ID, {"policy_id": policy_id})
 
     if not result:
         neo4j_conn.close()
         raise HTTPException(status_code=404, detail="Insurance policy not found")
 
     # Update policy
-    neo4j_conn.query("""
-    MATCH (p:InsurancePolicy {policy_id: $policy_id})
-    SET p.patient_id = $patient_id,
-        p.provider = $provider,
-        p.policy_number = $policy_number,
-        p.coverage_type = $coverage_type,
-        p.start_date = $start_date,
-        p.end_date = $end_date,
-        p.coverage_details = $coverage_details
-    RETURN p
-    """, {
+    neo4j_conn.query(queries.POLICY_UPDATE, {
         "policy_id": policy_id,
         "patient_id": policy.patient_id,
         "provider": policy.provider,
@@ -371,8 +550,12 @@ async def update_insurance_policy(policy_id: str, policy: InsurancePolicy):
     })
 
     neo4j_conn.close()
+    analytics.invalidate()
+    reference_cache.policies_changed()
     # Set the ID in the return object
     policy.policy_id = policy_id
+    events.policy_changed("policy.updated", policy)
+    audit_write("insurance_policy.updated", "insurance_policy", policy_id, policy)
     return policy
 
 
@@ -382,69 +565,96 @@ async def delete_insurance_policy(policy_id: str):
     neo4j_conn = Neo4jConnection()
 
     # Check if policy exists
-    result = neo4j_conn.query(
-        "MATCH (p:InsurancePolicy {policy_id: $policy_id}) RETURN p",
-        {"policy_id": policy_id}
-    )
+    result = neo4j_conn.query(queries.POLICY_BY_ID, {"policy_id": policy_id})
 
     if not result:
         neo4j_conn.close()
         raise HTTPException(status_code=404, detail="Insurance policy not found")
 
     # Delete any claims associated with this policy first
-    neo4j_conn.query(
-        "MATCH (c:Claim)-[r:FILED_UNDER]->(p:InsurancePolicy {policy_id: $policy_id}) DETACH DELETE c",
-        {"policy_id": policy_id}
-    )
+    neo4j_conn.query(queries.POLICY_DELETE_CLAIMS, {"policy_id": policy_id})
 
     # Delete policy
-    neo4j_conn.query(
-        "MATCH (p:InsurancePolicy {policy_id: $policy_id}) DELETE p",
-        {"policy_id": policy_id}
-    )
+    neo4j_conn.query(queries.POLICY_DELETE, {"policy_id": policy_id})
 
     neo4j_conn.close()
+    analytics.invalidate()
+    reference_cache.policies_changed()
+    events.policy_deleted(policy_id, result[0]["p"].get("patient_id"))
+    audit_write("insurance_policy.deleted", "insurance_policy", policy_id)
     return {"status": "success", "message": f"Insurance policy {policy_id} deleted successfully"}
 
 
-# Get all claims for a patient
-@router.get("/patients/{patient_id}/claims", response_model=List[Claim])
-async def get_patient_claims(patient_id: int):
+# Load all claims for a patient, optionally within a claim_date window (start inclusive, end exclusive)
+def load_patient_claims(patient_id, start=None, end=None, limit=None):
     neo4j_conn = Neo4jConnection()
-    result = neo4j_conn.query("""
-    MATCH (c:Claim)-[:FILED_UNDER]->(p:InsurancePolicy)
-    WHERE p.patient_id = $patient_id
-    RETURN c
-    """, {"patient_id": patient_id})
+    params = {"patient_id": patient_id, "start": start, "end": end}
+    if limit is None:
+        result = neo4j_conn.query(queries.CLAIMS_FOR_PATIENT, params)
+    else:
+        result = neo4j_conn.query(queries.CLAIMS_FOR_PATIENT_LIMIT, {**params, "limit": int(limit)})
 
-    claims = []
-    for record in result:
-        claim_node = record["c"]
-        claim_dict = dict(claim_node)
-        claims.append(Claim(**claim_dict))
+    claims = [claim_from_node(record["c"], record["provider"]) for record in result]
 
     neo4j_conn.close()
     return claims
 
 
+# Get all claims for a patient
+@router.get("/patients/{patient_id}/claims", response_model=List[Claim], responses=serialization.BINARY_RESPONSES)
+async def get_patient_claims(patient_id: int, request: Request,
+                             start: Optional[date] = None, end: Optional[date] = None):
+    claims = await asyncio.to_thread(load_patient_claims, patient_id, start, end)
+    return serialization.negotiate(request, claims)
+
+
+# List claims in a claim_date window, oldest first, one keyset page at a time
+@router.get("/claims/", response_model=ClaimPage)
+async def list_claims(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    status: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None
+):
+    after_date, after_id = decode_cursor(cursor)
+
+    def load_page():
+        neo4j_conn = Neo4jConnection()
+        result = neo4j_conn.query(queries.CLAIMS_PAGE, {
+            "start": start, "end": end, "status": status,
+            "after_date": after_date, "after_id": after_id, "limit": limit + 1
+        })
+        neo4j_conn.close()
+        return [claim_from_node(record["c"], record["provider"]) for record in result]
+
+    claims = await asyncio.to_thread(load_page)
+    next_cursor = None
+    if len(claims) > limit:
+        claims = claims[:limit]
+        next_cursor = encode_cursor(claims[-1].claim_date, claims[-1].claim_id)
+    return ClaimPage(items=claims, next_cursor=next_cursor)
+
+
 # Get a specific claim by ID
 @router.get("/claims/{claim_id}", response_model=Claim)
-async def get_claim(claim_id: str):
+async def get_claim(claim_id: str, request: Request, response: Response):
+    etag = await asyncio.to_thread(etags.current_etag, "claim", claim_id, etags.claim_version)
+    if etags.etag_matches(request.headers.get("if-none-match"), etag):
+        return etags.not_modified(etag, "claim")
+    etags.set_cache_headers(response, etag, "claim")
+
     neo4j_conn = Neo4jConnection()
-    result = neo4j_conn.query(
-        "MATCH (c:Claim {claim_id: $claim_id}) RETURN c",
-        {"claim_id": claim_id}
-    )
+    result = neo4j_conn.query(queries.CLAIM_WITH_PROVIDER, {"claim_id": claim_id})
 
     if not result:
         neo4j_conn.close()
         raise HTTPException(status_code=404, detail="Claim not found")
 
-    claim_node = result[0]["c"]
-    claim_dict = dict(claim_node)
+    claim = claim_from_node(result[0]["c"], result[0]["provider"])
 
     neo4j_conn.close()
-    return Claim(**claim_dict)
+    return claim
 
 
 # Create a new claim
@@ -455,24 +665,12 @@ async def create_claim(claim: Claim):
     # Generate a new claim ID if not provided
     if not claim.claim_id:
         # Get the count of existing claims and add 1
-        result = neo4j_conn.query("MATCH (c:Claim) RETURN COUNT(c) as count")
+        result = neo4j_conn.query(queries.CLAIM_COUNT)
         count = result[0]["count"]
         claim.claim_id = f"CLM{str(count + 1).zfill(3)}"
 
-    neo4j_conn.query("""
-    MATCH (p:InsurancePolicy {policy_id: $policy_id})
-    CREATE (c:Claim {
-        claim_id: $claim_id,
-        policy_id: $policy_id,
-        record_id: $record_id,
-        claim_date: $claim_date,
-        amount: $amount,
-        status: $status,
-        description: $description
-    })
-    CREATE (c)-[:FILED_UNDER]->(p)
-    RETURN c
-    """, {
+    # The medical record is checked against SQL Server asynchronously through the outbox
+    result = neo4j_conn.query(queries.CLAIM_CREATE, {
         "claim_id": claim.claim_id,
         "policy_id": claim.policy_id,
         "record_id": claim.record_id,
@@ -483,6 +681,12 @@ async def create_claim(claim: Claim):
     })
 
     neo4j_conn.close()
+    analytics.invalidate()
+    outbox.dispatcher.notify()
+    claim.record_status = "pending"
+    if result:
+        events.claim_changed("claim.created", claim, result[0]["patient_id"])
+    audit_write("claim.created", "claim", claim.claim_id, claim)
     return claim
 
 
@@ -491,16 +695,7 @@ async def create_claim(claim: Claim):
 async def update_claim(claim_id: str, claim: Claim):
     neo4j_conn = Neo4jConnection()
 
-    result = neo4j_conn.query("""
-    MATCH (c:Claim {claim_id: $claim_id})
-    SET c.policy_id = $policy_id,
-        c.record_id = $record_id,
-        c.claim_date = $claim_date,
-        c.amount = $amount,
-        c.status = $status,
-        c.description = $description
-    RETURN c
-    """, {
+    result = neo4j_conn.query(queries.CLAIM_UPDATE, {
         "claim_id": claim_id,
         "policy_id": claim.policy_id,
         "record_id": claim.record_id,
@@ -515,8 +710,13 @@ async def update_claim(claim_id: str, claim: Claim):
         raise HTTPException(status_code=404, detail=f"Claim {claim_id} not found")
 
     neo4j_conn.close()
+    analytics.invalidate()
+    outbox.dispatcher.notify()
     # Set the ID in the return object
     claim.claim_id = claim_id
+    claim.record_status = "pending"
+    events.claim_changed("claim.updated", claim, result[0]["patient_id"])
+    audit_write("claim.updated", "claim", claim_id, claim)
     return claim
 
 
@@ -526,113 +726,271 @@ async def delete_claim(claim_id: str):
     neo4j_conn = Neo4jConnection()
 
     # Check if claim exists
-    result = neo4j_conn.query(
-        "MATCH (c:Claim {claim_id: $claim_id}) RETURN c",
-        {"claim_id": claim_id}
-    )
+    result = neo4j_conn.query(queries.CLAIM_WITH_PATIENT, {"claim_id": claim_id})
 
     if not result:
         neo4j_conn.close()
         raise HTTPException(status_code=404, detail="Claim not found")
 
     # Delete claim
-    neo4j_conn.query(
-        "MATCH (c:Claim {claim_id: $claim_id}) DETACH DELETE c",
-        {"claim_id": claim_id}
-    )
+    neo4j_conn.query(queries.CLAIM_DELETE, {"claim_id": claim_id})
 
     neo4j_conn.close()
+    analytics.invalidate()
+    events.claim_deleted(claim_id, result[0]["c"].get("policy_id"), result[0]["patient_id"])
+    audit_write("claim.deleted", "claim", claim_id)
     return {"status": "success", "message": f"Claim {claim_id} deleted successfully"}
 
 
-# ----- FEDERATED ROUTES (COMBINING SQL AND NEO4J) -----
+# Adjudicate all pending claims in one vectorized batch
+@router.post("/claims/adjudicate", response_model=dict)
+async def adjudicate_claims(limit: Optional[int] = None):
+    # NumPy is only loaded once claims are adjudicated; the run itself is kept off the event loop
+    import adjudication
+    summary = await asyncio.to_thread(adjudication.adjudicate_pending_claims, limit=limit)
+    analytics.invalidate()
+    try:
+        claims = await asyncio.to_thread(adjudication.adjudicated_claims, summary["adjudicated_at"])
+    except BackendUnavailable as e:
+        # The claims are adjudicated either way; streams still get the bulk refresh
+        print(f"Adjudicated claims could not be read back: {e}")
+        claims = []
+    events.claims_adjudicated(claims, summary)
+    audit_log.record_many("claim.adjudicated", "claim", [claim["claim_id"] for claim in claims],
+                          adjudication.ADJUDICATED_FIELDS)
+    if summary["claims"] and not claims:
+        # Which claims changed is unknown; the run is still recorded
+        audit_write("claims.adjudicated", "claim", "*")
+    return summary
+
+
+# ----- BATCH LOOKUP ROUTES -----
+
+# Fetch SQL rows whose key is in ids with one statement (ids are passed as a JSON array), as columns
+def load_sql_table_by_ids(statement, ids):
+    conn = get_sql_connection()
+    cursor = conn.cursor()
+    cursor.execute(statement, (json.dumps(ids),))
+    table = ColumnTable.from_cursor(cursor)
+    cursor.close()
+    conn.close()
+    return table
+
+
+# Keep request order, drop duplicates and split into found items and missing IDs
+def order_batch(ids, found):
+    ids = list(dict.fromkeys(ids))
+    return [found[i] for i in ids if i in found], [i for i in ids if i not in found]
+
+
+# The same for a table of rows: the found rows in request order, and the missing IDs
+def order_table_batch(ids, table, key):
+    positions = table.index(key)
+    ids = list(dict.fromkeys(ids))
+    return table.take([positions[i] for i in ids if i in positions]), [i for i in ids if i not in positions]
+
+
+# Batch loaders: up to MAX_BATCH_IDS rows are fetched, ordered and encoded in a worker thread
+
+def load_patient_batch(ids, http_request):
+    table, missing = order_table_batch(ids, load_sql_table_by_ids(queries.PATIENTS_BY_IDS, ids), "patient_id")
+    # Arrow is encoded straight from the columns; only JSON and MessagePack need a model per row
+    if serialization.preferred_encoding(http_request) == "arrow":
+        return serialization.arrow_response(table, metadata={"missing": missing})
+    items = table.to_models(lambda row: Patient(**row))
+    return serialization.negotiate(http_request, PatientBatch(items=items, missing=missing))
 
-# Get complete patient information (from both databases)
-@router.get("/patients/{patient_id}/complete", response_model=PatientComplete)
-async def get_complete_patient(patient_id: int):
-    # Get patient info from SQL
-    patient = await get_patient(patient_id)
 
-    # Get medical records from SQL
-    medical_records = await get_patient_medical_records(patient_id)
+def load_medical_record_batch(ids, http_request):
+    table, missing = order_table_batch(ids, load_sql_table_by_ids(queries.MEDICAL_RECORDS_BY_IDS, ids), "record_id")
+    if serialization.preferred_encoding(http_request) == "arrow":
+        # Same columns as the models: record_date as text and the doctor attached
+        table.convert("record_date", lambda value: value.isoformat() if isinstance(value, (datetime, date)) else value)
+        table.with_column("doctor", [reference_cache.doctor(doctor_id) for doctor_id in table.column("doctor_id")])
+        return serialization.arrow_response(table, metadata={"missing": missing})
+    items = table.to_models(medical_record_from_dict)
+    return serialization.negotiate(http_request, MedicalRecordBatch(items=items, missing=missing))
 
-    # Get insurance policies from Neo4j
-    insurance_policies = await get_patient_insurance_policies(patient_id)
 
-    # Get claims from Neo4j
-    claims = await get_patient_claims(patient_id)
+def load_insurance_policy_batch(ids, http_request):
+    neo4j_conn = Neo4jConnection()
+    result = neo4j_conn.query(queries.POLICIES_BY_IDS, {"ids": ids})
+    neo4j_conn.close()
+
+    found = {}
+    for record in result:
+        policy = insurance_policy_from_node(record["p"])
+        found[policy.policy_id] = policy
+    items, missing = order_batch(ids, found)
+    return serialization.negotiate(http_request, InsurancePolicyBatch(items=items, missing=missing))
+
+
+def load_claim_batch(ids, http_request):
+    neo4j_conn = Neo4jConnection()
+    result = neo4j_conn.query(queries.CLAIMS_BY_IDS, {"ids": ids})
+    neo4j_conn.close()
+
+    found = {}
+    for record in result:
+        claim = claim_from_node(record["c"], record["provider"])
+        found[claim.claim_id] = claim
+    items, missing = order_batch(ids, found)
+    return serialization.negotiate(http_request, ClaimBatch(items=items, missing=missing))
+
+
+# Get many patients by ID
+@router.post("/patients:batchGet", response_model=PatientBatch, responses=serialization.BINARY_RESPONSES)
+async def batch_get_patients(request: BatchGetIdsRequest, http_request: Request):
+    return await asyncio.to_thread(load_patient_batch, request.ids, http_request)
+
+
+# Get many medical records by ID
+@router.post("/medical_records:batchGet", response_model=MedicalRecordBatch, responses=serialization.BINARY_RESPONSES)
+async def batch_get_medical_records(request: BatchGetIdsRequest, http_request: Request):
+    return await asyncio.to_thread(load_medical_record_batch, request.ids, http_request)
+
+
+# Get many insurance policies by ID
+@router.post("/insurance_policies:batchGet", response_model=InsurancePolicyBatch, responses=serialization.BINARY_RESPONSES)
+async def batch_get_insurance_policies(request: BatchGetKeysRequest, http_request: Request):
+    return await asyncio.to_thread(load_insurance_policy_batch, request.ids, http_request)
+
+
+# Get many claims by ID
+@router.post("/claims:batchGet", response_model=ClaimBatch, responses=serialization.BINARY_RESPONSES)
+async def batch_get_claims(request: BatchGetKeysRequest, http_request: Request):
+    return await asyncio.to_thread(load_claim_batch, request.ids, http_request)
+
+
+# ----- FEDERATED ROUTES (COMBINING SQL AND NEO4J) -----
+
+# Build complete patient information (from both databases)
+async def build_complete_patient(patient_id, include=()):
+    # Patient and medical records from SQL, policies and claims from Neo4j, fetched in parallel
+    patient, medical_records, insurance_policies, claims = await asyncio.gather(
+        asyncio.to_thread(load_patient, patient_id),
+        asyncio.to_thread(load_patient_medical_records, patient_id, include),
+        asyncio.to_thread(load_patient_insurance_policies, patient_id),
+        asyncio.to_thread(load_patient_claims, patient_id),
+        return_exceptions=True
+    )
+
+    # The patient itself comes from SQL and is required; SQL errors (including 404) propagate
+    for result in (patient, medical_records):
+        if isinstance(result, BaseException):
+            raise result
+
+    # Insurance data is optional: degrade to a partial result while Neo4j is unavailable
+    unavailable_sources = []
+    for result in (insurance_policies, claims):
+        if isinstance(result, BackendUnavailable):
+            unavailable_sources = ["insurance"]
+        elif isinstance(result, BaseException):
+            raise result
+    if unavailable_sources:
+        insurance_policies, claims = [], []
 
     # Combine all data
     complete_patient = PatientComplete(
         patient_info=patient,
         insurance_policies=insurance_policies,
         medical_records=medical_records,
-        claims=claims
+        claims=claims,
+        partial=bool(unavailable_sources),
+        unavailable_sources=unavailable_sources
     )
 
     return complete_patient
 
 
-# Get complete claim information (from both databases)
-@router.get("/claims/{claim_id}/complete", response_model=ClaimComplete)
-async def get_complete_claim(claim_id: str):
-    # Get claim info from Neo4j
-    neo4j_conn = Neo4jConnection()
-    claim_result = neo4j_conn.query(
-        "MATCH (c:Claim {claim_id: $claim_id}) RETURN c",
-        {"claim_id": claim_id}
+# Get complete patient information (from both databases)
+@router.get("/patients/{patient_id}/complete", response_model=PatientComplete)
+async def get_complete_patient(patient_id: int, request: Request, response: Response, include: Optional[str] = None):
+    include = parse_record_include(include)
+    # Each include set is its own representation, with its own ETag
+    etag = await asyncio.to_thread(
+        etags.current_etag, f"complete_patient:{','.join(include)}", patient_id, etags.complete_patient_version
+    )
+    if etags.etag_matches(request.headers.get("if-none-match"), etag):
+        return etags.not_modified(etag, "complete")
+    complete_patient = await federated_reads.do(
+        ("patient", patient_id, include, replication.session_key()),
+        lambda: build_complete_patient(patient_id, include)
     )
+    # Partial results must not be revalidated as if they were complete
+    etags.set_cache_headers(response, None if complete_patient.partial else etag, "complete")
+    return complete_patient
 
-    if not claim_result:
-        raise HTTPException(status_code=404, detail="Claim not found")
 
-    claim_dict = dict(claim_result[0]["c"])
-    claim = Claim(**claim_dict)
+# Records for a timeline, in date order, read from the SQL cursor a page at a time
+def iter_timeline_records(cursor, batch_size=500):
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        for row in rows:
+            record = record_summary_from_row(row, cursor)
+            yield date.fromisoformat(record.record_date), 0, str(record.record_id), record
 
-    # Get associated policy from Neo4j
-    policy_result = neo4j_conn.query(
-        "MATCH (c:Claim {claim_id: $claim_id})-[:FILED_UNDER]->(p:InsurancePolicy) RETURN p",
-        {"claim_id": claim_id}
+
+def load_patient_timeline(patient_id, start=None, end=None, limit=200):
+    conditions, params = record_date_window(start, end)
+    conn = get_sql_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        queries.MEDICAL_RECORDS_PAGE.format(
+            where=" AND ".join(["patient_id = ?", "record_date IS NOT NULL"] + conditions)
+        ),
+        (limit, patient_id, *params)
+    )
+    # Each source contributes at most `limit` entries, already sorted by date
+    claims = (
+        (claim.claim_date, 1, claim.claim_id, claim)
+        for claim in load_patient_claims(patient_id, start, end, limit)
     )
 
-    if not policy_result:
-        raise HTTPException(status_code=404, detail="Associated policy not found")
+    # k-way merge of the sorted sources; stops pulling rows once the page is full
+    entries = []
+    for entry_date, _, _, item in heapq.merge(iter_timeline_records(cursor), claims, key=lambda e: e[:3]):
+        if len(entries) == limit:
+            break
+        if isinstance(item, Claim):
+            entries.append(TimelineEntry(date=entry_date, kind="claim", claim=item))
+        else:
+            entries.append(TimelineEntry(date=entry_date, kind="medical_record", medical_record=item))
+    cursor.close()
+    conn.close()
+    return PatientTimeline(patient_id=patient_id, entries=entries)
 
-    policy_dict = dict(policy_result[0]["p"])
-    # Fix: Check if coverage_details exists before accessing it
-    if "coverage_details" not in policy_dict:
-        policy_dict["coverage_details"] = {}
-    elif policy_dict["coverage_details"] is None:
-        policy_dict["coverage_details"] = {}
-    else:
-        # Convert any Python objects to JSON-serializable types
-        policy_dict["coverage_details"] = json.loads(json.dumps(policy_dict["coverage_details"]))
 
-    policy = InsurancePolicy(**policy_dict)
+# Medical records and claims of a patient merged into one date-ordered timeline
+@router.get("/patients/{patient_id}/timeline", response_model=PatientTimeline)
+async def get_patient_timeline(patient_id: int, start: Optional[date] = None, end: Optional[date] = None,
+                               limit: int = Query(200, ge=1, le=1000)):
+    return await asyncio.to_thread(load_patient_timeline, patient_id, start, end, limit)
 
-    neo4j_conn.close()
 
-    # Get medical record from SQL
+# Load the medical record and patient a claim refers to (from SQL)
+def load_claim_hospital_context(record_id, patient_id):
     conn = get_sql_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM MedicalRecords WHERE record_id = ?", (claim.record_id,))
+    cursor.execute(queries.MEDICAL_RECORD_BY_ID, (record_id,))
     record_row = cursor.fetchone()
 
     if not record_row:
+        cursor.close()
+        conn.close()
         raise HTTPException(status_code=404, detail="Associated medical record not found")
 
-    record_dict = row_to_dict(record_row, cursor)
-    # Fix: Convert date object to string if needed
-    if isinstance(record_dict.get("record_date"), (datetime, date)):
-        record_dict["record_date"] = record_dict["record_date"].isoformat()
-
-    medical_record = MedicalRecord(**record_dict)
+    medical_record = medical_record_from_dict(row_to_dict(record_row, cursor))
 
     # Get patient info from SQL
-    cursor.execute("SELECT * FROM Patients WHERE patient_id = ?", (policy.patient_id,))
+    cursor.execute(queries.PATIENT_BY_ID, (patient_id,))
     patient_row = cursor.fetchone()
 
     if not patient_row:
+        cursor.close()
+        conn.close()
         raise HTTPException(status_code=404, detail="Associated patient not found")
 
     patient_dict = row_to_dict(patient_row, cursor)
@@ -640,13 +998,281 @@ async def get_complete_claim(claim_id: str):
 
     cursor.close()
     conn.close()
+    return medical_record, patient
+
+
+# Load complete claim information (from both databases)
+def load_complete_claim(claim_id):
+    # Get claim info from Neo4j
+    neo4j_conn = Neo4jConnection()
+    claim_result = neo4j_conn.query(queries.CLAIM_BY_ID, {"claim_id": claim_id})
+
+    if not claim_result:
+        neo4j_conn.close()
+        raise HTTPException(status_code=404, detail="Claim not found")
+
+    claim = claim_from_node(claim_result[0]["c"])
+
+    # Get associated policy from Neo4j
+    policy_result = neo4j_conn.query(queries.CLAIM_POLICY, {"claim_id": claim_id})
+
+    if not policy_result:
+        neo4j_conn.close()
+        raise HTTPException(status_code=404, detail="Associated policy not found")
+
+    policy = insurance_policy_from_node(policy_result[0]["p"])
+    claim.provider = reference_cache.provider(policy.provider)
+
+    neo4j_conn.close()
+
+    # Hospital data is optional: degrade to a partial result while SQL Server is unavailable
+    unavailable_sources = []
+    try:
+        medical_record, patient = load_claim_hospital_context(claim.record_id, policy.patient_id)
+    except BackendUnavailable:
+        medical_record, patient = None, None
+        unavailable_sources.append("hospital")
 
     # Combine all data
     complete_claim = ClaimComplete(
         claim_info=claim,
         policy_info=policy,
         medical_record=medical_record,
-        patient_info=patient
+        patient_info=patient,
+        partial=bool(unavailable_sources),
+        unavailable_sources=unavailable_sources
+    )
+
+    return complete_claim
+
+
+# Get complete claim information (from both databases)
+@router.get("/claims/{claim_id}/complete", response_model=ClaimComplete)
+async def get_complete_claim(claim_id: str, request: Request, response: Response):
+    etag = await asyncio.to_thread(etags.current_etag, "complete_claim", claim_id, etags.complete_claim_version)
+    if etags.etag_matches(request.headers.get("if-none-match"), etag):
+        return etags.not_modified(etag, "complete")
+    complete_claim = await federated_reads.do(
+        ("claim", claim_id, replication.session_key()), lambda: asyncio.to_thread(load_complete_claim, claim_id)
+    )
+    etags.set_cache_headers(response, None if complete_claim.partial else etag, "complete")
+    return complete_claim
+
+
+# ----- ANALYTICS ROUTES (CLAIMS GRAPH) -----
+
+# Insurance providers ranked by total claimed amount
+@router.get("/analytics/providers", response_model=List[ProviderClaimTotal])
+async def get_top_providers(limit: int = Query(20, ge=1, le=500)):
+    # Graph queries and cache refreshes can take seconds; they run off the event loop
+    return await asyncio.to_thread(analytics.top_providers, limit)
+
+
+# Patients whose claim count is unusually high relative to all patients
+@router.get("/analytics/anomalous_patients", response_model=List[AnomalousPatient])
+async def get_anomalous_patients(z: float = 2.0, limit: int = Query(50, ge=1, le=1000)):
+    return await asyncio.to_thread(analytics.anomalous_patients, z, limit)
+
+
+# Groups of patients sharing the same doctor and diagnosis, with their claim totals
+@router.get("/analytics/clusters", response_model=List[CareCluster])
+async def get_care_clusters(min_patients: int = Query(2, ge=1), limit: int = Query(20, ge=1, le=500)):
+    return await asyncio.to_thread(analytics.care_clusters, min_patients, limit)
+
+
+# Aggregate claims over the local columnar snapshot (no load on SQL Server or Neo4j)
+@router.get("/analytics/snapshot/claims", response_model=SnapshotQueryResult)
+async def query_claims_snapshot(
+    group_by: List[str] = Query(["diagnosis", "provider", "quarter"]),
+    metric: Optional[List[str]] = Query(None),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    status: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=100000)
+):
+    try:
+        return await asyncio.to_thread(
+            snapshot_query.engine.aggregate, group_by, metric,
+            start.isoformat() if start else None, end.isoformat() if end else None, status, limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except snapshot_query.SnapshotUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+# ----- SEARCH ROUTES (FEDERATED) -----
+
+# Prefix search over patients, medical records and claims, ranked across both stores
+@router.get("/search", response_model=SearchResults)
+async def search_all(q: str = Query(..., min_length=2), limit: int = Query(20, ge=1, le=100)):
+    return await search.federated_search(q, limit)
+
+
+
+# ----- MULTI-SOURCE ROUTES (EVERY HOSPITAL AND INSURER IN THE SOURCE CATALOG) -----
+
+# List the hospital and insurer backends federated requests fan out to
+@router.get("/sources", response_model=List[SourceInfo])
+async def list_sources():
+    return sources.catalog.describe()
+
+
+# A patient from one hospital, with records and coverage from every source that knows them
+@router.get("/sources/{source}/patients/{patient_id}/complete", response_model=FederatedPatient)
+async def get_federated_patient(source: str, patient_id: int):
+    try:
+        result = await sources.federated_patient(source, patient_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown hospital source")
+    if result is None:
+        raise HTTPException(status_code=404, detail="Patient not found")
+
+    # Doctor and provider reference data describe the .env stores only, so it is not attached here
+    policies, claims = {}, {}
+    for name, coverage in result["coverage"].items():
+        policies[name] = coverage["policies"].to_models(insurance_policy_from_node)
+        claims[name] = coverage["claims"].to_models(claim_from_node)
+    return FederatedPatient(
+        patient_info=Patient(**result["patient"]),
+        source=source,
+        master_id=result["master_id"],
+        identities=result["identities"],
+        medical_records={
+            name: records.to_models(lambda record: MedicalRecordSummary(**record))
+            for name, records in result["medical_records"].items()
+        },
+        insurance_policies=policies,
+        claims=claims,
+        partial=bool(result["unavailable_sources"]),
+        unavailable_sources=result["unavailable_sources"]
     )
 
-    return complete_claim
\ No newline at end of file
+
+# Master patient index entry for a hospital's patient: their patient IDs at every hospital
+@router.get("/patient_index/{source}/{patient_id}", response_model=PatientIdentity)
+async def get_patient_identity(source: str, patient_id: int):
+    master_id = await asyncio.to_thread(patient_index.master_id, source, patient_id)
+    if master_id is None:
+        raise HTTPException(status_code=404, detail="Patient is not in the patient index")
+    return PatientIdentity(
+        source=source, patient_id=patient_id, master_id=master_id, identities=patient_index.members(master_id)
+    )
+
+
+# ----- AUDIT ROUTES -----
+
+# Audit history of one patient, medical record, insurance policy or claim, newest first
+@router.get("/audit/{entity_type}/{entity_id}", response_model=List[AuditEvent])
+async def get_audit_history(entity_type: str, entity_id: str, limit: int = Query(100, ge=1, le=1000),
+                            before: Optional[int] = None):
+    if entity_type not in audit.ENTITY_TYPES:
+        raise HTTPException(status_code=404, detail="Unknown audit entity type")
+    return await asyncio.to_thread(audit_log.history, entity_type, entity_id, limit, before)
+
+
+# ----- JOB ROUTES -----
+
+# Queue a long-running operation (adjudicate, export, reindex, patient_index)
+@router.post("/jobs", response_model=Job, status_code=202)
+async def submit_job(request: JobRequest):
+    try:
+        job = await asyncio.to_thread(jobs.queue.submit, request.job_type, request.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    jobs.queue.notify()
+    return job
+
+
+# List recent jobs, optionally by status
+@router.get("/jobs", response_model=List[Job])
+async def list_jobs(status: Optional[str] = None, limit: int = Query(50, ge=1, le=500)):
+    return await asyncio.to_thread(jobs.queue.list, status, limit)
+
+
+# Get a job's status, progress and result
+@router.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(jobs.queue.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+# Cancel a queued or running job
+@router.post("/jobs/{job_id}/cancel", response_model=Job)
+async def cancel_job(job_id: str):
+    job = await asyncio.to_thread(jobs.queue.cancel, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+# ----- EVENT STREAM ROUTES -----
+
+# Server-Sent Events for claim and policy changes. Subscribe to patient_id and/or policy_id, or to
+# whole topics (claims, policies; the default is both). Reconnects resume from Last-Event-ID.
+@router.get("/events", response_class=StreamingResponse)
+async def stream_events(request: Request, patient_id: Optional[int] = None, policy_id: Optional[str] = None,
+                        topics: Optional[str] = None):
+    subscribed = [topic.strip() for topic in (topics or "").split(",") if topic.strip()]
+    unknown = set(subscribed) - {"claims", "policies"}
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown topic(s): {', '.join(sorted(unknown))}")
+    if patient_id is not None:
+        subscribed.append(f"patient:{patient_id}")
+    if policy_id is not None:
+        subscribed.append(f"policy:{policy_id}")
+    last_event_id = request.headers.get("last-event-id")
+    try:
+        subscription = events.broker.subscribe(
+            subscribed or ["claims", "policies"], int(last_event_id) if last_event_id else None
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    except events.TooManySubscribers as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    return StreamingResponse(
+        events.broker.stream(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ----- OPERATIONS ROUTES -----
+
+# Process-wide counters and timings
+@router.get("/metrics", response_model=dict)
+async def get_metrics():
+    snapshot = metrics.snapshot()
+    snapshot["in_flight"] = {"federated": federated_reads.in_flight()}
+    snapshot["backends"] = {name: breaker.snapshot() for name, breaker in breakers.items()}
+    snapshot["limiter"] = limiter.snapshot()
+    snapshot["rate_limiter"] = rate_limiter.snapshot()
+    snapshot["sql_pool"] = sql_pool.snapshot()
+    if sql_server.replica_set is not None:
+        snapshot["replicas"] = sql_server.replica_set.snapshot()
+    snapshot["patient_index"] = patient_index.snapshot()
+    snapshot["events"] = events.broker.snapshot()
+    snapshot["audit"] = audit_log.snapshot()
+    return snapshot
+
+
+# Recent statements slower than SLOW_QUERY_MS, newest first (parameter values are redacted)
+@router.get("/slow_queries", response_model=List[SlowQuery])
+async def get_slow_queries(backend: Optional[str] = None, limit: int = Query(100, ge=1, le=1000)):
+    return profiling.slow_queries.entries(backend, limit)
+
+
+# Sample every thread's stack for a time window; the folded output feeds flamegraph.pl or speedscope
+@router.get("/profile", response_class=PlainTextResponse)
+async def capture_profile(seconds: float = Query(10, gt=0), interval_ms: float = Query(5, ge=1, le=1000),
+                          include_idle: bool = False):
+    if not profiling.PROFILER_ENABLED:
+        raise HTTPException(status_code=403, detail="Profiler is disabled; set PROFILER_ENABLED=1 to allow it")
+    try:
+        # Sampling runs in a worker thread so this worker keeps serving the traffic being profiled
+        folded = await asyncio.to_thread(profiling.profiler.sample, seconds, interval_ms / 1000, include_idle)
+    except profiling.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(folded)
@@ -0,0 +1,202 @@
+import asyncio
+import heapq
+import re
+import time
+
+import queries
+from database import get_sql_connection, Neo4jConnection
+from resilience import BackendUnavailable
+
+# Longest query we turn into full-text terms
+MAX_SEARCH_TERMS = 8
+
+# Time budget for the Neo4j full-text lookup (seconds)
+SEARCH_QUERY_TIMEOUT = 2
+
+# Reciprocal rank fusion constant; larger values flatten the gap between a list's first and later hits
+RRF_K = 60
+
+
+def _terms(q):
+    return re.findall(r"\w+", q.lower())[:MAX_SEARCH_TERMS]
+
+
+# SQL Server CONTAINS condition: every term must match as a word prefix
+def sql_search_condition(terms):
+    return " AND ".join(f'"{term}*"' for term in terms)
+
+
+# Lucene query for the Neo4j full-text index; \w+ terms need no escaping
+def lucene_search_condition(terms):
+    return " AND ".join(f"{term}*" for term in terms)
+
+
+PATIENT_SEARCH_QUERY = queries.sql("search.patients", """
+SELECT p.patient_id, p.first_name, p.last_name, p.email, ft.[RANK]
+FROM CONTAINSTABLE(Patients, (first_name, last_name, email), ?, ?) ft
+JOIN Patients p ON p.patient_id = ft.[KEY]
+ORDER BY ft.[RANK] DESC
+""")
+
+MEDICAL_RECORD_SEARCH_QUERY = queries.sql("search.medical_records", """
+SELECT m.record_id, m.patient_id, m.diagnosis, m.treatment, m.record_date,
+       p.first_name, p.last_name, ft.[RANK]
+FROM CONTAINSTABLE(MedicalRecords, (diagnosis, treatment), ?, ?) ft
+JOIN MedicalRecords m ON m.record_id = ft.[KEY]
+JOIN Patients p ON p.patient_id = m.patient_id
+ORDER BY ft.[RANK] DESC
+""")
+
+CLAIM_SEARCH_QUERY = queries.cypher("search.claims", """
+CALL db.index.fulltext.queryNodes('claim_description', $condition, {limit: $limit})
+YIELD node, score
+OPTIONAL MATCH (node)-[:FILED_UNDER]->(p:InsurancePolicy)
+RETURN node.claim_id AS claim_id, node.description AS description, node.status AS status,
+       node.amount AS amount, node.policy_id AS policy_id, p.patient_id AS patient_id,
+       p.provider AS provider, score
+""")
+
+# Full-text DDL for rebuild_search_indexes
+REBUILD_CATALOG_STATEMENT = queries.sql("search.rebuild_catalog", """
+IF EXISTS (SELECT * FROM sys.fulltext_catalogs WHERE name = 'HospitalSearchCatalog')
+    ALTER FULLTEXT CATALOG HospitalSearchCatalog REBUILD
+""")
+
+DROP_CLAIM_INDEX_STATEMENT = queries.cypher("search.drop_claim_index", "DROP INDEX claim_description IF EXISTS")
+
+CREATE_CLAIM_INDEX_STATEMENT = queries.cypher(
+    "search.create_claim_index",
+    "CREATE FULLTEXT INDEX claim_description IF NOT EXISTS FOR (c:Claim) ON EACH [c.description]"
+)
+
+
+def search_hospital(terms, limit):
+    """Patients by name/email and medical records by diagnosis/treatment (SQL Server full-text)."""
+    hits = []
+    conn = get_sql_connection()
+    cursor = conn.cursor()
+    condition = sql_search_condition(terms)
+    try:
+        cursor.execute(PATIENT_SEARCH_QUERY, (condition, limit))
+        for patient_id, first_name, last_name, email, rank in cursor.fetchall():
+            hits.append({
+                "entity": "patient",
+                "id": str(patient_id),
+                "patient_id": patient_id,
+                "title": f"{first_name} {last_name}",
+                "snippet": email,
+                "raw_score": float(rank),
+                "context": {}
+            })
+
+        cursor.execute(MEDICAL_RECORD_SEARCH_QUERY, (condition, limit))
+        for record_id, patient_id, diagnosis, treatment, record_date, first_name, last_name, rank in cursor.fetchall():
+            hits.append({
+                "entity": "medical_record",
+                "id": str(record_id),
+                "patient_id": patient_id,
+                "title": diagnosis,
+                "snippet": (treatment or "")[:160],
+                "raw_score": float(rank),
+                "context": {
+                    "patient_name": f"{first_name} {last_name}",
+                    "record_date": record_date.isoformat() if record_date else None
+                }
+            })
+    finally:
+        cursor.close()
+        conn.close()
+    return hits
+
+
+def search_insurance(terms, limit):
+    """Claims by description (Neo4j full-text index), with the owning policy for context."""
+    neo4j_conn = Neo4jConnection()
+    result = neo4j_conn.query(
+        CLAIM_SEARCH_QUERY, {"condition": lucene_search_condition(terms), "limit": limit}, timeout=SEARCH_QUERY_TIMEOUT
+    )
+    neo4j_conn.close()
+
+    return [
+        {
+            "entity": "claim",
+            "id": row["claim_id"],
+            "patient_id": row["patient_id"],
+            "title": row["description"],
+            "snippet": None,
+            "raw_score": float(row["score"]),
+            "context": {
+                "policy_id": row["policy_id"],
+                "provider": row["provider"],
+                "status": row["status"],
+                "amount": row["amount"]
+            }
+        }
+        for row in result or []
+    ]
+
+
+# Scores from different engines are not comparable (a weak best hit in one store is not worth a strong
+# one in another), so hits are ranked within their own list and scored 1 / (RRF_K + rank)
+def _rank_scores(hits):
+    hits = sorted(hits, key=lambda hit: hit["raw_score"], reverse=True)
+    for rank, hit in enumerate(hits, 1):
+        del hit["raw_score"]
+        hit["score"] = round(1.0 / (RRF_K + rank), 6)
+    return hits
+
+
+def rebuild_search_indexes(progress=None):
+    """Rebuild the SQL Server full-text catalog and the Neo4j claim description index."""
+    conn = get_sql_connection()
+    # Full-text DDL cannot run inside a user transaction
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute(REBUILD_CATALOG_STATEMENT)
+    cursor.close()
+    conn.close()
+    if progress:
+        progress(0.5, "rebuilt hospital full-text catalog")
+
+    neo4j_conn = Neo4jConnection()
+    neo4j_conn.query(DROP_CLAIM_INDEX_STATEMENT)
+    neo4j_conn.query(CREATE_CLAIM_INDEX_STATEMENT)
+    neo4j_conn.close()
+    if progress:
+        progress(1.0, "rebuilt claim description index")
+    return {"indexes": ["HospitalSearchCatalog", "claim_description"]}
+
+
+async def federated_search(q, limit=20):
+    started = time.perf_counter()
+    terms = _terms(q)
+    if not terms:
+        return {"query": q, "took_ms": 0.0, "hits": []}
+
+    # Both stores are queried concurrently; a failing store only removes its own hits
+    results = await asyncio.gather(
+        asyncio.to_thread(search_hospital, terms, limit),
+        asyncio.to_thread(search_insurance, terms, limit),
+        return_exceptions=True
+    )
+    unavailable_sources = []
+    for index, (source, result) in enumerate(zip(("hospital", "insurance"), results)):
+        # Anything else is a bug (or a missing full-text index), not an outage, and is raised
+        if isinstance(result, BackendUnavailable):
+            unavailable_sources.append(source)
+            results[index] = []
+        elif isinstance(result, BaseException):
+            raise result
+    hospital_hits, insurance_hits = results
+
+    patient_hits = _rank_scores([h for h in hospital_hits if h["entity"] == "patient"])
+    record_hits = _rank_scores([h for h in hospital_hits if h["entity"] == "medical_record"])
+    claim_hits = _rank_scores(insurance_hits)
+
+    hits = heapq.nlargest(limit, patient_hits + record_hits + claim_hits, key=lambda h: h["score"])
+    return {
+        "query": q,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2),
+        "hits": hits,
+        "unavailable_sources": unavailable_sources
+    }
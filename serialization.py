@@ -0,0 +1,103 @@
+import json
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_TYPES = ("application/x-msgpack", "application/msgpack")
+ARROW_TYPE = "application/vnd.apache.arrow.stream"
+
+# Documents the alternative media types in the OpenAPI schema of list and batch routes
+BINARY_RESPONSES = {
+    200: {
+        "content": {
+            "application/x-msgpack": {},
+            ARROW_TYPE: {},
+        },
+        "description": "JSON by default; MessagePack or an Arrow IPC stream when requested with Accept.",
+    }
+}
+
+
+def _accepts(accept, media_types):
+    for part in accept.split(","):
+        media_type, _, params = part.strip().partition(";")
+        if media_type.strip().lower() in media_types and "q=0" not in params.replace(" ", "").split(";"):
+            return True
+    return False
+
+
+# pyarrow is imported on the first Arrow response rather than at startup
+def arrow_table(rows):
+    import pyarrow as pa
+    # Nested objects (doctor, provider, coverage details) have no fixed shape, so they travel as JSON text
+    flat = [
+        {key: json.dumps(value) if isinstance(value, (dict, list)) else value for key, value in row.items()}
+        for row in rows
+    ]
+    return pa.Table.from_pylist(flat)
+
+
+def encode_arrow(rows, metadata=None):
+    # A ColumnTable is converted column by column, without building a dict per row
+    table = rows.to_arrow() if hasattr(rows, "to_arrow") else arrow_table(rows)
+    if metadata:
+        table = table.replace_schema_metadata({key: json.dumps(value) for key, value in metadata.items()})
+    import pyarrow as pa
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _to_python(payload):
+    if isinstance(payload, BaseModel):
+        return payload.model_dump()
+    if isinstance(payload, list):
+        return [_to_python(item) for item in payload]
+    return payload
+
+
+def encode_msgpack(payload):
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+# "msgpack", "arrow" or None (JSON) for a request's Accept header
+def preferred_encoding(request):
+    accept = request.headers.get("accept", "")
+    if not accept or accept.startswith("application/json"):
+        return None
+    if msgpack is not None and _accepts(accept, MSGPACK_TYPES):
+        return "msgpack"
+    if _accepts(accept, (ARROW_TYPE,)):
+        return "arrow"
+    return None
+
+
+def arrow_response(rows, metadata=None):
+    return Response(content=encode_arrow(rows, metadata=metadata), media_type=ARROW_TYPE, headers={"Vary": "Accept"})
+
+
+def negotiate(request, payload):
+    """Return payload as MessagePack or Arrow when the Accept header asks for it, else unchanged (JSON)."""
+    encoding = preferred_encoding(request)
+
+    if encoding == "msgpack":
+        body = encode_msgpack(jsonable_encoder(payload))
+        return Response(content=body, media_type=MSGPACK_TYPES[0], headers={"Vary": "Accept"})
+
+    if encoding == "arrow":
+        # Native values, so dates become Arrow date columns rather than strings
+        data = _to_python(payload)
+        # Batch responses: items become the table, the other fields go into the schema metadata
+        if isinstance(data, dict):
+            rows = data.pop("items")
+            return arrow_response(rows, metadata=jsonable_encoder(data))
+        return arrow_response(data)
+
+    return payload
@@ -0,0 +1,38 @@
+import asyncio
+
+from metrics import metrics
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one shared in-flight computation."""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+
+    def _finished(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Retrieve the outcome so a failure nobody waited for is not reported as unhandled
+        if not task.cancelled() and task.exception() is not None:
+            metrics.increment(f"singleflight.{self.name}.errors")
+
+    async def do(self, key, fn):
+        task = self._calls.get(key)
+        if task is None:
+            metrics.increment(f"singleflight.{self.name}.executions")
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finished(key, t))
+        else:
+            metrics.increment(f"singleflight.{self.name}.coalesced")
+
+        # A waiter that is cancelled (client went away) must not cancel the shared work
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            metrics.increment(f"singleflight.{self.name}.waiter_cancelled")
+            raise
+
+    def in_flight(self):
+        return len(self._calls)
@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+import time
+
+from analytics import AnalyticsCache
+from export import EXPORT_DIR, WATERMARK_FILE
+
+# Dimensions callers may group by, mapped to expressions over the exported columns
+DIMENSIONS = {
+    "diagnosis": "diagnosis",
+    "provider": "provider",
+    "coverage_type": "coverage_type",
+    "status": "status",
+    "doctor_id": "doctor_id",
+    "patient_gender": "patient_gender",
+    "year": "CAST(year(coalesce(claim_date, record_date)) AS INTEGER)",
+    "quarter": "strftime(date_trunc('quarter', coalesce(claim_date, record_date)), '%Y') || '-Q' "
+               "|| CAST(quarter(coalesce(claim_date, record_date)) AS VARCHAR)",
+    "month": "strftime(coalesce(claim_date, record_date), '%Y-%m')",
+}
+
+METRICS = {
+    "claim_count": "count(claim_id)",
+    "total_amount": "round(coalesce(sum(amount), 0), 2)",
+    "avg_amount": "round(avg(amount), 2)",
+    "total_paid": "round(coalesce(sum(insurer_payment), 0), 2)",
+    "patient_count": "count(DISTINCT patient_id)",
+    "record_count": "count(DISTINCT record_id)",
+}
+
+
+class SnapshotUnavailable(Exception):
+    pass
+
+
+class SnapshotEngine:
+    """Read-only DuckDB view over the Parquet snapshot written by export.py."""
+
+    def __init__(self, snapshot_dir=EXPORT_DIR):
+        self.snapshot_dir = snapshot_dir
+        self._conn = None
+        self._lock = threading.Lock()
+        # Results only change when a new export lands, so they are cached per export run
+        self._results = AnalyticsCache(ttl=24 * 3600, max_entries=256)
+
+    def _connect(self):
+        with self._lock:
+            if self._conn is None:
+                # Imported on the first snapshot query rather than at startup
+                import duckdb
+                conn = duckdb.connect(":memory:")
+                # Keep Parquet footers and statistics cached between queries
+                conn.execute("SET enable_object_cache = true")
+                # Only finished partitions: export staging and swapped-out folders carry a suffix after the month
+                pattern = os.path.join(self.snapshot_dir, "record_month=????-??", "*.parquet").replace("'", "''")
+                try:
+                    conn.execute(f"""
+                    CREATE VIEW federated_claims AS
+                    SELECT * FROM read_parquet('{pattern}', hive_partitioning = true)
+                    """)
+                except duckdb.IOException as e:
+                    conn.close()
+                    raise SnapshotUnavailable(f"Analytics snapshot cannot be read: {e}") from e
+                self._conn = conn
+            return self._conn
+
+    def snapshot_info(self):
+        path = os.path.join(self.snapshot_dir, WATERMARK_FILE)
+        if not os.path.exists(path):
+            raise SnapshotUnavailable("No analytics snapshot found; run export.py first")
+        with open(path) as f:
+            return json.load(f)
+
+    def aggregate(self, group_by, metrics=None, start=None, end=None, status=None, limit=1000):
+        unknown = [d for d in group_by if d not in DIMENSIONS] + [m for m in metrics or [] if m not in METRICS]
+        if unknown:
+            raise ValueError(f"Unknown dimension or metric: {', '.join(unknown)}")
+        metrics = metrics or ["claim_count", "total_amount"]
+
+        select = [f"{DIMENSIONS[d]} AS {d}" for d in group_by] + [f"{METRICS[m]} AS {m}" for m in metrics]
+        where, params = [], []
+        if start:
+            where.append("coalesce(claim_date, record_date) >= CAST(? AS DATE)")
+            params.append(start)
+        if end:
+            where.append("coalesce(claim_date, record_date) < CAST(? AS DATE)")
+            params.append(end)
+        if status:
+            where.append("status = ?")
+            params.append(status)
+
+        sql = f"SELECT {', '.join(select)} FROM federated_claims"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if group_by:
+            sql += f" GROUP BY {', '.join(group_by)} ORDER BY {metrics[0]} DESC"
+        sql += f" LIMIT {int(limit)}"
+
+        info = self.snapshot_info()
+        key = (info.get("run_id"), sql, tuple(params))
+        started = time.perf_counter()
+        columns, rows = self._results.get(key, lambda: self._execute(sql, params))
+        return {
+            "columns": columns,
+            "rows": rows,
+            "snapshot": {"watermark": info.get("watermark"), "run_id": info.get("run_id")},
+            "took_ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+
+    def _execute(self, sql, params):
+        # Each thread gets its own cursor on the shared database
+        import duckdb
+        cursor = self._connect().cursor()
+        try:
+            result = cursor.execute(sql, params)
+            columns = [column[0] for column in result.description]
+            rows = [list(row) for row in result.fetchall()]
+        except duckdb.IOException as e:
+            # No partitions (yet), or a file removed or half-written underneath the query
+            raise SnapshotUnavailable(f"Analytics snapshot cannot be read: {e}") from e
+        finally:
+            cursor.close()
+        return columns, rows
+
+
+engine = SnapshotEngine()
@@ -0,0 +1,472 @@
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import threading
+from datetime import date, datetime
+
+import queries
+from columnar import ColumnTable
+from database import Neo4jConnection, Neo4jServer, SqlServer, neo4j_server, sql_server
+from metrics import metrics
+from patient_index import index as patient_index
+from resilience import BackendUnavailable
+
+# Catalog of hospital and insurer backends; without it the .env SQL Server and Neo4j are the only sources
+SOURCES_FILE = os.getenv("SOURCES_FILE", "sources.json")
+
+# Time a source gets to answer its part of a federated request, unless its catalog entry sets "timeout"
+SOURCE_TIMEOUT_SECONDS = float(os.getenv("SOURCE_TIMEOUT_SECONDS", "5"))
+
+# Exact name and date of birth matches for a patient the patient index has not seen yet
+PATIENTS_BY_DEMOGRAPHICS = queries.sql("sources.patients_by_demographics", """
+SELECT * FROM Patients
+WHERE UPPER(first_name) = UPPER(?) AND UPPER(last_name) = UPPER(?) AND date_of_birth = ?
+""")
+
+POLICIES_FOR_PATIENTS = queries.cypher("sources.policies_for_patients", """
+MATCH (p:InsurancePolicy) WHERE p.patient_id IN $patient_ids RETURN p
+""")
+
+CLAIMS_FOR_PATIENTS = queries.cypher("sources.claims_for_patients", """
+MATCH (c:Claim)-[:FILED_UNDER]->(p:InsurancePolicy)
+WHERE p.patient_id IN $patient_ids
+RETURN c
+ORDER BY c.claim_date, c.claim_id
+""")
+
+# Stand-in hospitals use the SQL Server table layout in SQLite
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS Patients (
+    patient_id INTEGER PRIMARY KEY,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    date_of_birth TEXT,
+    gender TEXT,
+    address TEXT,
+    phone TEXT,
+    email TEXT
+);
+CREATE TABLE IF NOT EXISTS MedicalRecords (
+    record_id INTEGER PRIMARY KEY,
+    patient_id INTEGER NOT NULL REFERENCES Patients(patient_id),
+    doctor_id INTEGER NOT NULL,
+    diagnosis TEXT,
+    treatment TEXT,
+    notes TEXT,
+    record_date TEXT
+);
+CREATE INDEX IF NOT EXISTS IX_MedicalRecords_patient ON MedicalRecords (patient_id, record_date, record_id);
+"""
+
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, (datetime, date)) else value
+
+
+def _row_dicts(cursor, rows):
+    columns = [column[0] for column in cursor.description]
+    return [{column: _iso(value) for column, value in zip(columns, row)} for row in rows]
+
+
+# Record lists can run to thousands of rows per patient, so they stay columnar until the response is built
+def _record_table(cursor, rows):
+    return ColumnTable.from_cursor(cursor, rows).convert("record_date", _iso).compact()
+
+
+def _placeholders(values):
+    return ", ".join("?" for _ in values)
+
+
+# ----- HOSPITAL SOURCES -----
+
+class HospitalSource:
+    kind = "hospital"
+    backend = None
+
+    def __init__(self, name, timeout=SOURCE_TIMEOUT_SECONDS):
+        self.name = name
+        self.timeout = timeout
+
+    def describe(self):
+        return {"name": self.name, "kind": self.kind, "backend": self.backend, "timeout": self.timeout}
+
+
+class SqlServerHospital(HospitalSource):
+    backend = "sqlserver"
+
+    def __init__(self, name, server, timeout=SOURCE_TIMEOUT_SECONDS):
+        super().__init__(name, timeout)
+        self.server = server
+
+    def _fetch(self, statement, params, build=_row_dicts):
+        conn = self.server.connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(statement, params)
+            return build(cursor, cursor.fetchall())
+        finally:
+            cursor.close()
+            conn.close()
+
+    def patients(self):
+        return self._fetch(queries.PATIENTS_ALL, ())
+
+    def patient(self, patient_id):
+        rows = self._fetch(queries.PATIENT_BY_ID, (patient_id,))
+        return rows[0] if rows else None
+
+    def find_patients(self, first_name, last_name, date_of_birth):
+        return self._fetch(PATIENTS_BY_DEMOGRAPHICS, (first_name, last_name, date_of_birth))
+
+    def medical_records(self, patient_ids):
+        statement = queries.MEDICAL_RECORDS_FOR_PATIENT.format(
+            text_columns="", where=f"patient_id IN ({_placeholders(patient_ids)})"
+        )
+        return self._fetch(statement, tuple(patient_ids), _record_table)
+
+
+class SqliteHospital(HospitalSource):
+    """Stand-in hospital backed by a local SQLite file, for running federation without more SQL Servers."""
+    backend = "sqlite"
+
+    def __init__(self, name, path, timeout=SOURCE_TIMEOUT_SECONDS):
+        super().__init__(name, timeout)
+        self.path = path
+
+    def _fetch(self, statement, params, build=_row_dicts):
+        try:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=self.timeout)
+        except sqlite3.Error as e:
+            raise BackendUnavailable(self.name, f"Cannot open {self.path}: {e}") from e
+        try:
+            cursor = conn.execute(statement, params)
+            return build(cursor, cursor.fetchall())
+        finally:
+            conn.close()
+
+    def patients(self):
+        return self._fetch("SELECT * FROM Patients", ())
+
+    def patient(self, patient_id):
+        rows = self._fetch("SELECT * FROM Patients WHERE patient_id = ?", (patient_id,))
+        return rows[0] if rows else None
+
+    def find_patients(self, first_name, last_name, date_of_birth):
+        return self._fetch(
+            "SELECT * FROM Patients WHERE first_name = ? COLLATE NOCASE AND last_name = ? COLLATE NOCASE "
+            "AND date_of_birth = ?",
+            (first_name, last_name, _iso(date_of_birth))
+        )
+
+    def medical_records(self, patient_ids):
+        return self._fetch(
+            "SELECT record_id, patient_id, doctor_id, diagnosis, record_date, "
+            "length(treatment) AS treatment_length, length(notes) AS notes_length "
+            f"FROM MedicalRecords WHERE patient_id IN ({_placeholders(patient_ids)}) "
+            "ORDER BY record_date, record_id",
+            tuple(patient_ids),
+            _record_table
+        )
+
+
+# ----- INSURER SOURCES -----
+
+class InsurerSource:
+    kind = "insurer"
+    backend = None
+
+    # patient_source names the hospital whose patient IDs this insurer's policies refer to
+    def __init__(self, name, patient_source, timeout=SOURCE_TIMEOUT_SECONDS):
+        self.name = name
+        self.patient_source = patient_source
+        self.timeout = timeout
+
+    def describe(self):
+        return {"name": self.name, "kind": self.kind, "backend": self.backend, "timeout": self.timeout,
+                "patient_source": self.patient_source}
+
+
+class Neo4jInsurer(InsurerSource):
+    backend = "neo4j"
+
+    def __init__(self, name, server, patient_source, timeout=SOURCE_TIMEOUT_SECONDS):
+        super().__init__(name, patient_source, timeout)
+        self.server = server
+
+    def coverage(self, patient_ids):
+        neo4j_conn = Neo4jConnection(self.server)
+        params = {"patient_ids": list(patient_ids)}
+        policies = ColumnTable.from_dicts(
+            dict(record["p"]) for record in neo4j_conn.query(POLICIES_FOR_PATIENTS, params, timeout=self.timeout)
+        )
+        claims = ColumnTable.from_dicts(
+            dict(record["c"]) for record in neo4j_conn.query(CLAIMS_FOR_PATIENTS, params, timeout=self.timeout)
+        )
+        neo4j_conn.close()
+        return {"policies": policies, "claims": claims.compact()}
+
+
+class JsonInsurer(InsurerSource):
+    """Stand-in insurer read from a JSON file of {"policies": [...], "claims": [...]}."""
+    backend = "json"
+
+    def __init__(self, name, path, patient_source, timeout=SOURCE_TIMEOUT_SECONDS):
+        super().__init__(name, patient_source, timeout)
+        self.path = path
+        self._loaded = (None, None)
+        self._lock = threading.Lock()
+
+    # Re-read only when the file has changed
+    def _data(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            raise BackendUnavailable(self.name, f"Cannot read {self.path}: {e}") from e
+        with self._lock:
+            if self._loaded[0] != mtime:
+                with open(self.path) as f:
+                    self._loaded = (mtime, json.load(f))
+            return self._loaded[1]
+
+    def coverage(self, patient_ids):
+        data = self._data()
+        patient_ids = set(patient_ids)
+        policies = [policy for policy in data.get("policies", []) if policy["patient_id"] in patient_ids]
+        policy_ids = {policy["policy_id"] for policy in policies}
+        claims = sorted((claim for claim in data.get("claims", []) if claim["policy_id"] in policy_ids),
+                        key=lambda claim: (claim["claim_date"], claim["claim_id"]))
+        return {"policies": ColumnTable.from_dicts(policies), "claims": ColumnTable.from_dicts(claims).compact()}
+
+
+# ----- CATALOG -----
+
+class SourceCatalog:
+    def __init__(self, sources):
+        self.sources = {source.name: source for source in sources}
+
+    # The hospital served by the .env SQL Server, whose patients the /patients routes create
+    @property
+    def primary_hospital(self):
+        for source in self.hospitals:
+            if getattr(source, "server", None) is sql_server:
+                return source.name
+        return None
+
+    @property
+    def hospitals(self):
+        return [source for source in self.sources.values() if source.kind == "hospital"]
+
+    @property
+    def insurers(self):
+        return [source for source in self.sources.values() if source.kind == "insurer"]
+
+    def hospital(self, name):
+        source = self.sources.get(name)
+        if source is None or source.kind != "hospital":
+            raise KeyError(name)
+        return source
+
+    def describe(self):
+        return [source.describe() for source in self.sources.values()]
+
+    def close(self):
+        for source in self.sources.values():
+            server = getattr(source, "server", None)
+            # The .env backends belong to database.close_connections()
+            if isinstance(server, SqlServer) and server is not sql_server:
+                server.pool.clear()
+            elif isinstance(server, Neo4jServer) and server is not neo4j_server:
+                server.close()
+
+
+def _source_from_entry(entry):
+    name, backend = entry["name"], entry["backend"]
+    timeout = float(entry.get("timeout", SOURCE_TIMEOUT_SECONDS))
+    if backend == "sqlserver":
+        prefix = entry.get("env_prefix", "SQL")
+        server = sql_server if prefix == "SQL" else SqlServer(name, prefix)
+        return SqlServerHospital(name, server, timeout)
+    if backend == "sqlite":
+        return SqliteHospital(name, entry["path"], timeout)
+    if backend == "neo4j":
+        prefix = entry.get("env_prefix", "NEO4J")
+        server = neo4j_server if prefix == "NEO4J" else Neo4jServer(name, prefix)
+        return Neo4jInsurer(name, server, entry["patient_source"], timeout)
+    if backend == "json":
+        return JsonInsurer(name, entry["path"], entry["patient_source"], timeout)
+    raise ValueError(f"Unknown backend {backend!r} for source {name!r}")
+
+
+def load_catalog(path=SOURCES_FILE):
+    """Sources from the catalog file, or the .env SQL Server and Neo4j when there is none."""
+    if not os.path.exists(path):
+        return SourceCatalog([
+            SqlServerHospital("hospital", sql_server),
+            Neo4jInsurer("insurer", neo4j_server, patient_source="hospital")
+        ])
+    with open(path) as f:
+        entries = json.load(f)["sources"]
+    catalog = SourceCatalog([_source_from_entry(entry) for entry in entries])
+    hospitals = {source.name for source in catalog.hospitals}
+    for insurer in catalog.insurers:
+        if insurer.patient_source not in hospitals:
+            raise ValueError(f"Insurer {insurer.name!r} refers to unknown hospital {insurer.patient_source!r}")
+    return catalog
+
+
+catalog = load_catalog()
+
+
+# ----- FAN-OUT -----
+
+# Run call(source) on every source in parallel, each within its own timeout;
+# returns ({source name: result}, [names of sources that were down or too slow])
+async def fan_out(sources, call):
+    async def run(source):
+        return await asyncio.wait_for(asyncio.to_thread(call, source), source.timeout)
+
+    results = await asyncio.gather(*(run(source) for source in sources), return_exceptions=True)
+    answered, unavailable = {}, []
+    for source, result in zip(sources, results):
+        # A timed-out call keeps its worker thread until the backend answers, but the request moves on
+        if isinstance(result, (BackendUnavailable, asyncio.TimeoutError, sqlite3.Error)):
+            print(f"Source {source.name} unavailable: {result!r}")
+            metrics.increment(f"sources.{source.name}.unavailable")
+            unavailable.append(source.name)
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            answered[source.name] = result
+    return answered, unavailable
+
+
+async def resolve_patient(source_name, patient_id):
+    """The patient at one hospital plus their patient IDs at every hospital, from the patient index."""
+    home = catalog.hospital(source_name)
+    found, unavailable = await fan_out([home], lambda source: source.patient(patient_id))
+    if unavailable:
+        raise BackendUnavailable(source_name, f"{source_name} did not answer")
+    patient = found[source_name]
+    if patient is None:
+        return None, None, {}, []
+
+    master_id = patient_index.master_id(source_name, patient_id)
+    pending = patient_index.unmatched_sources(source_name, patient_id) if master_id is not None else ()
+    if master_id is None or pending:
+        # Not indexed yet, or some hospitals were down when it was: index it along with any exact
+        # matches held by the other hospitals (only those not searched yet, on a retry)
+        others = [source for source in catalog.hospitals
+                  if source is not home and (master_id is None or source.name in pending)]
+        matches, unavailable = await fan_out(others, lambda source: source.find_patients(
+            patient["first_name"], patient["last_name"], patient["date_of_birth"]
+        ))
+        records = [(name, row) for name, rows in matches.items() for row in rows]
+        if master_id is None:
+            records.insert(0, (source_name, patient))
+        # Hospitals that were down are searched again on the next request
+        await asyncio.to_thread(patient_index.add_many, records, {(source_name, patient_id): unavailable})
+        master_id = patient_index.master_id(source_name, patient_id)
+    identities = {name: ids for name, ids in patient_index.members(master_id).items() if name in catalog.sources}
+    return patient, master_id, identities, unavailable
+
+
+async def federated_patient(source_name, patient_id):
+    """A patient's records from every hospital that knows them and coverage from every insurer."""
+    patient, master_id, identities, unavailable = await resolve_patient(source_name, patient_id)
+    if patient is None:
+        return None
+
+    hospitals = [catalog.hospital(name) for name in identities]
+    insurers = [insurer for insurer in catalog.insurers if insurer.patient_source in identities]
+    (records, records_unavailable), (coverage, coverage_unavailable) = await asyncio.gather(
+        fan_out(hospitals, lambda source: source.medical_records(identities[source.name])),
+        fan_out(insurers, lambda source: source.coverage(identities[source.patient_source]))
+    )
+    unavailable += records_unavailable + coverage_unavailable
+    return {
+        "patient": patient,
+        "master_id": master_id,
+        "identities": identities,
+        "medical_records": records,
+        "coverage": coverage,
+        "unavailable_sources": unavailable
+    }
+
+
+def rebuild_patient_index(progress=None):
+    """Match every patient at every hospital in the catalog from scratch (the patient_index job)."""
+    records = []
+    for source in catalog.hospitals:
+        records.extend((source.name, patient) for patient in source.patients())
+        if progress:
+            progress(0.0, f"read patients from {source.name}")
+    return patient_index.rebuild(records, progress)
+
+
+# ----- LOCAL STAND-INS -----
+
+STANDIN_PATIENTS = [
+    ("Sarah", "Nguyen", "1995-09-12", "Female", "654 Birch Street, Northside", "555-666-7878", "snguyen@email.com"),
+    ("Luis", "Rodriguez", "1978-03-25", "Male", "987 Elm Road, Southport", "555-777-8989", "lrodriguez@email.com"),
+    ("Emily", "Thompson", "1990-12-08", "Female", "159 Willow Way, Centertown", "555-888-9090",
+     "ethompson@email.com"),
+    ("Omar", "Ahmed", "1983-05-19", "Male", "753 Aspen Court, Hillcrest", "555-999-0101", "oahmed@email.com"),
+]
+
+
+def create_standins(directory):
+    """Write two SQLite hospitals and a JSON insurer sharing patients, plus a catalog file that uses them."""
+    os.makedirs(directory, exist_ok=True)
+    diagnoses = ["Hypertension", "Asthma", "Migraine", "Back Pain"]
+    # Each hospital numbers its patients differently, so identities have to be resolved
+    for index, name in enumerate(("hospital_b", "hospital_c")):
+        conn = sqlite3.connect(os.path.join(directory, f"{name}.sqlite3"))
+        conn.executescript(SQLITE_SCHEMA)
+        for offset, patient in enumerate(STANDIN_PATIENTS[index:index + 3]):
+            patient_id = 100 * (index + 1) + offset
+            conn.execute("INSERT OR REPLACE INTO Patients VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (patient_id, *patient))
+            conn.execute(
+                "INSERT OR REPLACE INTO MedicalRecords VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (patient_id, patient_id, index + 1, diagnoses[offset], "Follow-up in six weeks",
+                 f"Seen at {name}", f"2024-0{offset + 1}-15")
+            )
+        conn.commit()
+        conn.close()
+
+    insurer = {
+        "policies": [
+            {"policy_id": f"JS{patient_id}", "patient_id": patient_id, "provider": "Standin Mutual",
+             "policy_number": f"SM{patient_id}", "coverage_type": "Individual", "start_date": "2024-01-01",
+             "end_date": "2024-12-31", "coverage_details": {"deductible": 500, "coverage_percentage": 80}}
+            for patient_id in (100, 101, 102)
+        ],
+        "claims": [
+            {"claim_id": f"JSC{patient_id}", "policy_id": f"JS{patient_id}", "record_id": patient_id,
+             "claim_date": "2024-02-01", "amount": 120.0, "status": "Approved", "description": "Office visit"}
+            for patient_id in (100, 101, 102)
+        ]
+    }
+    with open(os.path.join(directory, "insurer_b.json"), "w") as f:
+        json.dump(insurer, f, indent=2)
+
+    entries = [
+        {"name": "hospital", "backend": "sqlserver"},
+        {"name": "insurer", "backend": "neo4j", "patient_source": "hospital"},
+        {"name": "hospital_b", "backend": "sqlite",
+         "path": os.path.join(directory, "hospital_b.sqlite3"), "timeout": 2},
+        {"name": "hospital_c", "backend": "sqlite",
+         "path": os.path.join(directory, "hospital_c.sqlite3"), "timeout": 2},
+        {"name": "insurer_b", "backend": "json",
+         "path": os.path.join(directory, "insurer_b.json"), "patient_source": "hospital_b", "timeout": 2},
+    ]
+    path = os.path.join(directory, "sources.json")
+    with open(path, "w") as f:
+        json.dump({"sources": entries}, f, indent=2)
+    print(f"Stand-in sources written; start the API with SOURCES_FILE={path}")
+    return path
+
+
+if __name__ == "__main__":
+    create_standins(sys.argv[1] if len(sys.argv) > 1 else "standins")
\ No newline at end of file
@@ -3,6 +3,46 @@ import datetime
 import random
 import logging
 
+# Bump whenever create_hospital_database changes, so existing databases apply it on their next start
+SCHEMA_VERSION = 9
+
+
+def schema_version():
+    """Schema version recorded in the hospital database (0 when none has been recorded)."""
+    conn = get_sql_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+    IF OBJECT_ID('SchemaVersion') IS NULL
+        SELECT CAST(0 AS INT)
+    ELSE
+        SELECT COALESCE(MAX(version), 0) FROM SchemaVersion WHERE component = 'hospital'
+    """)
+    version = cursor.fetchone()[0]
+    cursor.close()
+    conn.close()
+    return version
+
+
+def ensure_hospital_schema():
+    """Apply the hospital schema only when the recorded version is older than SCHEMA_VERSION."""
+    if schema_version() >= SCHEMA_VERSION:
+        return False
+    create_hospital_database()
+
+    conn = get_sql_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+    MERGE SchemaVersion AS target
+    USING (SELECT 'hospital' AS component) AS source ON target.component = source.component
+    WHEN MATCHED THEN UPDATE SET version = ?, applied_at = SYSUTCDATETIME()
+    WHEN NOT MATCHED THEN INSERT (component, version) VALUES ('hospital', ?);
+    """, (SCHEMA_VERSION, SCHEMA_VERSION))
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print(f"Hospital schema upgraded to version {SCHEMA_VERSION}.")
+    return True
+
 
 def create_hospital_database():
     """Create all necessary tables for the hospital database if they don't exist."""
@@ -59,12 +99,153 @@ def create_hospital_database():
     END
     """)
 
+    # Last-modified timestamps used by incremental exports
+    for table in ("Patients", "MedicalRecords"):
+        cursor.execute(f"""
+        IF COL_LENGTH('{table}', 'modified_at') IS NULL
+        BEGIN
+            ALTER TABLE {table} ADD modified_at DATETIME2 NOT NULL
+                CONSTRAINT DF_{table}_modified_at DEFAULT SYSUTCDATETIME() WITH VALUES
+        END
+        """)
+        # Row versions behind the ETags of the read routes
+        cursor.execute(f"""
+        IF COL_LENGTH('{table}', 'row_version') IS NULL
+        BEGIN
+            ALTER TABLE {table} ADD row_version ROWVERSION
+        END
+        """)
+        cursor.execute(f"""
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_{table}_modified_at')
+        BEGIN
+            EXEC('CREATE INDEX IX_{table}_modified_at ON {table} (modified_at)')
+        END
+        """)
+
+    # Indexes behind the date-windowed record listings and patient timelines
+    cursor.execute("""
+    IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_MedicalRecords_patient_date')
+    BEGIN
+        CREATE INDEX IX_MedicalRecords_patient_date
+        ON MedicalRecords (patient_id, record_date, record_id) INCLUDE (doctor_id, diagnosis)
+    END
+    """)
+    cursor.execute("""
+    IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_MedicalRecords_record_date')
+    BEGIN
+        CREATE INDEX IX_MedicalRecords_record_date
+        ON MedicalRecords (record_date, record_id) INCLUDE (patient_id, doctor_id, diagnosis)
+    END
+    """)
+
+    # Index used by the shared doctor/diagnosis cluster analytics
+    cursor.execute("""
+    IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_MedicalRecords_doctor_diagnosis')
+    BEGIN
+        CREATE INDEX IX_MedicalRecords_doctor_diagnosis
+        ON MedicalRecords (doctor_id, diagnosis) INCLUDE (patient_id)
+    END
+    """)
+
+    # Cross-store events written in the same transaction as the change that caused them
+    cursor.execute("""
+    IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'FederationOutbox')
+    BEGIN
+        CREATE TABLE FederationOutbox (
+            event_id BIGINT PRIMARY KEY IDENTITY(1,1),
+            event_type VARCHAR(50) NOT NULL,
+            payload NVARCHAR(MAX) NOT NULL,
+            created_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+            dispatched_at DATETIME2 NULL,
+            attempts INT NOT NULL DEFAULT 0,
+            last_error NVARCHAR(4000) NULL
+        )
+        CREATE INDEX IX_FederationOutbox_pending ON FederationOutbox (event_id)
+            WHERE dispatched_at IS NULL
+    END
+    """)
+
+    # Months that lost a record (deleted, or moved to another month) since the last export; written by
+    # OUTPUT clauses of the record update and delete statements, pruned by export.py after each run
+    cursor.execute("""
+    IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'ExportTombstones')
+    BEGIN
+        CREATE TABLE ExportTombstones (
+            record_month DATE NULL,
+            changed_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
+        )
+        CREATE INDEX IX_ExportTombstones_changed_at ON ExportTombstones (changed_at) INCLUDE (record_month)
+    END
+    """)
+
+    # Written on the primary every few seconds; how old a replica's copy is gives its replication lag
+    cursor.execute("""
+    IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'ReplicaHeartbeat')
+    BEGIN
+        CREATE TABLE ReplicaHeartbeat (
+            id INT PRIMARY KEY,
+            beat_at FLOAT NOT NULL
+        )
+    END
+    """)
+
+    # Schema version checked on startup, so unchanged databases skip all of the above
+    cursor.execute("""
+    IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'SchemaVersion')
+    BEGIN
+        CREATE TABLE SchemaVersion (
+            component VARCHAR(50) PRIMARY KEY,
+            version INT NOT NULL,
+            applied_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
+        )
+    END
+    """)
+
     conn.commit()
     print("Database tables created or already exist.")
 
     cursor.close()
     conn.close()
 
+    create_search_indexes()
+
+
+def create_search_indexes():
+    """Create the full-text catalog and indexes used by /search, if full-text search is installed."""
+    conn = get_sql_connection()
+    # Full-text DDL cannot run inside a user transaction
+    conn.autocommit = True
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT FULLTEXTSERVICEPROPERTY('IsFullTextInstalled')")
+    if not cursor.fetchone()[0]:
+        print("Full-text search is not installed; /search will only return claim hits.")
+        cursor.close()
+        conn.close()
+        return
+
+    cursor.execute("""
+    IF NOT EXISTS (SELECT * FROM sys.fulltext_catalogs WHERE name = 'HospitalSearchCatalog')
+        CREATE FULLTEXT CATALOG HospitalSearchCatalog AS DEFAULT
+    """)
+
+    # Full-text indexes are keyed on the (system-named) primary key index of each table
+    for table, columns in (("Patients", "first_name, last_name, email"),
+                           ("MedicalRecords", "diagnosis, treatment")):
+        cursor.execute(f"""
+        IF NOT EXISTS (SELECT * FROM sys.fulltext_indexes WHERE object_id = OBJECT_ID('{table}'))
+        BEGIN
+            DECLARE @pk SYSNAME = (SELECT name FROM sys.indexes
+                                   WHERE object_id = OBJECT_ID('{table}') AND is_primary_key = 1)
+            EXEC('CREATE FULLTEXT INDEX ON {table} ({columns}) KEY INDEX ' + @pk
+                 + ' ON HospitalSearchCatalog WITH CHANGE_TRACKING AUTO')
+        END
+        """)
+
+    print("Full-text search indexes created or already exist.")
+    cursor.close()
+    conn.close()
+
 
 def insert_hospital_data():
     """Insert sample data into the hospital database."""
@@ -223,6 +404,14 @@ def insert_hospital_data():
         conn.close()
         return
 
+    # Sample records are only generated once, so seeding can be repeated safely
+    cursor.execute("SELECT COUNT(*) FROM MedicalRecords")
+    if cursor.fetchone()[0] > 0:
+        print("Medical records already present; skipping sample records.")
+        cursor.close()
+        conn.close()
+        return
+
     # Get actual patient and doctor IDs from the database
     cursor.execute("SELECT patient_id FROM Patients")
     patient_ids = [row[0] for row in cursor.fetchall()]
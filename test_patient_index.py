@@ -0,0 +1,64 @@
+import pytest
+
+import patient_index
+from patient_index import PatientIndex, jaro_winkler, match_score, normalize, MATCH_THRESHOLD
+
+
+def patient(patient_id, first_name, gender="Female", last_name="Smith", date_of_birth="1990-04-12",
+            phone="555-123-4567", email=None):
+    return {"patient_id": patient_id, "first_name": first_name, "last_name": last_name, "gender": gender,
+            "date_of_birth": date_of_birth, "phone": phone, "email": email}
+
+
+@pytest.fixture
+def index(tmp_path):
+    return PatientIndex(str(tmp_path / "patient_index.sqlite3"))
+
+
+def test_twins_sharing_a_household_phone_are_not_merged():
+    a, b = normalize(patient(1, "Anna")), normalize(patient(2, "Emma"))
+    assert match_score(a, b) < MATCH_THRESHOLD
+
+
+def test_different_genders_never_match():
+    a = normalize(patient(1, "Mark", gender="Male"))
+    b = normalize(patient(2, "Mary", gender="Female"))
+    assert match_score(a, b) == 0.0
+
+
+def test_same_person_across_hospitals_still_matches():
+    a = normalize(patient(1, "Katherine", gender="F"))
+    b = normalize(patient(2, "Catherine", gender="female"))
+    assert match_score(a, b) >= MATCH_THRESHOLD
+
+
+def test_unknown_gender_does_not_veto():
+    a = normalize(patient(1, "Jon", gender=None))
+    b = normalize(patient(2, "John", gender="Male"))
+    assert match_score(a, b) >= MATCH_THRESHOLD
+
+
+def test_index_keeps_twins_apart(index):
+    index.add("hospital_a", patient(1, "Anna"))
+    index.add("hospital_b", patient(2, "Emma"))
+    index.add("hospital_b", patient(3, "Mark", gender="Male"))
+    index.add("hospital_a", patient(4, "Mary"))
+    assert index.master_id("hospital_a", 1) != index.master_id("hospital_b", 2)
+    assert index.master_id("hospital_b", 3) != index.master_id("hospital_a", 4)
+
+
+def test_unmatched_sources_survive_a_reload_until_searched(index):
+    index.add_many([("hospital_a", patient(1, "Anna"))], {("hospital_a", 1): ["hospital_b"]})
+    assert PatientIndex(index.db_path).unmatched_sources("hospital_a", 1) == ("hospital_b",)
+    # Re-indexing the record keeps the pending search; a completed search clears it
+    index.add("hospital_a", patient(1, "Anna"))
+    index.add_many([("hospital_b", patient(7, "Anna"))], {("hospital_a", 1): []})
+    assert PatientIndex(index.db_path).unmatched_sources("hospital_a", 1) == ()
+    assert index.master_id("hospital_b", 7) == index.master_id("hospital_a", 1)
+
+
+def test_pure_python_jaro_winkler_skips_the_prefix_boost_below_0_7(monkeypatch):
+    monkeypatch.setattr(patient_index, "_rapidfuzz_jaro_winkler", None)
+    # Jaro similarity 0.5 despite the common "m": no prefix boost, as in rapidfuzz
+    assert jaro_winkler("mark", "mxyz") == pytest.approx(0.5)
+    assert jaro_winkler("martha", "marhta") == pytest.approx(0.9611, abs=1e-4)